@@ -1,3 +1,4 @@
+import helpers as h
 import mt_thresholds
 import pandas as pd
 
@@ -107,7 +108,11 @@ def format_accuracy_matrix_data(dic: dict):
 
     return llm_scores
 
-def accuracy_matrix(df, writer, sheet_name="accuracy_matrix"):
+def accuracy_matrix(df, workbook, sheet_name="accuracy_matrix", formats=None):
+    """
+    Write the difference matrices of `df` (systems x metrics) to a new sheet.
+    Rows are written top to bottom, so this also works on constant-memory workbooks.
+    """
     def shade_from_prob(prob: float):
         """Return RGB color based on probability thresholds (discrete bins)."""
         if prob > 0.99:        # Virtually certain
@@ -125,10 +130,8 @@ def accuracy_matrix(df, writer, sheet_name="accuracy_matrix"):
         else:                  # Unlikely (< 33%)
             return 249, 211, 2    # yellowish-orange
 
-    # Use provided writer, do not create a new file
-    workbook  = writer.book
+    formats = formats or h.FormatCache(workbook)
     worksheet = workbook.add_worksheet(sheet_name)
-    writer.sheets[sheet_name] = worksheet
     worksheet.set_column(0, len(df) * len(df.columns), 20)
 
     # Legend with shaded text cells
@@ -146,17 +149,16 @@ def accuracy_matrix(df, writer, sheet_name="accuracy_matrix"):
     for i, (text, prob) in enumerate(legend_text):
         r, g, b = shade_from_prob(prob)
         color = f'#{r:02x}{g:02x}{b:02x}'
-        fmt = workbook.add_format({'bg_color': color, 'border': 1})
+        fmt = formats.get({'bg_color': color, 'border': 1})
         worksheet.write(i + 1, 0, text, fmt)  # Shaded legend text in column A
 
     row_offset = len(legend_text) + 3  # Extra space after legend
 
     for metric_name in df.columns:
         worksheet.write(row_offset, 0, f"{metric_name} Difference Matrix")
+        worksheet.write_row(row_offset, 1, list(df.index))
         for i, row_llm in enumerate(df.index):
             worksheet.write(row_offset + i + 1, 0, row_llm)
-            worksheet.write(row_offset, i + 1, row_llm)
-        for i, row_llm in enumerate(df.index):
             for j, col_llm in enumerate(df.index):
                 if row_llm == col_llm:
                     continue
@@ -164,7 +166,7 @@ def accuracy_matrix(df, writer, sheet_name="accuracy_matrix"):
                 prob = mt_thresholds.accuracy(diff, metric_name) / 100
                 r, g, b = shade_from_prob(prob)
                 color = f'#{r:02x}{g:02x}{b:02x}'
-                fmt = workbook.add_format({
+                fmt = formats.get({
                     'bg_color': color,
                     'align': 'center',
                     'valign': 'vcenter',
@@ -0,0 +1,163 @@
+"""
+Non-interactive evaluation of many jobs described in a JSON or YAML manifest:
+
+    python batch.py nightly.yaml [--gateway http://host:5000] [--workers 4]
+
+    gateway: http://127.0.0.1:5000
+    output_dir: nightly          # optional, default: next to each job's source/reference file
+    concurrency: {xcometxl: 1}   # optional, requests in flight per gateway service
+    defaults:                    # optional, applied to every job
+      language: de
+      metrics: [bertscore, bleurt20, xcometxl, sacrebleu]
+    jobs:
+      - name: flores-de
+        source: flores.lb
+        reference: flores.de
+        systems: [baseline.de, ckpt-1000.de]   # or {name: path}; the first one is the baseline
+
+Relative paths are resolved against the manifest's folder. Files shared by several
+jobs are loaded once, all jobs are scored concurrently against the gateway and
+each job gets its own results folder.
+"""
+import argparse
+from client import run_evaluation
+from concurrent.futures import ThreadPoolExecutor
+from corpus import Corpus
+import json
+import metrics as m
+import os
+import sys
+
+try:
+    import yaml
+except ImportError:  # only needed for YAML manifests
+    yaml = None
+
+METRICS = ["luxembedder", "bertscore", "bleurt20", "xcometxl", "sacrebleu"]  # same order as luxeval
+QUALITY_ESTIMATION_METRICS = {"luxembedder"}
+BERTSCORE_LANGS = {"en", "de", "fr", "es", "zh", "ja", "ru", "pt"}
+
+def read_manifest(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        if os.path.splitext(path)[1].lower() in {".yaml", ".yml"}:
+            if yaml is None:
+                raise ImportError("PyYAML is required for YAML manifests (pip install pyyaml), or use JSON.")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def load_jobs(manifest: dict, base_dir: str) -> list:
+    """Validate the manifest and return one normalised dict per job, before anything is scored."""
+    def resolve(path):
+        return os.path.normpath(os.path.join(base_dir, os.path.expanduser(str(path)))) if path else None
+
+    defaults = manifest.get("defaults", {})
+    jobs, names = [], set()
+    for i, spec in enumerate(manifest.get("jobs") or []):
+        job = {**defaults, **spec}
+        name = str(job.get("name") or f"job_{i + 1}")
+        if name in names:
+            raise ValueError(f"Duplicate job name '{name}'.")
+        names.add(name)
+
+        language = str(job.get("language", "")).strip().lower()
+        if len(language) != 2:
+            raise ValueError(f"{name}: language code should be 2 letters (ISO 639-1), got '{language}'.")
+
+        metrics = job.get("metrics") or []
+        unknown = [metric for metric in metrics if metric not in METRICS]
+        if not metrics or unknown:
+            raise ValueError(f"{name}: metrics must be a non-empty list of {', '.join(METRICS)}; unknown: {unknown}")
+        if "bertscore" in metrics and language not in BERTSCORE_LANGS:
+            print(f"Warning: {name}: '{language}' may not be supported by BERTScore.")
+
+        systems = job.get("systems") or {}
+        if isinstance(systems, list):
+            systems = {os.path.splitext(os.path.basename(path))[0]: path for path in systems}
+        systems = {system: resolve(path) for system, path in systems.items()}
+        if not systems:
+            raise ValueError(f"{name}: no systems given.")
+
+        source, reference = resolve(job.get("source")), resolve(job.get("reference"))
+        if any(metric in QUALITY_ESTIMATION_METRICS for metric in metrics) and not source:
+            raise ValueError(f"{name}: a source file is required for quality estimation metrics (e.g., luxembedder).")
+        if any(metric not in QUALITY_ESTIMATION_METRICS for metric in metrics) and not reference:
+            raise ValueError(f"{name}: a reference file is required for reference-based metrics (e.g., BERTScore, SacreBLEU, BLEURT20).")
+        for path in [source, reference, *systems.values()]:
+            if path and not os.path.exists(path):
+                raise ValueError(f"{name}: {path} does not exist.")
+
+        output_dir = resolve(job.get("output_dir") or manifest.get("output_dir"))
+        jobs.append({
+            "name": name,
+            "language": language,
+            "metric_flags": {metric: metric in metrics for metric in METRICS},
+            "systems": systems,
+            "source": source,
+            "reference": reference,
+            "directory": output_dir or os.path.dirname(source or reference),
+        })
+    if not jobs:
+        raise ValueError("The manifest has no jobs.")
+    return jobs
+
+def bar_count(job: dict) -> int:
+    """Number of progress bars `metrics.score_all` shows for a job."""
+    return sum(1 if m.metric_config[metric]["multi_system"] else len(job["systems"])
+               for metric, enabled in job["metric_flags"].items() if enabled)
+
+def run_batch(manifest_path: str, gateway: str = None, workers: int = None) -> dict:
+    """
+    Run every job of the manifest. Returns {job name: {"status": "ok", "results": folder}
+    or {"status": "failed", "error": message}}, which is also written to
+    batch_summary.json in the manifest's output_dir (if any).
+    """
+    manifest = read_manifest(manifest_path)
+    jobs = load_jobs(manifest, os.path.dirname(os.path.abspath(manifest_path)))
+    gateway = gateway or manifest.get("gateway")
+    if not gateway:
+        raise ValueError("No gateway URL given (manifest 'gateway' or --gateway).")
+
+    # Files shared by several jobs are mapped once (see corpus.load)
+    corpora = [Corpus(job["systems"], job["source"], job["reference"]) for job in jobs]
+
+    # All jobs share the per-service limits, so the gateway sees one queue
+    semaphores = m.service_semaphores(manifest.get("concurrency"))
+    positions = [sum(bar_count(job) for job in jobs[:i]) for i in range(len(jobs))]
+
+    def run(job, corpus, position):
+        return run_evaluation(corpus, job["metric_flags"], job["language"], gateway, job["directory"],
+                              folder_name=job["name"], parquet=manifest.get("parquet", True),
+                              semaphores=semaphores, position=position)
+
+    summary = {}
+    with ThreadPoolExecutor(max_workers=workers or len(jobs)) as executor:
+        futures = [executor.submit(run, job, corpus, position) for job, corpus, position in zip(jobs, corpora, positions)]
+        for job, future in zip(jobs, futures):
+            try:
+                summary[job["name"]] = {"status": "ok", "results": future.result()}
+            except Exception as e:
+                summary[job["name"]] = {"status": "failed", "error": str(e)}
+
+    print("\nBatch summary:")
+    for name, outcome in summary.items():
+        print(f"  {name}: {outcome.get('results') or 'FAILED - ' + outcome['error']}")
+
+    if manifest.get("output_dir"):
+        output_dir = os.path.join(os.path.dirname(os.path.abspath(manifest_path)), os.path.expanduser(manifest["output_dir"]))
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, "batch_summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the evaluation jobs of a JSON/YAML manifest without prompts.")
+    parser.add_argument("manifest", help="path of the .json/.yaml manifest")
+    parser.add_argument("--gateway", help="gateway URL, overrides the manifest's 'gateway'")
+    parser.add_argument("--workers", type=int, default=None, help="jobs evaluated at the same time (default: all)")
+    args = parser.parse_args()
+
+    summary = run_batch(args.manifest, gateway=args.gateway, workers=args.workers)
+    sys.exit(0 if all(outcome["status"] == "ok" for outcome in summary.values()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
 import accuracy_matrice as am
+import argparse
 from argparse import Namespace
-import helpers as h
+from corpus import Corpus
+import exporter
 import metrics as m
 import os
 import paired_bs_test as pbt
-import pandas as pd
 import plotter
-from sacrebleu.metrics import BLEU, CHRF, TER
+import run_state
 import sys
 
 def luxeval(sacrebleu: bool, 
@@ -14,7 +15,9 @@ def luxeval(sacrebleu: bool,
               comet: bool,
               bertscore: bool, 
               luxembedder: bool, 
-              ip_url: str):
+              ip_url: str,
+              concurrency: dict = None,
+              parquet: bool = True):
 
     quality_estimation_metrics = {
         "luxembedder": luxembedder,
@@ -28,13 +31,6 @@ def luxeval(sacrebleu: bool,
     
     metric_flags = {**quality_estimation_metrics, **reference_based_metrics}
 
-    # Prepping dict with individual routes for the flask calls
-    url_dict = {}
-    ip_url = ip_url.strip("/")
-    for metric, enabled in metric_flags.items():
-        if enabled:
-            url_dict[metric] = f"{ip_url}/{metric}"
-
     # ========================
     # 1. Ask for language code
     # ========================
@@ -123,122 +119,223 @@ def luxeval(sacrebleu: bool,
 
     print("All inputs successfully collected.")
 
-    named_systems = []
-    paired_bs_input = {name: [] for name, enabled in metric_flags.items() if enabled and name != "sacrebleu"}
+    # Every file is mapped and validated once; all later stages share these lines
+    corpus = Corpus({model: m_dict[model]["file_path"] for model in m_dict}, source_path, reference_path)
+    directory = os.path.dirname(list(sr_dict.values())[0])  # base folder from first file
+    run_evaluation(corpus, metric_flags, lang_code, ip_url, directory, concurrency=concurrency, parquet=parquet)
 
-    # Scoring loop
-    for model in m_dict:
-        candidate_path = m_dict[model]["file_path"]
+def create_results_folder(directory: str, folder_name: str = "results"):
+    """Create the first free folder_name, folder_name_1, ... in directory. Returns (path, counter)."""
+    folder_counter = 0
+    while True:
+        folder_path = os.path.join(directory, folder_name if folder_counter == 0 else f"{folder_name}_{folder_counter}")
+        try:
+            os.makedirs(folder_path)
+            return folder_path, folder_counter
+        except FileExistsError:  # also when a concurrent run took it first
+            folder_counter += 1
+
+def score_systems(corpus: Corpus,
+                  metric_flags: dict,
+                  lang_code: str,
+                  ip_url: str,
+                  concurrency: dict = None,
+                  semaphores: dict = None,
+                  position: int = 0) -> dict:
+    """
+    Score every system of `corpus` with the enabled metrics. Returns
+    {system: {"file_path": path, metric: scores}} in input order.
+    """
+    # Prepping dict with individual routes for the flask calls
+    url_dict = {}
+    ip_url = ip_url.strip("/")
+    for metric, enabled in metric_flags.items():
+        if enabled:
+            url_dict[metric] = f"{ip_url}/{m.metric_config[metric].get('endpoint', metric)}"
 
-        for metric_name, enabled in metric_flags.items():
-            if not enabled:
-                continue
+    m_dict = {model: {"file_path": text_file.path} for model, text_file in corpus.systems.items()}
 
-            files = {"candidate": candidate_path}
-            if has_reference:
-                files["reference"] = reference_path
-            if has_source:
-                files["source"] = source_path
-            scores = m.score_metric(url_dict[metric_name], model, files, metric_name, language=lang_code)
-            m_dict[model][metric_name] = scores
+    # Scoring jobs, run concurrently across systems and metrics.
+    # Metrics with a multi-system mode score all systems in one request.
+    jobs = []
+    for metric_name, enabled in metric_flags.items():
+        if not enabled:
+            continue
 
-            if metric_name != "sacrebleu":  # only those have segment_scores
-                paired_bs_input[metric_name].append(scores["segment_scores"])
+        if m.metric_config[metric_name]["multi_system"]:
+            jobs.append((f"{len(m_dict)} systems", corpus.inputs(), metric_name))
+        else:
+            for model in m_dict:
+                jobs.append((model, corpus.inputs(model), metric_name))
 
-        with open(m_dict[model]["file_path"], "r") as file:
-            model_lines = [line.strip("\n") for line in file.readlines()]
-        named_systems.append((model, model_lines))
+    job_scores = m.score_all(jobs, url_dict, language=lang_code, concurrency=concurrency, semaphores=semaphores, position=position)
+    failed = sorted({f"{metric_name}: {scores['error']}" for (_, metric_name), scores in job_scores.items() if "error" in scores})
+    if failed:
+        raise RuntimeError("Scoring failed for " + "; ".join(failed))
 
-    # Paired bootstrap tests
-    significance_dict = pbt.paired_bs(paired_bs_input)
-    if has_reference == "y":
-        with open(reference_path, "r") as file:
-            reference_lines = [line.strip("\n") for line in file.readlines()]
+    # Assemble results in input order
+    for model in m_dict:
+        for metric_name, enabled in metric_flags.items():
+            if not enabled:
+                continue
+
+            m_dict[model][metric_name] = job_scores[(model, metric_name)]
+    return m_dict
 
-    if sacrebleu:
-        sacrebleu_dict = {"BLEU": BLEU(), "chrF2": CHRF(), "TER": TER()}
+def significance(corpus: Corpus, metric_flags: dict, m_dict: dict, seed=None, paired_bs_n: int = 1000) -> dict:
+    """
+    Paired bootstrap tests of the systems in `m_dict` (the first one is the baseline):
+    mean sentence scores for the neural metrics, corpus statistics for sacrebleu.
+    Returns {metric: one `Result` per system}.
+    """
+    model_names = list(m_dict.keys())
+    named_systems = [(model, corpus.systems[model]) for model in model_names]
+
+    paired_bs_input = {name: [m_dict[model_name][name]["segment_scores"] for model_name in model_names]
+                       for name, enabled in metric_flags.items() if enabled and name != "sacrebleu"}
+    significance_dict = pbt.paired_bs(paired_bs_input, paired_bs_n, seed=seed)
+
+    if metric_flags.get("sacrebleu"):
+        sacrebleu_dict = m.sacrebleu_metrics()
+        # Statistics the service extracted with the same configuration are not extracted again
+        segment_stats = {sb_metric: [m_dict[model_name]["sacrebleu"]["stats"][sb_metric] for model_name in model_names]
+                         for sb_metric in sacrebleu_dict
+                         if all(sb_metric in m_dict[model_name]["sacrebleu"]["stats"] for model_name in model_names)}
         args = Namespace(short=False)
-        results, _ = pbt.paired_bs_sacrebleu(named_systems, sacrebleu_dict, reference_lines, args)
+        results, _ = pbt.paired_bs_sacrebleu(named_systems, sacrebleu_dict, corpus.reference, args, paired_bs_n,
+                                             segment_stats=segment_stats, seed=seed)
     else:
         results = {}
 
+    return {**significance_dict, **{metric: value for metric, value in results.items() if metric != "System"}}
+
+def run_evaluation(corpus: Corpus,
+                   metric_flags: dict,
+                   lang_code: str,
+                   ip_url: str,
+                   directory: str,
+                   folder_name: str = "results",
+                   concurrency: dict = None,
+                   parquet: bool = True,
+                   semaphores: dict = None,
+                   position: int = 0) -> str:
+    """
+    Score every system of `corpus` with the enabled metrics, run the significance
+    tests and write the Excel/Parquet results, plots and run state to a new results
+    folder in `directory`. Returns the path of that folder.
+
+    `semaphores` and `position` let concurrent evaluations share the per-service
+    request limits and the progress bar area, see `metrics.score_all`.
+    """
+    m_dict = score_systems(corpus, metric_flags, lang_code, ip_url, concurrency, semaphores, position)
+    seed = pbt.bootstrap_seed()
+    ci_results = significance(corpus, metric_flags, m_dict, seed)
+    return write_results(corpus, metric_flags, lang_code, m_dict, ci_results, seed, directory, folder_name, parquet)
+
+def add_systems(results_folder: str,
+                systems,
+                ip_url: str,
+                folder_name: str = "results",
+                concurrency: dict = None,
+                parquet: bool = True) -> str:
+    """
+    Add systems to an earlier evaluation without scoring its systems again.
+    `systems` is a list of files or a {name: path} dict. Only the new systems are
+    scored, with the language and metrics of the earlier run; each is then tested
+    against the baseline on the same resamples as the earlier systems, whose results
+    are reused. Refuses if any input file of the earlier run changed, or if it was
+    resampled without a seed.
+    The results of all systems go to a new folder next to `results_folder`.
+    """
+    state = run_state.load(results_folder)
+    if state["bootstrap"]["seed"] is None:
+        raise ValueError(f"Cannot add systems to {results_folder}: it was evaluated with random bootstrap resamples "
+                         "(SACREBLEU_SEED=none), so new p-values would not be comparable. Run a full evaluation instead.")
+    changed = run_state.changed_inputs(state)
+    if changed:
+        raise ValueError(f"Cannot reuse {results_folder}: " + "; ".join(changed) + ". Run a full evaluation instead.")
+
+    if isinstance(systems, (list, tuple)):
+        systems = {os.path.splitext(os.path.basename(path))[0]: path for path in systems}
+    duplicates = [name for name in systems if name in state["systems"]]
+    if duplicates:
+        raise ValueError(f"{results_folder} already has system(s) {', '.join(duplicates)}.")
+
+    source_path = state["source"]["path"] if state["source"] else None
+    reference_path = state["reference"]["path"] if state["reference"] else None
+    earlier = {name: info["path"] for name, info in state["systems"].items()}
+    corpus = Corpus({**earlier, **systems}, source_path, reference_path)
+    metric_flags, lang_code = state["metric_flags"], state["language"]
+    seed, paired_bs_n = state["bootstrap"]["seed"], state["bootstrap"]["resamples"]
+
+    new_dict = score_systems(Corpus(systems, source_path, reference_path, validate=False), metric_flags, lang_code, ip_url, concurrency)
+    m_dict = {**run_state.m_dict(state), **new_dict}
+
+    # Every system is compared to the baseline only, so the earlier results stay valid
+    baseline = next(iter(earlier))
+    added = significance(corpus, metric_flags, {baseline: m_dict[baseline], **new_dict}, seed, paired_bs_n)
+    ci_results = {metric: results + added[metric][1:] for metric, results in run_state.ci_results(state).items()}
+
+    directory = os.path.dirname(os.path.abspath(results_folder))
+    return write_results(corpus, metric_flags, lang_code, m_dict, ci_results, seed, directory, folder_name, parquet, paired_bs_n)
+
+def write_results(corpus: Corpus,
+                  metric_flags: dict,
+                  lang_code: str,
+                  m_dict: dict,
+                  ci_results: dict,
+                  seed,
+                  directory: str,
+                  folder_name: str = "results",
+                  parquet: bool = True,
+                  paired_bs_n: int = 1000) -> str:
+    """Write the Excel/Parquet results, plots and run state of scored systems to a new results folder; returns its path."""
     model_names = list(m_dict.keys())
-    data = {"system": model_names}
-
-    for metric, value in significance_dict.items():
-        data[f"{metric} (μ ± 95% CI)"] = [h.format_score(*vals) for vals in h.extract_values(value)]
-
-    for metric, value in results.items():
-        if metric == "System":
-            continue
-        data[f"{metric} (μ ± 95% CI)"] = [h.format_score(*vals) for vals in h.extract_values(value)]
-
-    df = pd.DataFrame(data)
-
-    if not df.empty:
-        df.loc[0, 'system'] = f"Baseline: {df.loc[0, 'system']}"
 
-    if sacrebleu:
-        df = df.style.apply(h.highlight_max, subset=df.columns[1:-1]).apply(h.highlight_min, subset=['TER (μ ± 95% CI)'])
-    else:
-        df = df.style.apply(h.highlight_max)
-
-    if has_source == "y":
-        with open(source_path, "r") as file:
-            source_lines = [line.strip() for line in file.readlines()]
-
-    # Prepare metric DataFrames for Excel export
-    df_dict = {}
+    # Segment-level scores, {metric: {model: scores}}; sacrebleu contributes sentence BLEU, chrF2 and TER
+    segment_scores = {}
     for metric_name, enabled in metric_flags.items():
-        if enabled and metric_name != "sacrebleu":
-            metric_data = {}
-
-            # Always include source/reference if they exist
-            if "source_path" in sr_dict and os.path.exists(sr_dict["source_path"]):
-                with open(sr_dict["source_path"], "r") as f:
-                    source_lines = [line.strip() for line in f.readlines()]
-                metric_data["source"] = source_lines
-
-            if "reference_path" in sr_dict and os.path.exists(sr_dict["reference_path"]):
-                with open(sr_dict["reference_path"], "r") as f:
-                    reference_lines = [line.strip() for line in f.readlines()]
-                metric_data["reference"] = reference_lines
-
-            # Add candidate lines and scores for each model
-            for model_name in model_names:
-                candidate_path = m_dict[model_name]["file_path"]
-                with open(candidate_path, "r") as f:
-                    model_lines = [line.strip() for line in f.readlines()]
-                metric_data[model_name + "_lines"] = model_lines
-                metric_data[model_name + "_score"] = m_dict[model_name][metric_name]["segment_scores"]
-
-            df_dict[metric_name] = pd.DataFrame(metric_data)
+        if not enabled:
+            continue
+        if metric_name == "sacrebleu":
+            for sb_metric in m.sacrebleu_metrics():
+                segment_scores[sb_metric] = {model_name: m_dict[model_name]["sacrebleu"]["segment_scores"][sb_metric] for model_name in model_names}
+        else:
+            segment_scores[metric_name] = {model_name: m_dict[model_name][metric_name]["segment_scores"] for model_name in model_names}
+
+    # Segment-level columns for the export; texts are read lazily from the corpus
+    segment_columns = {}
+    for metric_name, scores in segment_scores.items():
+        columns = {}
+
+        # Always include source/reference if they exist
+        if corpus.source is not None:
+            columns["source"] = corpus.source
+        if corpus.reference is not None:
+            columns["reference"] = corpus.reference
+
+        # Add candidate lines and scores for each model
+        for model_name in model_names:
+            columns[model_name + "_lines"] = corpus.systems[model_name]
+            columns[model_name + "_score"] = scores[model_name]
+
+        segment_columns[metric_name] = columns
 
     # Create results folder
-    folder_name = "results"
-    folder_counter = 0
-    directory = os.path.dirname(list(sr_dict.values())[0])  # base folder from first file
-    folder_path = os.path.join(directory, folder_name)
-    while os.path.exists(folder_path):
-        folder_counter += 1
-        folder_path = os.path.join(directory, f"{folder_name}_{folder_counter}")
-    os.makedirs(folder_path)
+    folder_path, folder_counter = create_results_folder(directory, folder_name)
 
     # Export all data to Excel
     excel_path = os.path.join(folder_path, f"results_{folder_counter}.xlsx")
     formatted_matrice_input = am.format_accuracy_matrix_data(m_dict)
 
-    with pd.ExcelWriter(excel_path, engine="xlsxwriter") as writer:
-        # Main CI table
-        df.to_excel(writer, sheet_name='ci', index=False)
-        # Individual metric sheets
-        for metric_name, metric_df in df_dict.items():
-            metric_df.to_excel(writer, sheet_name=metric_name, index=False)
-        # Accuracy matrix
-        am.accuracy_matrix(formatted_matrice_input, writer, sheet_name="accuracy_matrice")
-
+    exporter.write_excel(excel_path, model_names, ci_results, segment_columns, formatted_matrice_input)
     print(f"Excel file saved: {excel_path}")
 
+    if parquet and exporter.write_parquet(folder_path, model_names, ci_results, corpus, segment_scores):
+        print(f"Parquet files saved: {os.path.join(folder_path, 'segments.parquet')}, {os.path.join(folder_path, 'ci.parquet')}")
+
+    # Scores and fingerprints, so systems can be added later without scoring these again
+    run_state.save(folder_path, corpus, metric_flags, lang_code, m_dict, ci_results, seed, paired_bs_n)
 
     combined_dict = {}
     for model_name in m_dict:
@@ -249,27 +346,43 @@ def luxeval(sacrebleu: bool,
                 model_scores[metric_name + " ↑"] = metric_sys_score
         combined_dict[model_name] = model_scores
 
-        if sacrebleu:
+        if metric_flags.get("sacrebleu"):
             model_bleuscores = m_dict[model_name]["sacrebleu"]
             combined_dict[model_name]["bleu ↑"] = model_bleuscores["bleu"]
             combined_dict[model_name]["chrF2 ↑"] = model_bleuscores["chrF2"]
             combined_dict[model_name]["TER ↓"] = model_bleuscores["TER"]
 
-    plotter.bar_plot(combined_dict, os.path.join(folder_path, "bar_plot.png"))
-    plotter.radar_plot(combined_dict, os.path.join(folder_path, "radar_plot.png"))
+    plot_jobs = [
+        (plotter.bar_plot, combined_dict, os.path.join(folder_path, "bar_plot.png")),
+        (plotter.radar_plot, combined_dict, os.path.join(folder_path, "radar_plot.png")),
+    ]
+    for metric_name, scores in segment_scores.items():
+        # Only this metric's scores are sent to the worker process
+        metric_scores = {model_name: {metric_name: {"segment_scores": scores[model_name]}} for model_name in m_dict}
+        plot_jobs.append((plotter.lm_metric_scatter_plot, metric_scores, metric_name, os.path.join(folder_path, f"{metric_name}_scatter_plot.png")))
+    plotter.render_all(plot_jobs)
 
-    for metric_name, enabled in metric_flags.items():
-        if enabled and metric_name != "sacrebleu":
-            plotter.lm_metric_scatter_plot(m_dict, metric_name, os.path.join(folder_path, f"{metric_name}_scatter_plot.png"))
+    return folder_path
 
 ##########################################
 
 URL = "" # <-- enter your ip, e.g.,: "http://##.####.#.##:####"
 
 # example call
-luxeval(sacrebleu=True,
-          bleurt20=True,
-          comet=True,
-          bertscore=True,
-          luxembedder=True,
-          ip_url=URL)
+if __name__ == "__main__":  # worker processes re-import this module
+    parser = argparse.ArgumentParser(description="Evaluate MT systems against the gateway (asks for the inputs).")
+    parser.add_argument("--add-to", metavar="RESULTS", help="results folder of an earlier run to add the given systems to")
+    parser.add_argument("systems", nargs="*", help="system files to add (with --add-to)")
+    args = parser.parse_args()
+
+    if args.add_to:
+        if not args.systems:
+            parser.error("--add-to needs at least one system file")
+        add_systems(args.add_to, args.systems, ip_url=URL)
+    else:
+        luxeval(sacrebleu=True,
+                  bleurt20=True,
+                  comet=True,
+                  bertscore=True,
+                  luxembedder=True,
+                  ip_url=URL)
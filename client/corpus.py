@@ -0,0 +1,124 @@
+import hashlib
+import mmap
+import numpy as np
+import os
+from typing import Dict, Optional
+
+BLOCK_SIZE = 64 * 1024 * 1024  # bytes scanned for newlines at a time
+
+class LineView:
+    """A read-only range of lines of a `TextFile`; slicing returns another view without copying."""
+    def __init__(self, text_file, start: int, stop: int):
+        self.text_file = text_file
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return LineView(self.text_file, self.start + start, self.start + max(start, stop))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("line index out of range")
+        return self.text_file.line(self.start + key)
+
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield self.text_file.line(i)
+
+class TextFile(LineView):
+    """
+    A text file that is memory-mapped once, with an index of line offsets.
+    Lines are decoded (and stripped) only when accessed.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        data = np.frombuffer(self._buffer, dtype=np.uint8)
+        newlines = [np.flatnonzero(data[start:start + BLOCK_SIZE] == 10) + start for start in range(0, size, BLOCK_SIZE)]
+        self._ends = np.concatenate(newlines) if newlines else np.empty(0, dtype=np.int64)
+        if size and data[-1] != 10:  # last line without trailing newline
+            self._ends = np.append(self._ends, size)
+        self._starts = np.concatenate([[0], self._ends[:-1] + 1]) if len(self._ends) else self._ends
+        self._fingerprint = None
+        super().__init__(self, 0, len(self._ends))
+
+    def line(self, i: int) -> str:
+        return self._buffer[self._starts[i]:self._ends[i]].decode("utf-8").strip()
+
+    def fingerprint(self) -> str:
+        """SHA-256 of the file's contents, to tell whether it changed since an earlier run."""
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha256(self._buffer).hexdigest()
+        return self._fingerprint
+
+    def empty_lines(self) -> list:
+        """1-based numbers of lines that are empty or whitespace only."""
+        return [i + 1 for i in range(len(self)) if not self.line(i)]
+
+_loaded: Dict[str, TextFile] = {}
+
+def load(path: str) -> TextFile:
+    """Return the `TextFile` for a path, mapping each file only once per process."""
+    key = os.path.realpath(path)
+    if key not in _loaded:
+        _loaded[key] = TextFile(path)
+    return _loaded[key]
+
+def validate_lines(lines1, lines2, name1="Reference", name2="Candidate"):
+    """Ensure files are not empty and have the same number of lines."""
+    if not len(lines1) or not len(lines2):
+        raise ValueError(f"{name1} or {name2} file is empty.")
+    if len(lines1) != len(lines2):
+        raise ValueError(f"{name1} and {name2} must have the same number of lines. Got {len(lines1)} vs {len(lines2)}")
+
+class Corpus:
+    """
+    The source, reference and system files of one evaluation. Every file is read
+    through `load` and their alignment is validated once; later stages share the
+    same `TextFile` objects instead of reading the files again.
+    """
+    def __init__(self, systems: Dict[str, str], source_path: Optional[str] = None, reference_path: Optional[str] = None,
+                 validate: bool = True):
+        self.source = load(source_path) if source_path else None
+        self.reference = load(reference_path) if reference_path else None
+        self.systems = {name: load(path) for name, path in systems.items()}
+        if validate:
+            self.validate()
+
+    def __len__(self):
+        return len(next(iter(self.systems.values())))
+
+    def validate(self):
+        """Raise if files are misaligned; blank lines are kept (to stay aligned) but reported."""
+        for name, lines in self.systems.items():
+            if self.reference is not None:
+                validate_lines(self.reference, lines, "Reference", f"Candidate ({name})")
+            if self.source is not None:
+                validate_lines(self.source, lines, "Source", f"Candidate ({name})")
+
+        for text_file in [self.source, self.reference, *self.systems.values()]:
+            if text_file is not None:
+                empty = text_file.empty_lines()
+                if empty:
+                    print(f"Warning: empty lines in {text_file.path} at line(s): {', '.join(map(str, empty[:20]))}"
+                          + (" ..." if len(empty) > 20 else ""))
+
+    def inputs(self, system=None) -> dict:
+        """Inputs of a scoring job: source/reference plus one system, or all systems as a dict."""
+        inputs = {}
+        if self.source is not None:
+            inputs["source"] = self.source
+        if self.reference is not None:
+            inputs["reference"] = self.reference
+        inputs["candidate"] = self.systems[system] if system is not None else dict(self.systems)
+        return inputs
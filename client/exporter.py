@@ -0,0 +1,129 @@
+import accuracy_matrice as am
+import helpers as h
+import os
+import xlsxwriter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is skipped without pyarrow
+    pa = pq = None
+
+XLSX_MAX_ROWS = 1048576  # per worksheet, header included
+PARQUET_ROW_GROUP = 65536  # segments per row group
+LOWER_IS_BETTER = {"TER"}
+HEADER_FORMAT = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+
+def ci_column(metric: str) -> str:
+    return f"{metric} (μ ± 95% CI)"
+
+def best_systems(metric: str, results: list) -> set:
+    """Indices of the systems with the best score (lowest for TER, highest otherwise)."""
+    scores = [float(r.score) for r in results]
+    best = min(scores) if metric in LOWER_IS_BETTER else max(scores)
+    return {i for i, score in enumerate(scores) if score == best}
+
+def open_workbook(path: str):
+    """
+    A constant-memory workbook: each row is flushed to disk once the next one is
+    started, so rows of a sheet must be written in order. Segment text is always
+    written as text, never as a formula or URL.
+    """
+    return xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+        "nan_inf_to_errors": True,
+    })
+
+def write_ci_sheet(workbook, formats, systems: list, ci_results: dict, sheet_name="ci"):
+    """One row per system with the formatted score (μ ± 95% CI) of each metric; the best ones in bold."""
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, ["system"] + [ci_column(metric) for metric in ci_results], formats.get(HEADER_FORMAT))
+    best = {metric: best_systems(metric, results) for metric, results in ci_results.items()}
+    values = {metric: h.extract_values(results) for metric, results in ci_results.items()}
+    for i, system in enumerate(systems):
+        worksheet.write(i + 1, 0, f"Baseline: {system}" if i == 0 else system)
+        for j, metric in enumerate(ci_results):
+            fmt = formats.get({"bold": True}) if i in best[metric] else None
+            worksheet.write(i + 1, j + 1, h.format_score(*values[metric][i]), fmt)
+
+def write_segment_sheets(workbook, formats, sheet_name: str, columns: dict):
+    """
+    Write aligned columns ({header: sequence}) row by row. Rows beyond the xlsx
+    row limit continue on "<sheet_name> (2)", "<sheet_name> (3)", ...
+    """
+    rows_per_sheet = XLSX_MAX_ROWS - 1
+    header = list(columns)
+    worksheet = None
+    for i, row in enumerate(zip(*columns.values())):
+        if i % rows_per_sheet == 0:
+            part = i // rows_per_sheet + 1
+            worksheet = workbook.add_worksheet(sheet_name if part == 1 else f"{sheet_name} ({part})")
+            worksheet.write_row(0, 0, header, formats.get(HEADER_FORMAT))
+        worksheet.write_row(i % rows_per_sheet + 1, 0, row)
+    if worksheet is None:
+        workbook.add_worksheet(sheet_name).write_row(0, 0, header, formats.get(HEADER_FORMAT))
+
+def write_excel(path: str, systems: list, ci_results: dict, segment_columns: dict, accuracy_df):
+    """
+    :param path: the .xlsx file to create
+    :param systems: system names, baseline first
+    :param ci_results: {metric: [paired bootstrap `Result` per system]}
+    :param segment_columns: {metric: {header: sequence}} for the segment-level sheets
+    :param accuracy_df: system-level scores, see `accuracy_matrice.format_accuracy_matrix_data`
+    """
+    workbook = open_workbook(path)
+    formats = h.FormatCache(workbook)
+    write_ci_sheet(workbook, formats, systems, ci_results)
+    for metric_name, columns in segment_columns.items():
+        write_segment_sheets(workbook, formats, metric_name, columns)
+    am.accuracy_matrix(accuracy_df, workbook, sheet_name="accuracy_matrice", formats=formats)
+    workbook.close()
+
+def write_parquet(folder: str, systems: list, ci_results: dict, corpus, segment_scores: dict) -> bool:
+    """
+    Write segments.parquet (one row per system and segment: texts plus one column per
+    metric) and ci.parquet (one row per system and metric). Segments are written one
+    row group at a time, and readers can select systems, metrics or row groups
+    without loading the whole file.
+
+    :param segment_scores: {metric: {system: segment scores}}
+    :return: False if pyarrow is not installed
+    """
+    if pq is None:
+        print("pyarrow is not installed, skipping Parquet export.")
+        return False
+
+    fields = [("segment", pa.int64()), ("system", pa.string())]
+    if corpus.source is not None:
+        fields.append(("source", pa.string()))
+    if corpus.reference is not None:
+        fields.append(("reference", pa.string()))
+    fields.append(("candidate", pa.string()))
+    fields += [(metric, pa.float64()) for metric in segment_scores]
+    schema = pa.schema(fields)
+
+    num_segments = len(corpus)
+    with pq.ParquetWriter(os.path.join(folder, "segments.parquet"), schema) as writer:
+        for system in systems:
+            for start in range(0, num_segments, PARQUET_ROW_GROUP):
+                end = min(start + PARQUET_ROW_GROUP, num_segments)
+                columns = {"segment": range(start, end), "system": [system] * (end - start)}
+                if corpus.source is not None:
+                    columns["source"] = list(corpus.source[start:end])
+                if corpus.reference is not None:
+                    columns["reference"] = list(corpus.reference[start:end])
+                columns["candidate"] = list(corpus.systems[system][start:end])
+                for metric, scores in segment_scores.items():
+                    columns[metric] = scores[system][start:end]
+                writer.write_table(pa.table({name: pa.array(values, type=schema.field(name).type)
+                                             for name, values in columns.items()}, schema=schema))
+
+    rows = [{"system": system, "baseline": i == 0, "metric": metric, "score": score, "mean": mean, "ci": ci, "p_value": p_value}
+            for metric, results in ci_results.items()
+            for i, (system, (score, mean, ci, p_value)) in enumerate(zip(systems, h.extract_values(results)))]
+    ci_schema = pa.schema([("system", pa.string()), ("baseline", pa.bool_()), ("metric", pa.string()), ("score", pa.float64()),
+                           ("mean", pa.float64()), ("ci", pa.float64()), ("p_value", pa.float64())])
+    pq.write_table(pa.Table.from_pylist(rows, schema=ci_schema), os.path.join(folder, "ci.parquet"))
+    return True
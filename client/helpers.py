@@ -37,12 +37,14 @@ def format_score(score, mean, ci, p_value):
             formatted += "*"
     return formatted
 
-# Function to highlight the maximum in a column
-def highlight_max(s):
-    is_max = s == s.max()
-    return ['font-weight: bold' if v else '' for v in is_max]
+class FormatCache:
+    """Creates one xlsxwriter format per distinct set of properties, instead of one per cell."""
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._formats = {}
 
-# Function to highlight the minimum in the TER column
-def highlight_min(s):
-    is_min = s == s.min()
-    return ['font-weight: bold' if v else '' for v in is_min]
+    def get(self, properties: dict):
+        key = tuple(sorted(properties.items()))
+        if key not in self._formats:
+            self._formats[key] = self.workbook.add_format(properties)
+        return self._formats[key]
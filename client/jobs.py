@@ -0,0 +1,80 @@
+"""
+Scoring through the gateway's job API: the requests of one metric run are
+submitted as a job with a priority, uploaded a few chunks ahead of the results
+and collected with long polls, so no HTTP request stays open for a whole scoring
+call. Gateways without the job API are sent the same requests directly.
+"""
+import os
+import requests
+import wire
+
+# LUXEVAL_JOBS=0 posts every request directly, as before
+USE_JOBS = os.environ.get("LUXEVAL_JOBS", "1") != "0"
+# Higher-priority jobs are scored first when several clients share the gateway
+PRIORITY = int(os.environ.get("LUXEVAL_JOB_PRIORITY", "0"))
+WINDOW = 8          # chunks uploaded ahead of the one being collected
+POLL_SECONDS = 30   # long-poll duration of one result request
+
+def split_url(url: str) -> tuple:
+    """(gateway base URL, endpoint) of a scoring URL such as http://host:5000/bertscore."""
+    base, endpoint = url.rstrip("/").rsplit("/", 1)
+    return base, f"/{endpoint}"
+
+def submit(session, url: str, chunks: int, priority: int = PRIORITY, timeout=None):
+    """Create a job of `chunks` requests to the endpoint of `url`; returns its URL, or None without a job API."""
+    base, endpoint = split_url(url)
+    response = session.post(f"{base}/jobs", json={"endpoint": endpoint, "chunks": chunks, "priority": priority}, timeout=timeout)
+    if response.status_code in (404, 405):
+        return None  # a gateway from before the job API
+    if response.status_code != 201:
+        raise RuntimeError(f"Job submission failed with status code {response.status_code} - {response.text}")
+    return f"{base}/jobs/{response.json()['id']}"
+
+def result(session, job_url: str, index: int, timeout=None):
+    """The response of chunk `index`, waiting for it with long polls."""
+    while True:
+        response = session.get(f"{job_url}/chunks/{index}", params={"wait": POLL_SECONDS},
+                               timeout=max(timeout or 0, POLL_SECONDS + 30))
+        if response.status_code != 202:
+            return response
+
+def post_all(session, url: str, count: int, payload, timeout=None, priority: int = PRIORITY):
+    """
+    Post `payload(0)` ... `payload(count - 1)` to `url` and yield the responses in
+    order, as `wire.post` returns them. Payloads are built as they are uploaded.
+    A job left unfinished, e.g. because the caller stopped at an error, is cancelled.
+    """
+    job_url = submit(session, url, count, priority, timeout) if USE_JOBS and count else None
+    if job_url is None:
+        mode = None
+        for index in range(count):
+            response, mode = wire.post(session, url, payload(index), timeout=timeout, mode=mode)
+            yield response
+        return
+
+    mode = wire.preferred()
+
+    def upload(index):
+        body, headers = wire.encode(payload(index), mode)
+        response = session.put(f"{job_url}/chunks/{index}", data=body, headers=headers, timeout=timeout)
+        if response.status_code != 202:
+            raise RuntimeError(f"Chunk upload failed with status code {response.status_code} - {response.text}")
+
+    uploaded = 0
+    try:
+        for index in range(count):
+            while uploaded < min(index + WINDOW, count):
+                upload(uploaded)
+                uploaded += 1
+            response = result(session, job_url, index, timeout)
+            if response.status_code == 415:
+                # See wire.post; chunks uploaded before the switch are resent as they fail
+                mode = wire.FALLBACK
+                upload(index)
+                response = result(session, job_url, index, timeout)
+            yield response
+    finally:
+        try:
+            session.delete(job_url, timeout=timeout)  # cancels an unfinished job, frees the results of a finished one
+        except requests.RequestException:
+            pass  # the gateway forgets it after GATEWAY_JOB_TTL
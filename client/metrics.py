@@ -1,113 +1,185 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import jobs
 import numpy as np
 import requests
+from sacrebleu.metrics import BLEU, CHRF, TER
+from sacrebleu_stats import StatsCache, aggregate, metric_config_id, stats_key
 from tqdm import tqdm
-from yaspin import yaspin
 import threading
-import time
+import wire
 
 def output_format(segment_scores: list):
     """Convert segment scores to dict with system score."""
     system_score = np.mean(segment_scores) if segment_scores else 0.0
     return {"segment_scores": segment_scores, "system_score": system_score}
 
-def read_file_lines(path: str, strip=True):
-    """Read a file and return a list of lines."""
-    with open(path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    if strip:
-        lines = [line.strip() for line in lines if line.strip()]
-    return lines
-
-def validate_lines(lines1, lines2, name1="Reference", name2="Candidate"):
-    """Ensure files are not empty and have the same number of lines."""
-    if not lines1 or not lines2:
-        raise ValueError(f"{name1} or {name2} file is empty.")
-    if len(lines1) != len(lines2):
-        raise ValueError(f"{name1} and {name2} must have the same number of lines. Got {len(lines1)} vs {len(lines2)}")
+def sacrebleu_metrics() -> dict:
+    """The sacrebleu metrics by score name; the service extracts statistics with the same configuration."""
+    return {"BLEU": BLEU(), "chrF2": CHRF(), "TER": TER()}
+
+def sacrebleu_output(collected: dict, signatures: dict, hypotheses, references) -> dict:
+    """
+    Corpus BLEU/chrF2/TER of one system from the segment statistics the service
+    returned, plus its sentence scores. Statistics extracted with the same
+    configuration as here are kept for the paired bootstrap and stored in the
+    statistics cache (see `sacrebleu_stats`), so they are not extracted again.
+    """
+    cache = StatsCache()
+    stats = {}
+    corpus = {}
+    for name, metric in sacrebleu_metrics().items():
+        corpus[name] = aggregate(metric, collected["stats"][name]).score
+        config_id = metric_config_id(metric)
+        if signatures.get(name) == config_id:
+            stats[name] = collected["stats"][name]
+            cache.put_many([stats_key(config_id, hyp, ref) for hyp, ref in zip(hypotheses, references)], stats[name])
+    return {"bleu": corpus["BLEU"], "chrF2": corpus["chrF2"], "TER": corpus["TER"],
+            "segment_scores": collected["scores"], "stats": stats}
 
 # Metric configuration
 metric_config = {
-    "bertscore": {"files": ["reference", "candidate"], "payload_keys": {"references": "reference", "candidates": "candidate"}, "score_key": "bert_scores", "language": True},
-    "bleurt20": {"files": ["reference", "candidate"], "payload_keys": {"references": "reference", "candidates": "candidate"}, "score_key": "bleurt_scores", "language": False},
-    "xcometxl": {"files": ["reference", "candidate"], "payload_keys": {"references": "reference", "candidates": "candidate"}, "score_key": "xcometxl_scores", "language": False},
-    "luxembedder": {"files": ["source", "candidate"], "payload_keys": {"sources": "source", "candidates": "candidate"}, "score_key": "luxembedder_scores", "language": False},
-    "sacrebleu": {"files": ["reference", "candidate"], "payload_keys": {"references": "reference", "candidates": "candidate"}, "score_key": None, "language": False}
+    "bertscore": {"files": ["reference", "candidate"], "payload_keys": {"references": "reference", "candidates": "candidate"}, "score_key": "bert_scores", "language": True, "service": "bert", "multi_system": True},
+    "bleurt20": {"files": ["reference", "candidate"], "payload_keys": {"references": "reference", "candidates": "candidate"}, "score_key": "bleurt_scores", "language": False, "service": "bleurt", "multi_system": True},
+    "xcometxl": {"files": ["reference", "candidate"], "payload_keys": {"references": "reference", "candidates": "candidate"}, "score_key": "xcometxl_scores", "language": False, "service": "xcometxl", "multi_system": True},
+    "luxembedder": {"files": ["source", "candidate"], "payload_keys": {"sources": "source", "candidates": "candidate"}, "score_key": "luxembedder_scores", "language": False, "service": "luxembedder", "multi_system": True},
+    "sacrebleu": {"files": ["reference", "candidate"], "payload_keys": {"references": "reference", "candidates": "candidate"}, "score_key": "sacrebleu_scores", "language": False, "service": "bert", "multi_system": True, "endpoint": "sacrebleu_segments", "chunk_size": 4096}
 }
 
-def score_metric(url, model, files: dict, metric_name: str, language="en"):
+# Maximum number of simultaneous requests per gateway service
+service_concurrency = {"bert": 2, "bleurt": 2, "xcometxl": 1, "luxembedder": 2}
+
+def score_metric(url, model, inputs: dict, metric_name: str, language="en", pbar=None, chunk_size=256, timeout=600):
     """
-    Generic scoring function with tqdm for prep and spinner for API wait.
+    Generic scoring function with a progress bar of the segments scored so far.
+
+    `inputs` maps "source"/"reference"/"candidate" to aligned line sequences, as
+    handed out by `corpus.Corpus.inputs`. If inputs["candidate"] is a
+    {system: lines} dict, all systems are scored in multi-system requests and a
+    {system: scores} dict is returned.
+    Segments are sent in chunks of about `chunk_size` (or the metric's own
+    "chunk_size"), so the bar shows real throughput and ETA and no single request
+    holds the whole corpus. sacrebleu results also hold the corpus scores, see
+    `sacrebleu_output`.
     """
     cfg = metric_config[metric_name]
+    own_bar = pbar is None
+    if own_bar:
+        pbar = tqdm(desc=f"{model} - {metric_name}", unit="seg")
     try:
-        # Read required files
-        file_lines = {}
-        for f in cfg["files"]:
-            if f in files and files[f]:
-                file_lines[f] = read_file_lines(files[f])
-
-        # Validate line counts
-        if "reference" in file_lines and "candidate" in file_lines:
-            validate_lines(file_lines["reference"], file_lines["candidate"])
-        if "source" in file_lines and "candidate" in file_lines:
-            validate_lines(file_lines["source"], file_lines["candidate"], "Source", "Candidate")
-
-        # Build payload
-        data = {}
-        for key, file_key in cfg["payload_keys"].items():
-            data[key] = file_lines[file_key]
-        if cfg.get("language"):
-            data["language"] = language.lower()
-
-        total_segments = len(next(iter(file_lines.values())))  # number of lines
-        response_container = {}
-
-        def do_request():
-            try:
-                headers = {"Content-Type": "application/json"}
-                response = requests.post(url, json=data, headers=headers)
-                response_container["response"] = response
-            except Exception as e:
-                response_container["error"] = str(e)
-
-        # Step 1: prep with tqdm
-        with tqdm(total=total_segments, desc=f"{model} - {metric_name} (prep)", unit="lines") as pbar:
-            for _ in range(total_segments):
-                time.sleep(0.001)  # simulate per-line prep
-                pbar.update(1)
-
-        # Step 2: API request with spinner
-        thread = threading.Thread(target=do_request)
-        thread.start()
-        with yaspin(text=f"{model} - {metric_name} (waiting on API)", color="cyan") as spinner:
-            while thread.is_alive():
-                time.sleep(0.1)
-            thread.join()
-            if "error" in response_container:
-                spinner.fail(":(")
-                raise RuntimeError(response_container["error"])
-            else:
-                spinner.ok(":)")
-
-        response = response_container["response"]
-        if response.status_code != 200:
-            print(f"Error: {model}, {metric_name}, {response.status_code} - {response.text}")
-            return {"error": f"API request failed with status code {response.status_code}"}
+        candidate_lines = inputs.get("candidate")
+        multi = isinstance(candidate_lines, dict)
+        if not multi:
+            candidate_lines = {model: candidate_lines}
+        file_lines = {f: inputs[f] for f in cfg["files"] if f != "candidate" and inputs.get(f) is not None}
+
+        num_lines = len(next(iter(candidate_lines.values())))
+        pbar.reset(total=num_lines * len(candidate_lines))
+        pbar.set_postfix_str("scoring")
+
+        rows_per_request = max(1, cfg.get("chunk_size", chunk_size) // len(candidate_lines))
+
+        segment_scores = {name: {"scores": {}, "stats": {}} if metric_name == "sacrebleu" else [] for name in candidate_lines}
+        signatures = {}
+        cache_hits = cache_misses = 0
+        starts = range(0, num_lines, rows_per_request)
+
+        def payload(i):
+            start, end = starts[i], min(starts[i] + rows_per_request, num_lines)
+            data = {}
+            for key, file_key in cfg["payload_keys"].items():
+                if file_key != "candidate":
+                    data[key] = list(file_lines[file_key][start:end])
+                elif multi:
+                    data["systems"] = {name: list(lines[start:end]) for name, lines in candidate_lines.items()}
+                else:
+                    data[key] = list(candidate_lines[model][start:end])
+            if cfg.get("language"):
+                data["language"] = language.lower()
+            return data
+
+        # One job per metric run, see jobs.py
+        with requests.Session() as session, contextlib.closing(jobs.post_all(session, url, len(starts), payload, timeout=timeout)) as responses:
+            for start, response in zip(starts, responses):
+                end = min(start + rows_per_request, num_lines)
+                if response.status_code != 200:
+                    pbar.set_postfix_str(":(")
+                    tqdm.write(f"Error: {model}, {metric_name}, {response.status_code} - {response.text}")
+                    return {"error": f"API request failed with status code {response.status_code}"}
+                result = wire.decode(response)
+
+                if "cache" in result:
+                    cache_hits += result["cache"]["hits"]
+                    cache_misses += result["cache"]["misses"]
+                scores = result.get(cfg["score_key"]) or ({} if multi else [])
+                for name in candidate_lines:
+                    chunk = scores.get(name, []) if multi else scores
+                    if metric_name == "sacrebleu":  # {"scores"/"stats": {BLEU/chrF2/TER: per segment}}
+                        for key, collected in segment_scores[name].items():
+                            for sb_metric, values in chunk[key].items():
+                                collected.setdefault(sb_metric, []).extend(values)
+                    else:
+                        segment_scores[name].extend(chunk)
+                signatures = result.get("signatures", signatures)
+                pbar.update((end - start) * len(candidate_lines))
+
+        pbar.set_postfix_str(":)")
+        if cache_hits or cache_misses:
+            tqdm.write(f"{model} - {metric_name}: {cache_hits} cached, {cache_misses} scored")
 
-        # Handle standard metrics
-        if cfg["score_key"]:
-            segment_scores = response.json().get(cfg["score_key"], []) or []
-            return output_format(segment_scores)
-
-        # Special handling for sacrebleu
         if metric_name == "sacrebleu":
-            data = response.json()
-            return {"bleu": data.get("bleu_score", data.get("BLEU")),
-                    "chrF2": data.get("chrF2"),
-                    "TER": data.get("TER")}
-
-        return response.json()
+            results = {name: sacrebleu_output(collected, signatures, candidate_lines[name], file_lines["reference"])
+                       for name, collected in segment_scores.items()}
+        else:
+            results = {name: output_format(scores) for name, scores in segment_scores.items()}
+        return results if multi else results[model]
 
     except Exception as e:
-        print(f"{model}: {metric_name} scoring failed: {e}")
+        pbar.set_postfix_str(":(")
+        tqdm.write(f"{model}: {metric_name} scoring failed: {e}")
         return {"error": str(e)}
+    finally:
+        if own_bar:
+            pbar.close()
+
+def service_semaphores(concurrency: dict = None) -> dict:
+    """One semaphore per gateway service, allowing `concurrency[service]` jobs in flight."""
+    limits = {**service_concurrency, **(concurrency or {})}
+    return {service: threading.Semaphore(limit) for service, limit in limits.items()}
+
+def score_all(jobs: list, url_dict: dict, language="en", concurrency: dict = None, chunk_size=256, semaphores: dict = None, position=0):
+    """
+    Score all (model, inputs, metric_name) jobs concurrently, with at most
+    `concurrency[service]` jobs in flight per gateway service.
+    Multi-system jobs (candidate given as {system: lines}) are split per system.
+    Returns {(model, metric_name): scores}, independent of completion order.
+
+    Concurrent calls can pass the same `semaphores` (see `service_semaphores`) to
+    share the limits, and distinct `position`s to stack their progress bars.
+    """
+    limits = {**service_concurrency, **(concurrency or {})}
+    semaphores = semaphores or service_semaphores(concurrency)
+    bars = [tqdm(total=1, desc=f"{model} - {metric_name}", unit="seg", position=position + i, leave=True)
+            for i, (model, _, metric_name) in enumerate(jobs)]
+    for bar in bars:
+        bar.set_postfix_str("queued")
+
+    def run(job, bar):
+        model, inputs, metric_name = job
+        with semaphores[metric_config[metric_name]["service"]]:
+            return score_metric(url_dict[metric_name], model, inputs, metric_name, language=language, pbar=bar, chunk_size=chunk_size)
+
+    with ThreadPoolExecutor(max_workers=max(1, sum(limits.values()))) as executor:
+        futures = [executor.submit(run, job, bar) for job, bar in zip(jobs, bars)]
+        results = {}
+        for (model, inputs, metric_name), future in zip(jobs, futures):
+            scores = future.result()
+            if isinstance(inputs["candidate"], dict):
+                for name in inputs["candidate"]:
+                    results[(name, metric_name)] = scores if "error" in scores else scores[name]
+            else:
+                results[(model, metric_name)] = scores
+
+    for bar in bars:
+        bar.close()
+    return results
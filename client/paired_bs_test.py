@@ -1,51 +1,115 @@
 from argparse import Namespace
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import multiprocessing
 import numpy as np
 import os
 from sacrebleu.metrics.base import Metric as SbMetric
-from sacrebleu.significance import PairedTest, Result, _compute_p_value, estimate_ci
+from sacrebleu.significance import Result, _compute_p_value, estimate_ci
+from sacrebleu_stats import CACHE_PATH, StatsCache, aggregate, metric_config_id, score_from_statistics, segment_statistics
 from typing import Dict, List, Tuple
 
 
+def bootstrap_seed():
+    """The resampling seed, SACREBLEU_SEED (default 12345 as in sacrebleu); None for "none", i.e. random resamples."""
+    seed = os.environ.get("SACREBLEU_SEED", "12345")
+    return None if seed.lower() == "none" else int(seed)
+
+def bootstrap_means(
+    all_sys_scores: np.ndarray,
+    seed: int,
+    paired_bs_n: int = 1000,
+    method: str = "indices",
+    max_memory_mb: int = 256,
+) -> np.ndarray:
+    """
+    :param all_sys_scores: (n_systems, dataset_size) array of sentence-level scores
+    :param seed: seed of the resampling generator
+    :param paired_bs_n: how many resamples to draw
+    :param method: "indices" draws the resamples with `rng.choice` exactly like a single
+    (paired_bs_n, dataset_size) index matrix would, so results are bit-for-bit identical
+    to the unchunked computation; "poisson" weights every segment with an independent
+    Poisson(1) count instead, which needs no index matrix but gives different resamples
+    :param max_memory_mb: upper bound for the indices/weights and gathered scores held at once
+    :return: (n_systems, paired_bs_n) array with the mean score of every resample
+    """
+    rng = np.random.default_rng(seed)
+    n_systems, dataset_size = all_sys_scores.shape
+    bytes_per_resample = dataset_size * 8 * 2
+    chunk = max(1, min(paired_bs_n, max_memory_mb * 1024 * 1024 // bytes_per_resample))
+
+    means = np.empty((n_systems, paired_bs_n))
+    for start in range(0, paired_bs_n, chunk):
+        rows = min(chunk, paired_bs_n - start)
+        if method == "poisson":
+            weights = rng.poisson(1.0, size=(rows, dataset_size)).astype(np.float64)
+            means[:, start:start + rows] = (all_sys_scores @ weights.T) / np.maximum(weights.sum(axis=1), 1)
+        elif method == "indices":
+            idxs = rng.choice(dataset_size, size=(rows, dataset_size), replace=True)
+            for i, scores in enumerate(all_sys_scores):
+                means[i, start:start + rows] = scores[idxs].mean(axis=1)
+        else:
+            raise ValueError(f"Unknown bootstrap method: {method}")
+    return means
+
 def paired_bs(
     metric_sentence_scores: Dict[str, List[List[float]]],
     paired_bs_n: int = 1000,
+    method: str = "indices",
+    workers: int = None,
+    max_memory_mb: int = 256,
+    seed: int = None,
 ):
     """
     :param metric_sentence_scores: a dictionary of metric_name to a list of list of sentence-level scores
     where each item corresponds to the results of one system
     :param paired_bs_n: how many partitions to use in bootstrap sampling
+    :param method: resampling method, see `bootstrap_means`
+    :param workers: number of processes the metrics are spread over; by default one
+    per metric (up to the number of CPUs) for large test sets and none for small ones
+    :param max_memory_mb: memory bound per metric, see `bootstrap_means`
+    :param seed: seed of the resamples (default: `bootstrap_seed()`). Every system is
+    compared to the baseline on the same resamples, so the results of a system do not
+    depend on which other systems are tested with it
     :return: a dictionary with keys metrics and as values a list of dicts, where each dict
     contains the results for a system
     """
     # This seed is also used in sacrebleu
-    seed = int(os.environ.get("SACREBLEU_SEED", "12345"))
-    rng = np.random.default_rng(seed)
-    dataset_size = len(next(iter(metric_sentence_scores.values()))[0])
-    idxs = rng.choice(dataset_size, size=(paired_bs_n, dataset_size), replace=True)
+    seed = bootstrap_seed() if seed is None else seed
+    metric_names = list(metric_sentence_scores)
+    all_scores = [np.array(metric_sentence_scores[name]) for name in metric_names]
+    if not all_scores:
+        return {}
+
+    if workers is None:
+        workers = min(len(all_scores), os.cpu_count() or 1) if all_scores[0].shape[1] >= 10000 else 1
+
+    # Every metric uses the same resamples, since they are all drawn from the same seed
+    args = (all_scores, repeat(seed), repeat(paired_bs_n), repeat(method), repeat(max_memory_mb))
+    if workers > 1 and len(all_scores) > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:  # see plotter.render_all
+            all_means = list(executor.map(bootstrap_means, *args))
+    else:
+        all_means = list(map(bootstrap_means, *args))
 
     results = defaultdict(list)
-    for metric_name, all_sys_scores in metric_sentence_scores.items():
-        all_sys_scores = np.array(all_sys_scores)
+    for metric_name, all_sys_scores, bs_means in zip(metric_names, all_scores, all_means):
         scores_bl, all_sys_scores = all_sys_scores[0], all_sys_scores[1:]
+        bs_scores_bl, all_bs_sys_scores = bs_means[0], bs_means[1:]
         # Baseline
         real_mean_bl = scores_bl.mean().item()
-        # First create (n_samples, dataset_size) array that contains n_samples partitions
-        # of 'dataset_size' items, randomly picked.
-        # Then calculate corpus scores, which here are the average over the dataset_size,
-        # so we end up with an array of (n_samples,)
-        bs_scores_bl = scores_bl[idxs].mean(axis=1)
+        # bs_scores_bl holds the corpus score of each resample of 'dataset_size' items,
+        # which here is the average over the resampled sentence scores, so (n_samples,)
         bs_bl_mean, bl_ci = estimate_ci(bs_scores_bl)
 
         results[metric_name].append(Result(score=real_mean_bl, p_value=None, mean=bs_bl_mean, ci=bl_ci))
 
-        for scores_sys in all_sys_scores:
+        for scores_sys, bs_sys_scores in zip(all_sys_scores, all_bs_sys_scores):
             # The real, final score for this metric (average of all sentence scores)
             real_mean_sys = scores_sys.mean().item()
             # The remainder is borrowed and slightly adapted from sacrebleu
             diff = abs(real_mean_bl - real_mean_sys)
-            # size (n_samples,)
-            bs_sys_scores = scores_sys[idxs].mean(axis=1)
 
             # 1. bs_mean_sys: the "true" mean score estimated from bootstrap resamples of the system
             # 2. sys_ci: the 95% confidence interval around the true mean score `bs_mean_sys`
@@ -57,28 +121,98 @@ def paired_bs(
 
     return dict(results)
 
+def bootstrap_sacrebleu_scores(
+    metric: SbMetric,
+    all_sys_stats: List[np.ndarray],
+    seed,
+    paired_bs_n: int = 1000,
+    max_memory_mb: int = 256,
+) -> List[np.ndarray]:
+    """
+    :param metric: the sacrebleu `Metric` the statistics belong to
+    :param all_sys_stats: one float32 (dataset_size, n_stats) array of segment statistics per system
+    :param seed: seed of the resampling generator, or None
+    :param paired_bs_n: how many resamples to draw
+    :param max_memory_mb: upper bound for the resampled statistics held at once
+    :return: one array per system with the corpus score of every resample.
+    The resamples, float32 sums and score dtypes are the ones sacrebleu's `PairedTest`
+    uses, but each chunk of resamples is summed with one vectorised NumPy call.
+    """
+    rng = np.random.default_rng(seed)
+    dataset_size, n_stats = all_sys_stats[0].shape
+    bytes_per_resample = dataset_size * (8 + 4 * n_stats)
+    chunk = max(1, min(paired_bs_n, max_memory_mb * 1024 * 1024 // bytes_per_resample))
+
+    scores = [[] for _ in all_sys_stats]
+    for start in range(0, paired_bs_n, chunk):
+        rows = min(chunk, paired_bs_n - start)
+        idxs = rng.choice(dataset_size, size=(rows, dataset_size), replace=True)
+        for sys_scores, stats in zip(scores, all_sys_stats):
+            sums = stats[idxs].sum(axis=1)
+            sys_scores.extend(score_from_statistics(metric, s).score for s in sums)
+    return [np.array(sys_scores) for sys_scores in scores]
+
 def paired_bs_sacrebleu(
-    named_systems: List[Tuple[str, List[str]]], metrics: Dict[str, SbMetric], references: List[str], args: Namespace
+    named_systems: List[Tuple[str, List[str]]], metrics: Dict[str, SbMetric], references: List[str], args: Namespace,
+    paired_bs_n: int = 1000,
+    workers: int = None,
+    cache_path: str = CACHE_PATH,
+    max_memory_mb: int = 256,
+    segment_stats: Dict[str, List[list]] = None,
+    seed: int = None,
 ):
     """
+    Paired bootstrap resampling as in sacrebleu's `PairedTest` (test_type="bs"), on
+    per-segment sufficient statistics that are extracted in parallel and cached.
+
     :param named_systems: A lisf of (system_name, system_hypotheses) tuples on
     which the test will be applied.
     :param metrics: A dictionary of `Metric` instances that will be computed
     for each system.
-    :param references: A sequence of reference documents with document being
-    defined as a sequence of reference strings. If `None`, already cached references
-    will be used through each metric's internal cache.
-    :return:
+    :param references: A sequence of reference strings, one per segment.
+    :param paired_bs_n: how many resamples to draw
+    :param workers: processes used to extract uncached statistics, see `segment_statistics`
+    :param cache_path: SQLite file of cached statistics, "" to disable caching
+    :param max_memory_mb: memory bound of the resampling, see `bootstrap_sacrebleu_scores`
+    :param segment_stats: statistics that are already known, {key in `metrics`: one list per system},
+    e.g. as returned by the scoring service; the other metrics are extracted here
+    :param seed: seed of the resamples (default: `bootstrap_seed()`), see `paired_bs`
+    :return: the results per metric name (plus the "System" names) and the formatted signatures
     """
-    res = PairedTest(
-        named_systems=named_systems,
-        metrics=metrics,
-        n_samples=1000,
-        references=[references],
-        test_type="bs",
-    )
-
-    signatures, results = res()
+    seed = bootstrap_seed() if seed is None else seed
+    cache = StatsCache(cache_path)
+
+    results = {"System": [name for name, _ in named_systems]}
+    signatures = {}
+    for key, metric in metrics.items():
+        if segment_stats and key in segment_stats:
+            metric_config_id(metric)  # the signature below needs the number of references
+            all_sys_stats = segment_stats[key]
+        else:
+            all_sys_stats = [segment_statistics(metric, hyps, references, cache, workers) for _, hyps in named_systems]
+        real_scores = [aggregate(metric, stats) for stats in all_sys_stats]
+        bs_scores = bootstrap_sacrebleu_scores(
+            metric, [np.array(stats, dtype="float32") for stats in all_sys_stats], seed, paired_bs_n, max_memory_mb)
+
+        metric_name = real_scores[0].name
+        bs_scores_bl = bs_scores[0]
+        bl_mean, bl_ci = estimate_ci(bs_scores_bl)
+        results[metric_name] = [Result(real_scores[0].score, mean=bl_mean, ci=bl_ci)]
+
+        for sys_score, bs_scores_sys in zip(real_scores[1:], bs_scores[1:]):
+            # original test statistic: absolute difference between baseline and the system
+            diff = abs(real_scores[0].score - sys_score.score)
+            sys_mean, sys_ci = estimate_ci(bs_scores_sys)
+            sample_diffs = np.abs(bs_scores_sys - bs_scores_bl)
+            stats = sample_diffs - sample_diffs.mean()
+            p = _compute_p_value(stats, diff)
+            results[metric_name].append(Result(sys_score.score, p, sys_mean, sys_ci))
+
+        sig = metric.get_signature()
+        sig.update("seed", str(seed).lower())
+        sig.update("bs", paired_bs_n)
+        signatures[metric_name] = sig
+
     signatures = {k: v.format(args.short) for k, v in signatures.items()}
 
-    return results, signatures
\ No newline at end of file
+    return results, signatures
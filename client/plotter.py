@@ -1,7 +1,37 @@
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import numpy as np
+import os
+
+# Above this many points (segments x systems) scatter plots show binned quantiles instead
+SCATTER_MAX_POINTS = int(os.environ.get("LUXEVAL_SCATTER_MAX_POINTS", 20000))
+QUANTILE_BINS = 200
+
+def pyplot():
+    """Import matplotlib on first use, with the headless Agg backend."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def cmap(i: int):
+    return pyplot().get_cmap("Set2")(i)
+
+def render_all(jobs: list, workers: int = None):
+    """
+    Render (plot_function, *args) jobs in parallel worker processes.
+    With workers=1 they are rendered one after another in this process.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        for fn, *args in jobs:
+            fn(*args)
+        return
+    # Spawned, not forked: batch.py renders from several threads, and a fork copies locks other threads hold
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for future in [executor.submit(fn, *args) for fn, *args in jobs]:
+            future.result()
 
-cmap = plt.get_cmap("Set2")
 def bar_plot(dic: dict, output_path: str):
     """
     dic = {
@@ -10,6 +40,7 @@ def bar_plot(dic: dict, output_path: str):
         ...
     }
     """
+    plt = pyplot()
     models = list(dic.keys())
     # Take metric names from the first model
     metrics = list(next(iter(dic.values())).keys())
@@ -43,6 +74,7 @@ def bar_plot(dic: dict, output_path: str):
 
     # Save and show
     plt.savefig(output_path, bbox_inches="tight")
+    plt.close()
     #plt.show()
 
 def radar_plot(dic: dict, output_path: str):
@@ -53,6 +85,7 @@ def radar_plot(dic: dict, output_path: str):
         ...
     }
     """
+    plt = pyplot()
     models = list(dic.keys())
     # Extract metric names from the first model
     metrics = list(next(iter(dic.values())).keys())
@@ -92,10 +125,30 @@ def radar_plot(dic: dict, output_path: str):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig(output_path, bbox_inches='tight')
+    plt.close()
     #plt.show()
 
-def lm_metric_scatter_plot(dic: dict, metric: str, output_path: str):
+def binned_quantiles(scores, bins: int = QUANTILE_BINS):
+    """
+    Split the segments into `bins` consecutive bins and return the bin centres
+    (1-based segment positions) and the 25/50/75% quantiles of each bin.
+    """
+    scores = np.asarray(scores, dtype=float)
+    bin_size = -(-len(scores) // bins)
+    padded = np.full(bins * bin_size, np.nan)
+    padded[:len(scores)] = scores
+    starts = np.arange(bins) * bin_size
+    ends = np.minimum(starts + bin_size, len(scores))
+    filled = starts < len(scores)  # trailing bins may be empty
+    centres = (starts + 1 + ends)[filled] / 2
+    return centres, np.nanquantile(padded.reshape(bins, bin_size)[filled], [0.25, 0.5, 0.75], axis=1)
 
+def lm_metric_scatter_plot(dic: dict, metric: str, output_path: str):
+    """
+    One point per segment and system; above SCATTER_MAX_POINTS points, the
+    median and interquartile range of consecutive segment bins per system.
+    """
+    plt = pyplot()
     title = f"Model Scores - {metric}"
 
     # Define a colormap to dynamically assign colors
@@ -117,8 +170,15 @@ def lm_metric_scatter_plot(dic: dict, metric: str, output_path: str):
     plt.figure(figsize=(fig_width, fig_height))
 
     # Plot each model's scores
-    for i, (model, model_scores) in enumerate(scores.items()):
-        plt.scatter(range(1, num_range + 1), model_scores, color=cmap(i), label=model, alpha=0.6)
+    if num_range * len(models) <= SCATTER_MAX_POINTS:
+        for i, (model, model_scores) in enumerate(scores.items()):
+            plt.scatter(range(1, num_range + 1), model_scores, color=cmap(i), label=model, alpha=0.6)
+    else:
+        title += f" (median and IQR per {-(-num_range // QUANTILE_BINS)} segments)"
+        for i, (model, model_scores) in enumerate(scores.items()):
+            centres, (q25, q50, q75) = binned_quantiles(model_scores)
+            plt.fill_between(centres, q25, q75, color=cmap(i), alpha=0.25, linewidth=0)
+            plt.plot(centres, q50, color=cmap(i), label=model)
 
     # Add labels and title
     plt.xlabel('Segments')
@@ -132,4 +192,5 @@ def lm_metric_scatter_plot(dic: dict, metric: str, output_path: str):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig(output_path, bbox_inches='tight')
+    plt.close()
     #plt.show()
\ No newline at end of file
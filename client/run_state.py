@@ -0,0 +1,78 @@
+"""
+Machine-readable state of an evaluation, saved as run_state.json in its results
+folder: the input files with their fingerprints, the scores of every system and
+metric, the significance results and the bootstrap seed. `client.add_systems`
+scores only new systems and reuses the rest, as long as no input file changed.
+"""
+from corpus import load as load_text
+import json
+import numpy as np
+import os
+from sacrebleu.significance import Result
+
+STATE_FILE = "run_state.json"
+VERSION = 1
+
+def _json_default(obj):
+    """`json.dump` hook writing numpy scalars and arrays as plain Python values."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Cannot encode {type(obj).__name__}")
+
+def file_info(text_file) -> dict:
+    return {"path": os.path.abspath(text_file.path), "sha256": text_file.fingerprint(), "lines": len(text_file)}
+
+def save(folder: str, corpus, metric_flags: dict, language: str, m_dict: dict, ci_results: dict, seed, paired_bs_n: int) -> str:
+    """Write the state of an evaluation to `folder`; `m_dict` and `ci_results` as built by `client.run_evaluation`."""
+    state = {
+        "version": VERSION,
+        "language": language,
+        "metric_flags": metric_flags,
+        "bootstrap": {"seed": seed, "resamples": paired_bs_n},
+        "source": file_info(corpus.source) if corpus.source is not None else None,
+        "reference": file_info(corpus.reference) if corpus.reference is not None else None,
+        "systems": {name: file_info(text_file) for name, text_file in corpus.systems.items()},  # baseline first
+        "scores": {name: {metric: scores for metric, scores in entry.items() if metric != "file_path"} for name, entry in m_dict.items()},
+        "significance": {metric: [{"score": r.score, "p_value": r.p_value, "mean": r.mean, "ci": r.ci} for r in results]
+                         for metric, results in ci_results.items()},
+    }
+    path = os.path.join(folder, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, default=_json_default, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+    return path
+
+def load(folder: str) -> dict:
+    path = os.path.join(folder, STATE_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{folder} has no {STATE_FILE}; it was written by an older version or is not a results folder.")
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("version") != VERSION:
+        raise ValueError(f"{path} has version {state.get('version')}, expected {VERSION}.")
+    return state
+
+def changed_inputs(state: dict) -> list:
+    """Descriptions of the input files of `state` that are missing or were modified since."""
+    files = [("source", state["source"]), ("reference", state["reference"])]
+    files += [(f"system '{name}'", info) for name, info in state["systems"].items()]
+    changed = []
+    for role, info in files:
+        if info is None:
+            continue
+        if not os.path.exists(info["path"]):
+            changed.append(f"{role} file {info['path']} is missing")
+        elif load_text(info["path"]).fingerprint() != info["sha256"]:
+            changed.append(f"{role} file {info['path']} changed")
+    return changed
+
+def m_dict(state: dict) -> dict:
+    """The scores of `state` as `client.run_evaluation` keeps them, {system: {"file_path": path, metric: scores}}."""
+    return {name: {"file_path": state["systems"][name]["path"], **scores} for name, scores in state["scores"].items()}
+
+def ci_results(state: dict) -> dict:
+    """The significance results of `state`, {metric: one `Result` per system}."""
+    return {metric: [Result(r["score"], r["p_value"], r["mean"], r["ci"]) for r in results]
+            for metric, results in state["significance"].items()}
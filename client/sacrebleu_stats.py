@@ -0,0 +1,118 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import multiprocessing
+import os
+from sacrebleu.metrics.base import Metric as SbMetric
+import sqlite3
+from typing import List
+
+# Per-segment statistics are cached here; set LUXEVAL_STATS_CACHE="" to disable
+CACHE_PATH = os.environ.get("LUXEVAL_STATS_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "sacrebleu_stats.sqlite"))
+
+def metric_config_id(metric: SbMetric) -> str:
+    """Identifies the metric configuration (tokenizer, casing, sacrebleu version, ...)."""
+    if not hasattr(metric, "num_refs"):
+        # Set by sacrebleu once references are seen; here every segment has exactly one
+        metric.num_refs = 1
+    return metric.get_signature().format()
+
+def stats_key(config_id: str, hypothesis: str, reference: str) -> str:
+    payload = json.dumps([config_id, hypothesis, reference], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def select_in(conn, query: str, values: list) -> list:
+    """All rows of `query`, whose "IN ({})" is filled with `values` in chunks that stay below SQLite's variable limit."""
+    rows = []
+    for start in range(0, len(values), 500):
+        chunk = values[start:start + 500]
+        rows.extend(conn.execute(query.format(",".join("?" * len(chunk))), chunk).fetchall())
+    return rows
+
+class StatsCache:
+    """SQLite store of per-segment sufficient statistics, keyed by `stats_key`."""
+    def __init__(self, path: str = CACHE_PATH):
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=30)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, stats TEXT NOT NULL)")
+            self._conn.commit()
+
+    def get_many(self, keys: list) -> list:
+        if self._conn is None:
+            return [None] * len(keys)
+        found = {k: json.loads(v) for k, v in select_in(self._conn, "SELECT key, stats FROM stats WHERE key IN ({})", list(set(keys)))}
+        return [found.get(k) for k in keys]
+
+    def put_many(self, keys: list, stats: list):
+        if self._conn is None:
+            return
+        self._conn.executemany("INSERT OR REPLACE INTO stats (key, stats) VALUES (?, ?)",
+                               ((k, json.dumps(s)) for k, s in zip(keys, stats)))
+        self._conn.commit()
+
+# -------- sacrebleu adapter --------
+# The only uses of sacrebleu's private Metric API; tests/test_sacrebleu_stats.py checks them against its public one
+
+def extract_statistics(metric: SbMetric, hypotheses: List[str], references: List[str]) -> list:
+    """One list of sufficient statistics per segment, each with a single reference."""
+    return metric._extract_corpus_statistics(hypotheses, [references])
+
+def score_from_statistics(metric: SbMetric, stats):
+    """The sacrebleu score of one row of (summed) statistics."""
+    return metric._compute_score_from_stats(stats)
+
+def aggregate(metric: SbMetric, stats: list):
+    """The corpus score of per-segment statistics, as `metric.corpus_score` computes it."""
+    return metric._aggregate_and_compute(stats)
+
+def segment_statistics(
+    metric: SbMetric,
+    hypotheses: List[str],
+    references: List[str],
+    cache: StatsCache = None,
+    workers: int = None,
+    chunk_size: int = 2000,
+) -> list:
+    """
+    :param metric: the sacrebleu `Metric` instance
+    :param hypotheses: the system's segments
+    :param references: the reference segments
+    :param cache: where statistics of earlier runs are looked up and new ones stored
+    :param workers: number of processes uncached segments are spread over
+    (default: number of CPUs, if there is more than one chunk to extract)
+    :param chunk_size: segments extracted per task
+    :return: one list of sufficient statistics per segment, as `extract_statistics` returns them
+    """
+    cache = cache or StatsCache("")
+    config_id = metric_config_id(metric)
+    keys = [stats_key(config_id, hyp, ref) for hyp, ref in zip(hypotheses, references)]
+    stats = cache.get_many(keys)
+
+    first_miss = {}
+    for i, (key, s) in enumerate(zip(keys, stats)):
+        if s is None and key not in first_miss:
+            first_miss[key] = i
+
+    if first_miss:
+        idxs = list(first_miss.values())
+        chunks = [idxs[start:start + chunk_size] for start in range(0, len(idxs), chunk_size)]
+        hyp_chunks = [[hypotheses[i] for i in chunk] for chunk in chunks]
+        ref_chunks = [[references[i] for i in chunk] for chunk in chunks]
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if workers > 1 and len(chunks) > 1:
+            # Spawned, since the caller may be one of several scoring threads (see plotter.render_all)
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=multiprocessing.get_context("spawn")) as executor:
+                extracted = list(executor.map(extract_statistics, [metric] * len(chunks), hyp_chunks, ref_chunks))
+        else:
+            extracted = [extract_statistics(metric, h, r) for h, r in zip(hyp_chunks, ref_chunks)]
+
+        computed = [s for chunk_stats in extracted for s in chunk_stats]
+        cache.put_many(list(first_miss), computed)
+        by_key = dict(zip(first_miss, computed))
+        stats = [by_key[k] if s is None else s for k, s in zip(keys, stats)]
+
+    return stats
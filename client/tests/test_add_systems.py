@@ -0,0 +1,23 @@
+import json
+import pytest
+
+import client
+import run_state
+
+def write_state(folder, seed):
+    state = {"version": run_state.VERSION, "language": "en", "metric_flags": {"sacrebleu": True},
+             "bootstrap": {"seed": seed, "resamples": 1000}, "source": None,
+             "reference": {"path": str(folder / "missing.ref"), "sha256": "", "lines": 1},
+             "systems": {"baseline": {"path": str(folder / "missing.txt"), "sha256": "", "lines": 1}},
+             "scores": {"baseline": {}}, "significance": {}}
+    (folder / run_state.STATE_FILE).write_text(json.dumps(state))
+
+def test_refuses_unseeded_run(tmp_path):
+    write_state(tmp_path, seed=None)
+    with pytest.raises(ValueError, match="random bootstrap resamples"):
+        client.add_systems(str(tmp_path), ["new.txt"], ip_url="http://127.0.0.1:1")
+
+def test_seeded_run_passes_the_seed_check(tmp_path):
+    write_state(tmp_path, seed=12345)
+    with pytest.raises(ValueError, match="is missing"):  # refused later, for its missing input files
+        client.add_systems(str(tmp_path), ["new.txt"], ip_url="http://127.0.0.1:1")
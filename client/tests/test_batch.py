@@ -0,0 +1,40 @@
+import pytest
+
+import batch
+
+@pytest.fixture
+def files(tmp_path):
+    for name in ("flores.lb", "flores.de", "baseline.de"):
+        (tmp_path / name).write_text("Moien\n", encoding="utf-8")
+    return tmp_path
+
+def manifest(**job):
+    return {"defaults": {"language": "de", "metrics": ["bertscore", "luxembedder"]},
+            "jobs": [{"name": "flores", "source": "flores.lb", "reference": "flores.de", "systems": ["baseline.de"], **job}]}
+
+def test_valid_manifest(files):
+    [job] = batch.load_jobs(manifest(), str(files))
+    assert job["systems"] == {"baseline": str(files / "baseline.de")}
+    assert job["metric_flags"]["bertscore"] and not job["metric_flags"]["xcometxl"]
+    assert job["directory"] == str(files)
+
+@pytest.mark.parametrize("job, error", [
+    ({"language": "deu"}, "language code should be 2 letters"),
+    ({"metrics": ["bertscore", "meteor"]}, r"unknown: \['meteor'\]"),
+    ({"metrics": []}, "metrics must be a non-empty list"),
+    ({"systems": []}, "no systems given"),
+    ({"source": None}, "a source file is required"),
+    ({"reference": None}, "a reference file is required"),
+    ({"systems": ["missing.de"]}, "missing.de does not exist"),
+])
+def test_invalid_job_is_refused(files, job, error):
+    with pytest.raises(ValueError, match=error):
+        batch.load_jobs(manifest(**job), str(files))
+
+def test_duplicate_names_and_empty_manifests_are_refused(files):
+    twice = manifest()
+    twice["jobs"].append(dict(twice["jobs"][0]))
+    with pytest.raises(ValueError, match="Duplicate job name 'flores'"):
+        batch.load_jobs(twice, str(files))
+    with pytest.raises(ValueError, match="no jobs"):
+        batch.load_jobs({"jobs": []}, str(files))
@@ -0,0 +1,36 @@
+import pytest
+
+import corpus
+
+def write(folder, name, data: bytes):
+    path = folder / name
+    path.write_bytes(data)
+    return str(path)
+
+def test_empty_lines_keep_files_aligned(tmp_path, capsys):
+    reference = write(tmp_path, "ref.txt", "Moien\n\nÄddi\n".encode("utf-8"))
+    system = write(tmp_path, "sys.txt", b"hello\n  \nbye")  # whitespace line, no trailing newline
+    texts = corpus.Corpus({"sys": system}, reference_path=reference)
+
+    assert len(texts) == 3
+    assert list(texts.reference) == ["Moien", "", "Äddi"]
+    assert list(texts.systems["sys"]) == ["hello", "", "bye"]
+    assert texts.systems["sys"].empty_lines() == [2]
+    assert "empty lines" in capsys.readouterr().out
+    assert list(texts.reference[1:]) == ["", "Äddi"]
+
+def test_misaligned_files_are_refused(tmp_path):
+    reference = write(tmp_path, "ref2.txt", b"a\nb\n\n")
+    system = write(tmp_path, "sys2.txt", b"a\nb\n")
+    with pytest.raises(ValueError, match="same number of lines. Got 3 vs 2"):
+        corpus.Corpus({"sys": system}, reference_path=reference)
+
+def test_empty_file_is_refused(tmp_path):
+    reference = write(tmp_path, "ref3.txt", b"a\n")
+    system = write(tmp_path, "sys3.txt", b"")
+    with pytest.raises(ValueError, match="is empty"):
+        corpus.Corpus({"sys": system}, reference_path=reference)
+
+def test_files_are_mapped_once(tmp_path):
+    path = write(tmp_path, "once.txt", b"a\n")
+    assert corpus.load(path) is corpus.load(str(tmp_path / "." / "once.txt"))
@@ -0,0 +1,28 @@
+import openpyxl
+
+import exporter
+import helpers as h
+
+def write(path, columns: dict):
+    workbook = exporter.open_workbook(str(path))
+    exporter.write_segment_sheets(workbook, h.FormatCache(workbook), "BLEU", columns)
+    workbook.close()
+    return openpyxl.load_workbook(str(path), read_only=True)
+
+def rows(sheet) -> list:
+    return [list(row) for row in sheet.iter_rows(values_only=True)]
+
+def test_rows_beyond_the_limit_overflow_into_numbered_sheets(tmp_path, monkeypatch):
+    monkeypatch.setattr(exporter, "XLSX_MAX_ROWS", 4)  # a header and three segments per sheet
+    workbook = write(tmp_path / "results.xlsx", {"segment": list(range(1, 8)), "text": [f"=line {i}" for i in range(1, 8)]})
+
+    assert workbook.sheetnames == ["BLEU", "BLEU (2)", "BLEU (3)"]
+    assert rows(workbook["BLEU"]) == [["segment", "text"], [1, "=line 1"], [2, "=line 2"], [3, "=line 3"]]
+    assert rows(workbook["BLEU (2)"]) == [["segment", "text"], [4, "=line 4"], [5, "=line 5"], [6, "=line 6"]]
+    assert rows(workbook["BLEU (3)"]) == [["segment", "text"], [7, "=line 7"]]  # text, never a formula
+
+def test_a_full_sheet_does_not_start_an_empty_one(tmp_path, monkeypatch):
+    monkeypatch.setattr(exporter, "XLSX_MAX_ROWS", 4)
+    workbook = write(tmp_path / "full.xlsx", {"segment": [1, 2, 3]})
+    assert workbook.sheetnames == ["BLEU"]
+    assert write(tmp_path / "empty.xlsx", {"segment": []}).sheetnames == ["BLEU"]
@@ -0,0 +1,17 @@
+from argparse import Namespace
+from sacrebleu.metrics import BLEU
+
+from paired_bs_test import paired_bs_sacrebleu
+
+REFERENCES = [f"the cat number {i} sat on the mat" for i in range(30)]
+SYSTEMS = [("baseline", [f"the cat {i} sat on a mat" for i in range(30)]),
+           ("other", [f"a cat number {i} sat on the mat" if i % 3 else "nothing" for i in range(30)])]
+
+def run(seed):
+    results, _ = paired_bs_sacrebleu(SYSTEMS, {"bleu": BLEU()}, REFERENCES, Namespace(short=False),
+                                     paired_bs_n=200, workers=1, cache_path="", seed=seed)
+    return [(r.score, r.p_value, r.mean, r.ci) for r in results["BLEU"]]
+
+def test_seed_zero_gives_reproducible_resamples():
+    assert run(0) == run(0)
+    assert run(0) != run(1)
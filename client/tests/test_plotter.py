@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+import plotter
+
+def test_binned_quantiles_cover_every_segment_once():
+    scores = np.arange(1, 11, dtype=float)  # bins of 3: [1-3], [4-6], [7-9], [10]
+    centres, quantiles = plotter.binned_quantiles(scores, bins=4)
+    assert centres.tolist() == [2, 5, 8, 10]
+    assert quantiles[1].tolist() == [2, 5, 8, 10]  # medians
+    assert quantiles[0].tolist() == pytest.approx([1.5, 4.5, 7.5, 10])
+
+def test_trailing_empty_bins_are_dropped():
+    centres, quantiles = plotter.binned_quantiles([0.5, 0.25, 1.0], bins=5)
+    assert centres.tolist() == [1, 2, 3]
+    assert quantiles[1].tolist() == [0.5, 0.25, 1.0]
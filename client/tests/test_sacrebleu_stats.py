@@ -0,0 +1,20 @@
+from sacrebleu.metrics import BLEU, CHRF, TER
+import pytest
+
+from sacrebleu_stats import aggregate, extract_statistics, score_from_statistics
+
+HYPOTHESES = ["the cat sat on the mat", "a dog ran", "", "Ëch hunn en Hond gesinn ."]
+REFERENCES = ["the cat sat on a mat", "the dog ran away", "nothing", "Ech hunn en Hond gesi ."]
+
+@pytest.mark.parametrize("metric", [BLEU(), CHRF(), TER()], ids=["BLEU", "chrF2", "TER"])
+def test_adapter_matches_the_public_api(metric):
+    stats = extract_statistics(metric, HYPOTHESES, REFERENCES)
+    assert len(stats) == len(HYPOTHESES)
+    assert aggregate(metric, stats).score == pytest.approx(metric.corpus_score(HYPOTHESES, [REFERENCES]).score)
+    summed = [sum(column) for column in zip(*stats)]
+    assert score_from_statistics(metric, summed).score == pytest.approx(metric.corpus_score(HYPOTHESES, [REFERENCES]).score)
+
+def test_sentence_scores_match_sentence_bleu():
+    metric = BLEU(effective_order=True)
+    for hypothesis, reference, stats in zip(HYPOTHESES, REFERENCES, extract_statistics(metric, HYPOTHESES, REFERENCES)):
+        assert score_from_statistics(metric, stats).score == pytest.approx(metric.sentence_score(hypothesis, [reference]).score)
@@ -0,0 +1,70 @@
+"""
+Request/response encoding for the gateway: MessagePack bodies and zstd/gzip
+compression when available, plain JSON otherwise. Responses are decompressed by
+`requests` itself: urllib3 only advertises encodings it can decode (gzip, and
+zstd when it has a zstd decoder).
+"""
+import gzip
+import json
+import os
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MIN_COMPRESS_BYTES = 1024  # smaller requests are sent as they are
+
+# "msgpack" or "json"; "zstd", "gzip" or "none"
+FORMAT = os.environ.get("LUXEVAL_WIRE_FORMAT", "msgpack" if msgpack is not None else "json")
+COMPRESSION = os.environ.get("LUXEVAL_WIRE_COMPRESSION", "zstd" if zstandard is not None else "gzip")
+
+# What every service can read: JSON, gzip-compressed when large
+FALLBACK = (JSON, "gzip")
+
+def preferred() -> tuple:
+    """The (content type, compression) requests are sent with first."""
+    return (MSGPACK if FORMAT == "msgpack" and msgpack is not None else JSON, COMPRESSION)
+
+def encode(payload: dict, mode: tuple = None):
+    """Return (body, headers) for posting `payload` as (content type, compression)."""
+    content_type, compression = mode or preferred()
+    if content_type == MSGPACK:
+        body = msgpack.packb(payload, use_bin_type=True)
+    else:
+        body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": content_type, "Accept": f"{MSGPACK}, {JSON};q=0.9" if msgpack is not None else JSON}
+
+    if len(body) >= MIN_COMPRESS_BYTES:
+        if compression == "zstd" and zstandard is not None:
+            body, headers["Content-Encoding"] = zstandard.ZstdCompressor(level=3).compress(body), "zstd"
+        elif compression in ("zstd", "gzip"):
+            body, headers["Content-Encoding"] = gzip.compress(body, compresslevel=5), "gzip"
+    return body, headers
+
+def decode(response) -> dict:
+    """The payload of a (decompressed) `requests` response."""
+    if response.headers.get("Content-Type", "").split(";")[0].strip() == MSGPACK:
+        return msgpack.unpackb(response.content, raw=False)
+    return response.json()
+
+def post(session, url: str, payload: dict, timeout=None, mode: tuple = None):
+    """
+    Post `payload` as `mode` (default: `preferred()`). A service that cannot read
+    it answers 415 and the request is repeated as `FALLBACK`.
+    Returns (response, mode used), so later requests can skip the failed attempt.
+    """
+    mode = mode or preferred()
+    body, headers = encode(payload, mode)
+    response = session.post(url, data=body, headers=headers, timeout=timeout)
+    if response.status_code == 415 and mode != FALLBACK:
+        mode = FALLBACK
+        body, headers = encode(payload, mode)
+        response = session.post(url, data=body, headers=headers, timeout=timeout)
+    return response, mode
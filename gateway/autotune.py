@@ -0,0 +1,216 @@
+"""
+Batch limits tuned per model and device. A limit is a service's padded-token budget
+(or, for BLEURT, its batch size). Unless it is set explicitly, a service looks the
+limit up in LUXEVAL_BATCH_TUNING at startup and probes for it if this model has not
+been tuned on this device yet: it doubles the limit on a set of sample sentences
+while that fits in memory and still makes scoring faster, and keeps the fastest.
+POST /autotune probes again. A batch that still runs out of memory is halved and
+retried, and the limit lowered to what fitted.
+"""
+from contextlib import contextmanager
+import fcntl
+import gc
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+TUNING_FILE = os.environ.get("LUXEVAL_BATCH_TUNING", "./cache/batch_tuning.json")
+# LUXEVAL_AUTOTUNE=0 uses the defaults instead of probing
+AUTOTUNE = os.environ.get("LUXEVAL_AUTOTUNE", "1") != "0"
+MAX_FACTOR = 32          # largest limit probed, relative to the default
+MIN_GAIN = 0.05          # a larger limit must be this much faster to count as better
+PATIENCE = 2             # doublings without a gain before probing stops
+MAX_PROBE_SECONDS = 20   # a batch slower than this is not doubled again
+
+SAMPLE = ("D'Iwwersetzung vun dësem Saz gëtt mat enger Referenz verglach , fir ze moossen wéi gutt "
+          "de System d'Bedeitung vum Original op Lëtzebuergesch an an aner Sprooche weiderginn huet .").split()
+
+def is_oom(e: Exception) -> bool:
+    """Whether `e` means the device ran out of memory (torch, TensorFlow or host)."""
+    return (isinstance(e, MemoryError) or type(e).__name__ in ("OutOfMemoryError", "ResourceExhaustedError")
+            or "out of memory" in str(e).lower())
+
+def free_memory():
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def _cpu_name() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+def torch_device(backend: str) -> str:
+    """The hardware a torch model runs on with `backend` (see cpu_backend), as tuning results are keyed."""
+    import cpu_backend
+    import torch
+    if cpu_backend.device(backend) == "cuda":
+        name = torch.cuda.get_device_name(torch.cuda.current_device())
+    else:
+        name = f"{_cpu_name()} x{torch.get_num_threads()}"
+    return f"{name} int8" if backend == "cpu-int8" else name
+
+def tensorflow_device() -> str:
+    """The hardware TensorFlow runs on, as tuning results are keyed."""
+    import tensorflow as tf
+    gpus = tf.config.get_visible_devices("GPU")
+    if gpus:
+        return tf.config.experimental.get_device_details(gpus[0]).get("device_name", gpus[0].name)
+    return f"{_cpu_name()} x{tf.config.threading.get_intra_op_parallelism_threads() or os.cpu_count()}"
+
+def probe_texts(limit: int, lengths=None, start: int = 0) -> list:
+    """
+    Distinct sample sentences filling one batch: `limit` of them, or with
+    `lengths(texts) -> token counts`, as many as fit in `limit` padded tokens.
+    """
+    def sentences(count):
+        return [f"{i} " + " ".join(SAMPLE[(i + j) % len(SAMPLE)] for j in range(len(SAMPLE))) for i in range(start, start + count)]
+    count = limit if lengths is None else max(1, limit // max(lengths(sentences(8))))
+    return sentences(count)
+
+# -------- Persistence --------
+@contextmanager
+def _locked():
+    """Serialise probing and writing between processes, e.g. replicas that start together."""
+    os.makedirs(os.path.dirname(TUNING_FILE) or ".", exist_ok=True)
+    with open(TUNING_FILE + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def _load() -> dict:
+    try:
+        with open(TUNING_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _save(key: str, result: dict):
+    tuned = _load()
+    tuned[key] = result
+    with open(TUNING_FILE + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(tuned, f, indent=2)
+    os.replace(TUNING_FILE + ".tmp", TUNING_FILE)
+
+class BatchLimit:
+    """
+    The batch limit `setting` (e.g. COMET_MAX_TOKENS) of one model on one device.
+    Its lock only covers changes of the limit; model calls made through `guard` run concurrently.
+    """
+    def __init__(self, setting: str, model: str, device: str, default: int, minimum: int = 1):
+        self.setting = setting
+        self.key = f"{setting} | {model} | {device}"
+        self.default = default
+        self.minimum = minimum
+        self.fixed = setting in os.environ
+        self.value = int(os.environ[setting]) if self.fixed else default
+        self._targets = []
+        self._lock = threading.Lock()
+
+    def bind(self, obj, attribute: str):
+        """Keep `obj.attribute` (e.g. a MicroBatcher's max_tokens) equal to the limit."""
+        self._targets.append((obj, attribute))
+        setattr(obj, attribute, self.value)
+
+    def _set(self, value: int):
+        with self._lock:
+            self._update(value)
+
+    def _update(self, value: int):
+        self.value = value
+        for obj, attribute in self._targets:
+            setattr(obj, attribute, value)
+
+    def start(self, probe) -> int:
+        """Use the tuned limit of this model and device, probing for it first if there is none; see `tune`."""
+        if self.fixed or not AUTOTUNE or not self.value:
+            return self.value
+        with _locked():
+            result = _load().get(self.key)
+            if result is None:
+                result = self._probe(probe)
+                _save(self.key, result)
+        self._set(result["value"])
+        return self.value
+
+    def tune(self, probe) -> dict:
+        """
+        Probe for the fastest limit that fits in memory, persist and use it. `probe(limit)`
+        scores one batch filling `limit` and returns the number of segments it scored.
+        """
+        with _locked():
+            result = self._probe(probe)
+            _save(self.key, result)
+        self._set(result["value"])
+        return result
+
+    def _probe(self, probe) -> dict:
+        limit, best, stalled, probes = max(self.minimum, self.default // 8), None, 0, {}
+        while limit <= self.default * MAX_FACTOR and stalled < PATIENCE:
+            oom = False
+            try:
+                probe(limit)  # allocations and kernel selection happen in the first batch of a size
+                start = time.perf_counter()
+                segments = probe(limit)
+                seconds = time.perf_counter() - start
+            except Exception as e:
+                if not is_oom(e):
+                    raise
+                oom = True
+            if oom:
+                free_memory()
+                probes[str(limit)] = "out of memory"
+                break
+
+            rate = segments / max(seconds, 1e-9)
+            probes[str(limit)] = round(rate, 1)
+            stalled = 0 if best is None or rate > best[1] * (1 + MIN_GAIN) else stalled + 1
+            if best is None or rate > best[1]:
+                best = (limit, rate)
+            if seconds > MAX_PROBE_SECONDS:
+                break
+            limit *= 2
+
+        if best is None:
+            raise RuntimeError(f"{self.key}: a batch of {limit} does not fit in memory")
+        print(f"{self.key}: tuned {self.setting}={best[0]} ({best[1]:.1f} segments/s)")
+        return {"value": best[0], "segments_per_second": round(best[1], 1), "probes": probes,
+                "tuned": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+    def shrink(self, failed: int):
+        """Lower the limit below a batch of `failed` that ran out of memory, and persist it."""
+        with self._lock:  # concurrent batches that ran out of memory lower it once
+            value = max(self.minimum, min(self.value, failed // 2))
+            if value == self.value or not self.value:
+                return
+            print(f"{self.key}: out of memory at {failed}, lowering {self.setting} to {value}")
+            self._update(value)
+        if not self.fixed and AUTOTUNE:
+            with _locked():
+                result = _load().get(self.key) or {}
+                _save(self.key, {**result, "value": value, "shrunk": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    def guard(self, fn, size=len):
+        """
+        Wrap a batch function `fn(items) -> results`. A batch that runs out of memory
+        is halved and retried, and the limit lowered below its `size(items)`.
+        """
+        def run(items):
+            try:
+                return list(fn(items))
+            except Exception as e:
+                if not is_oom(e) or len(items) <= 1:
+                    raise
+                free_memory()  # outside the except block, which still references the batch's tensors
+                self.shrink(size(items))
+                middle = len(items) // 2
+                return run(items[:middle]) + run(items[middle:])
+        return run
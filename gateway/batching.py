@@ -0,0 +1,160 @@
+from collections import deque
+import os
+import threading
+import time
+
+def batch_settings(service: str, max_batch_size, max_wait_ms: int):
+    """Read <SERVICE>_MAX_BATCH and <SERVICE>_MAX_WAIT_MS, falling back to the given defaults (None: no item limit)."""
+    prefix = service.upper()
+    max_batch_size = os.environ.get(f"{prefix}_MAX_BATCH", max_batch_size)
+    return (int(max_batch_size) if max_batch_size is not None else None,
+            int(os.environ.get(f"{prefix}_MAX_WAIT_MS", max_wait_ms)) / 1000)
+
+def tokenized_lengths(tokenizer, max_length: int = 512):
+    """Return a function giving the number of tokens of each text, as the model will see them."""
+    def lengths(texts: list) -> list:
+        return [len(ids) for ids in tokenizer(list(texts), truncation=True, max_length=max_length)["input_ids"]]
+    return lengths
+
+def fits(count: int, longest: int, max_tokens: int) -> bool:
+    """Whether `count` items padded to `longest` tokens stay within the budget (always true for one item)."""
+    return count <= 1 or not max_tokens or count * longest <= max_tokens
+
+def token_batches(lengths: list, max_tokens: int, max_batch_size: int = None) -> list:
+    """
+    Split positions 0..len(lengths)-1 into batches of similar length, longest first,
+    each within `max_tokens` padded tokens and `max_batch_size` items.
+    """
+    batches, batch, longest = [], [], 0
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        if batch and (len(batch) == max_batch_size or not fits(len(batch) + 1, max(longest, lengths[i]), max_tokens)):
+            batches.append(batch)
+            batch, longest = [], 0
+        batch.append(i)
+        longest = max(longest, lengths[i])
+    if batch:
+        batches.append(batch)
+    return batches
+
+class _Job:
+    def __init__(self, items: list, lengths: list = None):
+        self.items = items
+        self.lengths = lengths
+        # Items are handed out longest first, so batches hold items of similar length
+        self.order = sorted(range(len(items)), key=lambda i: -lengths[i]) if lengths is not None else range(len(items))
+        self.results = [None] * len(items)
+        self.next = 0  # items handed to a batch so far, in `order`
+        self.remaining = len(items)
+        self.error = None
+        self.done = threading.Event()
+
+class MicroBatcher:
+    """
+    Coalesces the items submitted by concurrent requests into model batches.
+
+    A single worker thread collects queued items until `max_batch_size` is reached
+    or `max_wait` seconds have passed since the first one arrived, runs
+    `fn(items) -> results` on them and hands every request its own results back.
+    Requests larger than a batch are split over several batches.
+
+    With `lengths(items) -> token counts`, every request's items are batched
+    longest first and a batch also stops before `max_tokens` padded tokens, so
+    short items run in large batches and little compute goes to padding. Results
+    are returned in the order the items were submitted. `max_batch_size=None`
+    leaves the batch size to the token budget alone.
+    """
+    def __init__(self, fn, max_batch_size: int = 64, max_wait: float = 0.01, lengths=None, max_tokens: int = 0):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.lengths = lengths
+        self.max_tokens = max_tokens
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, items: list) -> list:
+        """Block until all items are processed and return their results in order."""
+        if not items:
+            return []
+        items = list(items)
+        job = _Job(items, self.lengths(items) if self.lengths is not None else None)
+        with self._cond:
+            self._pending.append(job)
+            self._cond.notify()
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.results
+
+    def depth(self) -> int:
+        """Number of submitted items still waiting for a batch."""
+        with self._cond:
+            return self._queued()
+
+    def _queued(self) -> int:
+        return sum(len(job.items) - job.next for job in self._pending)
+
+    def _full(self) -> bool:
+        """Whether the queued items fill a batch, so it need not wait for more."""
+        if self.max_batch_size is not None and self._queued() >= self.max_batch_size:
+            return True
+        if self.lengths is None or not self.max_tokens:
+            return False
+        tokens = 0
+        for job in self._pending:
+            for position in job.order[job.next:]:
+                tokens += job.lengths[position]
+                if tokens >= self.max_tokens:
+                    return True
+        return False
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while not self._full():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []  # (job, item position)
+            longest = 0
+            while self._pending and (self.max_batch_size is None or len(batch) < self.max_batch_size):
+                job = self._pending[0]
+                position = job.order[job.next]
+                if job.lengths is not None:
+                    if not fits(len(batch) + 1, max(longest, job.lengths[position]), self.max_tokens):
+                        break
+                    longest = max(longest, job.lengths[position])
+                batch.append((job, position))
+                job.next += 1
+                if job.next == len(job.items):
+                    self._pending.popleft()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            jobs = {id(job): job for job, _ in batch}.values()
+            try:
+                results = list(self.fn([job.items[position] for job, position in batch]))
+            except Exception as e:
+                with self._cond:
+                    for job in jobs:
+                        if job in self._pending:
+                            self._pending.remove(job)
+                for job in jobs:
+                    job.error = e
+                    job.done.set()
+                continue
+
+            for (job, position), result in zip(batch, results):
+                job.results[position] = result
+                job.remaining -= 1
+            for job in jobs:
+                if job.remaining == 0 and job.error is None:
+                    job.done.set()
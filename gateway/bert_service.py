@@ -1,14 +1,28 @@
+import autotune
+from batching import token_batches, tokenized_lengths
 from bert_score import BERTScorer
-from flask import Flask, request, jsonify
+from bert_score.utils import get_bert_embedding, greedy_cos_idf
+from collections import OrderedDict, defaultdict
+import cpu_backend
+from flask import Flask
+import multi_system
 import os
 from sacrebleu.metrics import BLEU, CHRF, TER
+from score_cache import ScoreCache, segment_keys
+import service_metrics
+import surface_metrics
 import sys
+import threading
+import torch
+from torch.nn.utils.rnn import pad_sequence
 from waitress import serve
+import wire
 
 # Run on GPU 0
 #os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
 app = Flask(__name__)
+service_metrics.instrument(app)
 port = int(sys.argv[1]) if len(sys.argv) > 1 else 5002
 
 @app.route("/")
@@ -16,31 +30,218 @@ def health():
     return "BERTSCORE and BLEU service are running", 200
 
 
+# -------- Scorer pool --------
+ENGLISH_MODEL = "/home/nils/nilseval/models/models--microsoft--deberta-xlarge-mnli/snapshots/5b07a9086c1dbb79981ff7b05b4d1ad83b3af51c"
+MULTILINGUAL_MODEL = "/home/nils/nilseval/models/models--FacebookAI--xlm-roberta-large/snapshots/c23d21b0620b635a76227c604d44e43a9f0ee389"
+RESCALE_WITH_BASELINE = False
+
+# Memory budget (MB) for resident scorers and languages to load at startup
+POOL_BUDGET_MB = int(os.environ.get("BERTSCORE_POOL_MB", "8000"))
+WARM_LANGUAGES = [l for l in os.environ.get("BERTSCORE_WARM_LANGS", "en,de").split(",") if l.strip()]
+# See cpu_backend for BERTSCORE_BACKEND
+BACKEND = cpu_backend.backend("bertscore")
+cpu_backend.configure_torch(BACKEND)
+# Padded tokens per forward pass, tuned per model unless BERTSCORE_MAX_TOKENS is set; see `score_pairs`
+DEFAULT_MAX_TOKENS = 32768
+
+def resolve_model(language: str):
+    """Return (model_path, num_layers) used for the given target language."""
+    if language in ["en", "english", "eng"]:
+        return ENGLISH_MODEL, 40
+    return MULTILINGUAL_MODEL, 17
+
+def scorer_key(language: str):
+    """Pool key of the scorer for a language; also identifies its scores in the cache."""
+    model_path, num_layers = resolve_model(language)
+    # lang only changes the output when rescaling with a baseline
+    return model_path, num_layers, language if RESCALE_WITH_BASELINE else None
+
+class ScorerPool:
+    """
+    Keeps loaded BERTScorer instances resident, keyed by (model_path, num_layers, lang).
+    Least recently used scorers are evicted once the approximate parameter memory
+    exceeds the budget; the most recently used scorer is always kept. The token
+    budget of every model that was loaded is kept in `limits`. Models are loaded
+    and tuned outside the pool's lock, so resident scorers keep serving meanwhile.
+    """
+    def __init__(self, budget_mb: int):
+        self.budget = budget_mb * 1024 * 1024
+        self._scorers = OrderedDict()
+        self._sizes = {}
+        self._loading = {}  # key -> Event set once its scorer is loaded (or failed to load)
+        self.limits = {}
+        self._lock = threading.Lock()
+
+    def get(self, language: str) -> BERTScorer:
+        key = scorer_key(language)
+        while True:
+            with self._lock:
+                if key in self._scorers:
+                    self._scorers.move_to_end(key)
+                    return self._scorers[key]
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    break
+            # Another request is loading this model; requests for resident scorers are not held up meanwhile
+            loading.wait()
+
+        try:
+            scorer, size = self._load(key, language)
+            with self._lock:
+                self._sizes[key] = size
+                self._scorers[key] = scorer
+                self._evict()
+            return scorer
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+
+    def _load(self, key, language: str):
+        """Build (and, the first time, tune) the scorer of `key`; returns (scorer, fp32 parameter bytes)."""
+        model_path, num_layers, _ = key
+        scorer = BERTScorer(model_type=model_path, num_layers=num_layers, lang=language, rescale_with_baseline=RESCALE_WITH_BASELINE,
+                            device=cpu_backend.device(BACKEND))
+        # fp32 size, an upper bound for int8 models
+        size = sum(p.numel() * p.element_size() for p in scorer._model.parameters())
+        if BACKEND == "cpu-int8":
+            quantize_scorer(scorer, language)
+        if key not in self.limits:
+            limit = autotune.BatchLimit("BERTSCORE_MAX_TOKENS", model_path, autotune.torch_device(BACKEND), DEFAULT_MAX_TOKENS, minimum=1024)
+            limit.start(probe(scorer))
+            self.limits[key] = limit
+        return scorer, size
+
+    def tune(self) -> dict:
+        """Tune the token budget of every resident model again; see `autotune`."""
+        with self._lock:
+            scorers = list(self._scorers.items())
+        return {self.limits[key].key: self.limits[key].tune(probe(scorer)) for key, scorer in scorers}
+
+    def _evict(self):
+        evicted = False
+        while len(self._scorers) > 1 and sum(self._sizes.values()) > self.budget:
+            key, _ = self._scorers.popitem(last=False)
+            del self._sizes[key]
+            print(f"Evicted BERTScorer {key[0]} from pool")
+            evicted = True
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+# Forks the sacrebleu workers, before any scorer touches the GPU
+segment_scorer = surface_metrics.SegmentScorer()
+
+def quantize_scorer(scorer: BERTScorer, language: str):
+    """Swap the scorer's model for its int8 version, comparing both on the calibration set first."""
+    fp32_model, int8_model = scorer._model, cpu_backend.quantize(scorer._model)
+
+    def score_with(model):
+        def score(items):
+            scorer._model = model
+            P, R, F1 = scorer.score([i["candidate"] for i in items], [i["reference"] for i in items])
+            return (F1 * 100).tolist()
+        return score
+
+    cpu_backend.calibrate(f"bertscore_{language}", score_with(fp32_model), score_with(int8_model))
+    scorer._model = int8_model
+
+def score_pairs(scorer: BERTScorer, candidates: list, references: list, max_tokens: int) -> list:
+    """
+    BERTScore F1 * 100 of each candidate and reference pair, as `scorer.score` computes it.
+    Every distinct sentence is embedded once, but in batches of similar length that each
+    stay within `max_tokens` padded tokens (64 sentences when 0), so short sentences run
+    in large batches even when the request also holds long ones.
+    """
+    tokenizer, device = scorer._tokenizer, next(scorer._model.parameters()).device
+    idf = defaultdict(lambda: 1.0)  # no idf weighting, as in BERTScorer
+    idf[tokenizer.sep_token_id] = idf[tokenizer.cls_token_id] = 0
+    max_batch_size = None if max_tokens else 64
+    sentences = list(dict.fromkeys(candidates + references))
+    embedded = {}
+    with torch.no_grad():
+        for batch in token_batches(tokenized_lengths(tokenizer)(sentences), max_tokens, max_batch_size):
+            texts = [sentences[i] for i in batch]
+            embeddings, masks, weights = get_bert_embedding(texts, scorer._model, tokenizer, idf, device=scorer.device)
+            for text, embedding, mask, weight in zip(texts, embeddings.cpu(), masks.cpu(), weights.cpu()):
+                length = int(mask.sum())
+                embedded[text] = (embedding[:length], weight[:length])
+
+        def padded(texts: list):
+            embeddings, weights = zip(*(embedded[text] for text in texts))
+            lengths = torch.tensor([len(embedding) for embedding in embeddings])
+            mask = torch.arange(int(lengths.max()))[None, :] < lengths[:, None]
+            return (pad_sequence(embeddings, batch_first=True, padding_value=2.0).to(device), mask.to(device),
+                    pad_sequence(weights, batch_first=True).to(device))
+
+        scores = [None] * len(candidates)
+        pair_lengths = [max(len(embedded[c][0]), len(embedded[r][0])) for c, r in zip(candidates, references)]
+        for batch in token_batches(pair_lengths, max_tokens, max_batch_size):
+            _, _, F1 = greedy_cos_idf(*padded([references[i] for i in batch]), *padded([candidates[i] for i in batch]))
+            if scorer.rescale_with_baseline:
+                F1 = (F1 - scorer.baseline_vals[2]) / (1 - scorer.baseline_vals[2])
+            for i, score in zip(batch, (F1.cpu() * 100).tolist()):
+                scores[i] = score
+    return scores
+
+def probe(scorer: BERTScorer):
+    """Score one batch of sample sentences filling a token budget, see `autotune`."""
+    count_tokens = tokenized_lengths(scorer._tokenizer)
+    def run(limit: int) -> int:
+        candidates = autotune.probe_texts(limit, count_tokens)
+        references = autotune.probe_texts(limit, count_tokens, start=len(candidates))
+        score_pairs(scorer, candidates, references, limit)
+        return len(candidates)
+    return run
+
+pool = ScorerPool(POOL_BUDGET_MB)
+for lang in WARM_LANGUAGES:
+    pool.get(lang.strip().lower())
+
+cache = ScoreCache()
+
 @app.route('/bertscore', methods=['POST'])
 def bertscore():
-    data = request.json
+    data = wire.request_data()
     references = data.get('references', [])
-    candidates = data.get('candidates', [])
     language = data.get("language", "").lower()
+    systems = data.get('systems')
 
-    if not references or not candidates or len(references) != len(candidates):
-        return jsonify({'error': 'Invalid input'}), 400
-
-    if language in ["en", "english", "eng"]:
-        model_path = "/home/nils/nilseval/models/models--microsoft--deberta-xlarge-mnli/snapshots/5b07a9086c1dbb79981ff7b05b4d1ad83b3af51c"
-        num_layers = 40
+    if systems is not None:
+        # Multi-system mode: references shared by all systems are only embedded once
+        if not multi_system.valid(references, systems):
+            return wire.respond({'error': 'Invalid input'}, 400)
+        references, candidates, spans = multi_system.flatten(references, systems)
     else:
-        model_path = "/home/nils/nilseval/models/models--FacebookAI--xlm-roberta-large/snapshots/c23d21b0620b635a76227c604d44e43a9f0ee389"
-        num_layers = 17
+        candidates = data.get('candidates', [])
+        if not references or not candidates or len(references) != len(candidates):
+            return wire.respond({'error': 'Invalid input'}, 400)
+
+    model_path, num_layers, lang = scorer_key(language)
+    keys = segment_keys("bertscore", model_path, cpu_backend.cache_config(BACKEND, {"num_layers": num_layers, "lang": lang}), candidates, references=references)
+
+    def compute(idxs):
+        scorer = pool.get(language)
+        limit = pool.limits[scorer_key(language)]
+
+        def score(items: list) -> list:
+            # One call per request, so sentences shared by several systems are embedded once
+            return score_pairs(scorer, [candidates[i] for i in items], [references[i] for i in items], limit.value)
+        return limit.guard(score, lambda items: limit.value)(idxs)
 
-    scorer = BERTScorer(model_type=model_path, num_layers=num_layers, lang=language, rescale_with_baseline=False)
-    P, R, F1 = scorer.score(candidates, references) # precision, recall, harmonic mean
-    F1 = F1 * 100
-    return jsonify({"bert_scores": F1.tolist()})
+    scores, cache_stats = cache.lookup(keys, compute)
+    service_metrics.record_segments("/bertscore", len(keys), cache_stats)
+    if systems is not None:
+        scores = multi_system.split(scores, spans)
+    return wire.respond({"bert_scores": scores, "cache": cache_stats})
+
+@app.route('/autotune', methods=['POST'])
+def autotune_batches():
+    return wire.respond(pool.tune())
 
 @app.route('/sacrebleu', methods=['POST'])
 def sacrebleu():
-    data = request.json
+    data = wire.request_data()
     references = [data.get('references', [])]
     candidates = data.get('candidates', [])
 
@@ -52,8 +253,43 @@ def sacrebleu():
 
     ter = TER()
     ter_scores = ter.corpus_score(candidates, references)
+    service_metrics.record_segments("/sacrebleu", len(candidates))
+
+    return wire.respond({'bleu_score': bleu_scores.score, "chrF2": chrF2.score, "TER": ter_scores.score})
 
-    return jsonify({'bleu_score': bleu_scores.score, "chrF2": chrF2.score, "TER": ter_scores.score})
+@app.route('/sacrebleu_segments', methods=['POST'])
+def sacrebleu_segments():
+    data = wire.request_data()
+    references = data.get('references', [])
+    systems = data.get('systems')
+
+    if systems is not None:
+        if not multi_system.valid(references, systems):
+            return wire.respond({'error': 'Invalid input'}, 400)
+        references, candidates, spans = multi_system.flatten(references, systems)
+    else:
+        candidates = data.get('candidates', [])
+        if not references or not candidates or len(references) != len(candidates):
+            return wire.respond({'error': 'Invalid input'}, 400)
+        spans = None
+
+    scored = segment_scorer.score(candidates, references)
+    service_metrics.record_segments("/sacrebleu_segments", len(candidates))
+
+    def result(start=None, end=None):
+        stats = {name: s["stats"][start:end] for name, s in scored.items()}
+        return {
+            "scores": {name: s["scores"][start:end] for name, s in scored.items()},
+            "stats": stats,
+            "corpus": surface_metrics.corpus_scores(stats),
+        }
+
+    # Statistics can be summed across requests into corpus scores, see `signatures` for their configuration
+    if spans is not None:
+        results = {name: result(start, end) for name, (start, end) in spans.items()}
+    else:
+        results = result()
+    return wire.respond({"sacrebleu_scores": results, "signatures": surface_metrics.signatures()})
 
 if __name__ == "__main__":
     serve(app, host="0.0.0.0", port=port)
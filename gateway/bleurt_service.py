@@ -1,13 +1,21 @@
+import autotune
+from batching import MicroBatcher, batch_settings
 from bleurt import score
-from flask import Flask, request, jsonify
+import cpu_backend
+from flask import Flask
+import multi_system
 import os
+from score_cache import ScoreCache, segment_keys
+import service_metrics
 import sys
 from waitress import serve
+import wire
 
 # Run on GPU 0
 #os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
 app = Flask(__name__)
+service_metrics.instrument(app)
 port = int(sys.argv[1]) if len(sys.argv) > 1 else 5001
 
 @app.route("/")
@@ -16,21 +24,60 @@ def health():
 
 
 checkpoint = "" # ENTER CHECKPOINT
+# BLEURT is a TensorFlow model, so BLEURT_BACKEND=cpu-int8 runs fp32 on the CPU
+backend = cpu_backend.backend("bleurt", int8=False)
+cpu_backend.configure_tensorflow(backend)
 scorer = score.BleurtScorer(checkpoint)
+cache = ScoreCache()
+
+def score_pairs(pairs: list) -> list:
+    """Score one coalesced batch of (reference, candidate) pairs."""
+    res = scorer.score(references=[ref for ref, _ in pairs], candidates=[cand for _, cand in pairs], batch_size=len(pairs))
+    for i in range(len(res)):
+        res[i] = res[i] * 100
+    return res
+
+def probe(limit: int) -> int:
+    texts = autotune.probe_texts(limit)
+    return len(score_pairs(list(zip(texts, texts))))
+
+# BLEURT pads every input to the same length, so the batch size is tuned instead of a token budget
+batch_size = autotune.BatchLimit("BLEURT_MAX_BATCH", checkpoint, autotune.tensorflow_device(), 64, minimum=8)
+batch_size.start(probe)
+batcher = MicroBatcher(service_metrics.observe_batches(batch_size.guard(score_pairs)), *batch_settings("bleurt", batch_size.value, 10))
+batch_size.bind(batcher, "max_batch_size")
+service_metrics.queue_depth(batcher.depth)
+
+@app.route('/autotune', methods=['POST'])
+def autotune_batches():
+    return wire.respond({batch_size.key: batch_size.tune(probe)})
 
 @app.route('/bleurt20', methods=['POST'])
 def bleurtscore():
-    data = request.json
+    data = wire.request_data()
     references = data.get('references', [])
-    candidates = data.get('candidates', [])
+    systems = data.get('systems')
 
-    if not references or not candidates or len(references) != len(candidates):
-        return jsonify({'error': 'Invalid input: references and candidates must be non-empty and of equal length'}), 400
+    if systems is not None:
+        # Multi-system mode: all systems are scored in the same batches
+        if not multi_system.valid(references, systems):
+            return wire.respond({'error': 'Invalid input: every system must have as many candidates as there are references'}, 400)
+        references, candidates, spans = multi_system.flatten(references, systems)
+    else:
+        candidates = data.get('candidates', [])
+        if not references or not candidates or len(references) != len(candidates):
+            return wire.respond({'error': 'Invalid input: references and candidates must be non-empty and of equal length'}, 400)
 
-    res = scorer.score(references=references, candidates=candidates)
-    for i in range(len(res)):
-        res[i] = res[i] * 100
-    return jsonify({'bleurt_scores': res})
+    keys = segment_keys("bleurt20", checkpoint, {}, candidates, references=references)
+
+    def compute(idxs):
+        return batcher.submit([(references[i], candidates[i]) for i in idxs])
+
+    res, cache_stats = cache.lookup(keys, compute)
+    service_metrics.record_segments("/bleurt20", len(keys), cache_stats)
+    if systems is not None:
+        res = multi_system.split(res, spans)
+    return wire.respond({'bleurt_scores': res, 'cache': cache_stats})
 
 if __name__ == "__main__":
     serve(app, host="0.0.0.0", port=port)
@@ -0,0 +1,93 @@
+import asyncio
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+import hashlib
+import os
+import time
+
+# Requests up to this size are buffered, fingerprinted and coalesced; larger ones are streamed
+COALESCE_MAX_BYTES = int(float(os.environ.get("GATEWAY_COALESCE_MAX_MB", "16")) * 1024 * 1024)
+# Successful responses are reused for identical requests for this many seconds (0 disables)
+RESPONSE_TTL = float(os.environ.get("GATEWAY_RESPONSE_TTL", "30"))
+RESPONSE_CACHE_BYTES = int(float(os.environ.get("GATEWAY_RESPONSE_CACHE_MB", "256")) * 1024 * 1024)
+
+BufferedResponse = namedtuple("BufferedResponse", ["status", "headers", "body"])
+
+def fingerprint(endpoint: str, headers: dict, body: bytes) -> str:
+    """Identifies a request by endpoint, the forwarded headers (encodings) and the exact body bytes."""
+    h = hashlib.sha256(endpoint.encode("utf-8"))
+    for k in sorted(headers):
+        h.update(f"\n{k.lower()}:{headers[k]}".encode("utf-8"))
+    h.update(b"\n\n")
+    h.update(body)
+    return h.hexdigest()
+
+class ResponseCache:
+    """Recent responses by fingerprint; entries expire after `ttl` seconds, the oldest go first when over budget."""
+    def __init__(self, ttl: float = RESPONSE_TTL, max_bytes: int = RESPONSE_CACHE_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # fingerprint -> (expires, response)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            return None
+        return entry[1]
+
+    def put(self, key: str, response: BufferedResponse):
+        if self.ttl <= 0 or len(response.body) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, response)
+        self.size += len(response.body)
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str):
+        _, response = self._entries.pop(key)
+        self.size -= len(response.body)
+
+class Coalescer:
+    """
+    Singleflight for identical requests: the first one is sent to the backend and
+    every identical request arriving while it runs waits for the same response.
+    Successful responses are then kept in a `ResponseCache` for a short while.
+    """
+    def __init__(self, cache: ResponseCache = None):
+        self.cache = cache or ResponseCache()
+        self.stats = defaultdict(Counter)  # service -> {"computed", "coalesced", "cache_hits", "streamed"}
+        self._in_flight = {}  # fingerprint -> asyncio.Task
+
+    async def run(self, service: str, key: str, fetch) -> BufferedResponse:
+        """Return the response for `key`, calling `fetch()` only if no identical request is running or cached."""
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats[service]["cache_hits"] += 1
+            return cached
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.stats[service]["computed"] += 1
+            task = asyncio.ensure_future(fetch())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.stats[service]["coalesced"] += 1
+        # A client that disconnects must not cancel the fetch others are waiting for
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is None and task.result().status == 200:
+            self.cache.put(key, task.result())
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
@@ -1,14 +1,22 @@
-from comet import download_model, load_from_checkpoint
-import os
-from flask import Flask, request, jsonify
+import autotune
+from batching import MicroBatcher, batch_settings, tokenized_lengths
+from comet import load_from_checkpoint
+import cpu_backend
 import os
+from flask import Flask
+import model_store
+import multi_system
+from score_cache import ScoreCache, segment_keys
+import service_metrics
 import sys
 from waitress import serve
+import wire
 
 # Run on GPU 0
 #os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
 app = Flask(__name__)
+service_metrics.instrument(app)
 port = int(sys.argv[1]) if len(sys.argv) > 1 else 5008
 
 @app.route("/")
@@ -16,33 +24,86 @@ def health():
     return "COMET service is running", 200
 
 
-model_path = download_model("Unbabel/XCOMET-XL")
-model = load_from_checkpoint(model_path)
+# COMET_BACKEND=cpu predicts on the CPU; COMET_GPUS sets the devices Lightning predicts on otherwise
+backend = cpu_backend.backend("comet", int8=False)
+cpu_backend.configure_torch(backend)
+gpus = int(os.environ.get("COMET_GPUS", "1")) if cpu_backend.device(backend) == "cuda" else 0
 
-@app.route('/xcometxl', methods=['POST'])
-def cometscore():
-    data = request.json
-    references = data.get('references', [])
-    candidates = data.get('candidates', [])
+# XCOMET ships a Lightning checkpoint (no safetensors), read from the local snapshot
+model_path = os.path.join(model_store.local_model("Unbabel/XCOMET-XL"), "checkpoints", "model.ckpt")
+try:
+    # The encoder's tokenizer and config are in the Hugging Face cache after the first start
+    model = load_from_checkpoint(model_path, local_files_only=True)
+except OSError:
+    model = load_from_checkpoint(model_path)
+cache = ScoreCache()
 
-    if not references or not candidates or len(references) != len(candidates):
-        return jsonify({'error': 'Invalid input: references and candidates must be non-empty and of equal length'}), 400
+# Padded tokens per forward pass, tuned for this device unless COMET_MAX_TOKENS is set; each coalesced batch then runs as one pass
+max_tokens = autotune.BatchLimit("COMET_MAX_TOKENS", "Unbabel/XCOMET-XL", autotune.torch_device(backend) + (f" x{gpus}" if gpus > 1 else ""),
+                                 4096, minimum=256)
+count_tokens = tokenized_lengths(model.encoder.tokenizer)
 
-    # Prepare data in the format expected by XCOMET
-    eval_data = [
-        {"mt": mt, "ref": ref}
-        for mt, ref in zip(candidates, references)
-    ]
+def pair_lengths(eval_data: list) -> list:
+    """Tokens of each {"mt", "ref"} item, which the model reads as one sequence."""
+    return [mt + ref for mt, ref in zip(count_tokens([d["mt"] for d in eval_data]), count_tokens([d["ref"] for d in eval_data]))]
 
-    # Load and run the model
-    model_output = model.predict(eval_data, batch_size=8, gpus=1) # may have to adjust number of gpus depending on your system
+def predict(eval_data: list) -> list:
+    """Score one coalesced batch of {"mt", "ref"} items."""
+    batch_size = len(eval_data) if max_tokens.value else 8
+    model_output = model.predict(eval_data, batch_size=batch_size, gpus=gpus)
 
     # Extract scores
     # model_output is typically a list of dicts like [{'score': 0.8732}, ...]
     res = model_output.scores
     for i in range(len(res)):
         res[i] = res[i] * 100
-    return jsonify({'xcometxl_scores': res})
+    return res
+
+def probe(limit: int) -> int:
+    texts = autotune.probe_texts(limit, lambda texts: [2 * n for n in count_tokens(texts)])
+    return len(predict([{"mt": t, "ref": t} for t in texts]))
+
+max_tokens.start(probe)
+batcher = MicroBatcher(service_metrics.observe_batches(max_tokens.guard(predict, lambda items: len(items) * max(pair_lengths(items)))),
+                       *batch_settings("comet", None if max_tokens.value else 64, 10), lengths=pair_lengths if max_tokens.value else None)
+max_tokens.bind(batcher, "max_tokens")
+service_metrics.queue_depth(batcher.depth)
+
+@app.route('/autotune', methods=['POST'])
+def autotune_batches():
+    return wire.respond({max_tokens.key: max_tokens.tune(probe)})
+
+@app.route('/xcometxl', methods=['POST'])
+def cometscore():
+    data = wire.request_data()
+    references = data.get('references', [])
+    systems = data.get('systems')
+
+    if systems is not None:
+        # Multi-system mode: all systems are scored in the same batches
+        if not multi_system.valid(references, systems):
+            return wire.respond({'error': 'Invalid input: every system must have as many candidates as there are references'}, 400)
+        references, candidates, spans = multi_system.flatten(references, systems)
+    else:
+        candidates = data.get('candidates', [])
+        if not references or not candidates or len(references) != len(candidates):
+            return wire.respond({'error': 'Invalid input: references and candidates must be non-empty and of equal length'}, 400)
+
+    keys = segment_keys("xcometxl", "Unbabel/XCOMET-XL", {}, candidates, references=references)
+
+    def compute(idxs):
+        # Prepare data in the format expected by XCOMET
+        eval_data = [
+            {"mt": candidates[i], "ref": references[i]}
+            for i in idxs
+        ]
+        return batcher.submit(eval_data)
+
+    res, cache_stats = cache.lookup(keys, compute)
+    service_metrics.record_segments("/xcometxl", len(keys), cache_stats)
+    if systems is not None:
+        res = multi_system.split(res, spans)
+    return wire.respond({'xcometxl_scores': res, 'cache': cache_stats})
 
 if __name__ == "__main__":
     serve(app, host="0.0.0.0", port=port)
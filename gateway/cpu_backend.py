@@ -0,0 +1,109 @@
+"""
+How a service runs its model, selected with <SERVICE>_BACKEND:
+
+    gpu       stock fp32 model, on CUDA when available (default)
+    cpu       fp32 on the CPU with LUXEVAL_CPU_THREADS intra-op threads
+    cpu-int8  CPU, with the Linear layers dynamically quantised to int8
+
+Scores of int8 models differ slightly from fp32 ones, so they are cached under
+their own keys (see `cache_config`). With LUXEVAL_CALIBRATION_SET, an int8
+service scores that set with both models at startup and writes a report.
+"""
+import json
+import numpy as np
+import os
+import time
+
+BACKENDS = ("gpu", "cpu", "cpu-int8")
+# Threads per process; the gateway divides the cores between the replicas of a service
+CPU_THREADS = int(os.environ.get("LUXEVAL_CPU_THREADS", "0")) or os.cpu_count() or 1
+# JSON list of {"source", "reference", "candidate"} segments scored by both models
+CALIBRATION_SET = os.environ.get("LUXEVAL_CALIBRATION_SET", "")
+CALIBRATION_DIR = os.environ.get("LUXEVAL_CALIBRATION_DIR", "./cache/calibration")
+
+def backend(service: str, int8: bool = True) -> str:
+    """The configured backend; "cpu-int8" falls back to "cpu" where the model cannot be quantised (`int8=False`)."""
+    name = os.environ.get(f"{service.upper()}_BACKEND", "gpu").strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"{service.upper()}_BACKEND must be one of {', '.join(BACKENDS)}, got '{name}'")
+    if name == "cpu-int8" and not int8:
+        print(f"{service} cannot be quantised to int8, running fp32 on the CPU")
+        return "cpu"
+    return name
+
+def device(name: str) -> str:
+    """The torch device of a backend."""
+    import torch
+    return "cuda" if name == "gpu" and torch.cuda.is_available() else "cpu"
+
+def configure_torch(name: str):
+    """Use CPU_THREADS intra-op threads on CPU backends; call before the model is loaded."""
+    if name != "gpu":
+        import torch
+        torch.set_num_threads(CPU_THREADS)
+
+def configure_tensorflow(name: str):
+    """Hide the GPUs from TensorFlow and size its thread pools on CPU backends; call before the model is loaded."""
+    if name != "gpu":
+        import tensorflow as tf
+        tf.config.set_visible_devices([], "GPU")
+        tf.config.threading.set_intra_op_parallelism_threads(CPU_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(2)
+
+def quantize(module):
+    """A copy of `module` whose Linear layers hold int8 weights and quantise their inputs per batch."""
+    import torch
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+def cache_config(name: str, config: dict) -> dict:
+    """The score-cache config of a model; int8 scores get keys of their own."""
+    return {**config, "backend": name} if name == "cpu-int8" else config
+
+def _ranks(x: np.ndarray) -> np.ndarray:
+    """Ranks starting at 0, ties sharing their average rank."""
+    _, inverse, counts = np.unique(x, return_inverse=True, return_counts=True)
+    starts = np.cumsum(counts) - counts
+    return (starts + (counts - 1) / 2)[inverse]
+
+def compare(fp32_scores, scores) -> dict:
+    """Agreement of `scores` with the fp32 scores of the same segments."""
+    a, b = np.asarray(fp32_scores, dtype=np.float64), np.asarray(scores, dtype=np.float64)
+    diff = np.abs(a - b)
+    return {
+        "segments": len(a),
+        "pearson": float(np.corrcoef(a, b)[0, 1]) if len(a) > 1 else None,
+        "spearman": float(np.corrcoef(_ranks(a), _ranks(b))[0, 1]) if len(a) > 1 else None,
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "fp32_mean": float(a.mean()),
+        "mean": float(b.mean()),
+    }
+
+def calibrate(service: str, fp32_fn, int8_fn) -> dict:
+    """
+    Score the calibration set with `fp32_fn(items)` and `int8_fn(items)` (lists of
+    scores), write the comparison and timings to CALIBRATION_DIR/<service>.json
+    and return it. Returns None without a calibration set.
+    """
+    if not CALIBRATION_SET:
+        return None
+    with open(CALIBRATION_SET, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    if len(items) < 2:
+        raise ValueError(f"{CALIBRATION_SET} needs at least two segments")
+
+    start = time.perf_counter()
+    fp32_scores = fp32_fn(items)
+    fp32_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    int8_scores = int8_fn(items)
+    int8_seconds = time.perf_counter() - start
+
+    report = {"service": service, "calibration_set": CALIBRATION_SET, "threads": CPU_THREADS,
+              **compare(fp32_scores, int8_scores), "fp32_seconds": fp32_seconds, "int8_seconds": int8_seconds}
+    os.makedirs(CALIBRATION_DIR, exist_ok=True)
+    with open(os.path.join(CALIBRATION_DIR, f"{service}.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"{service} int8 calibration on {report['segments']} segments: pearson {report['pearson']:.4f}, "
+          f"max deviation {report['max_abs_diff']:.3f}, {fp32_seconds / max(int8_seconds, 1e-9):.1f}x faster than fp32")
+    return report
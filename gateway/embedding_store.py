@@ -0,0 +1,94 @@
+import hashlib
+import numpy as np
+import os
+from score_cache import select_in
+import sqlite3
+import threading
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingStore:
+    """
+    Persistent sentence-embedding store: a memory-mapped float16 matrix with one row
+    per distinct text, plus a SQLite index from text hash to row. Appends are
+    serialised through the index database, so several processes can share a store.
+    With directory=None nothing is stored and every text is encoded.
+    """
+    def __init__(self, directory, dim: int):
+        self.dim = dim
+        self._conn = None
+        self._matrix = None
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.matrix_path = os.path.join(directory, f"embeddings_{dim}.f16")
+            open(self.matrix_path, "ab").close()
+            self._conn = sqlite3.connect(os.path.join(directory, f"index_{dim}.sqlite"), check_same_thread=False, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rows (hash TEXT PRIMARY KEY, row INTEGER UNIQUE NOT NULL)")
+            self._conn.commit()
+            self._map()
+
+    def _capacity(self) -> int:
+        return os.path.getsize(self.matrix_path) // (self.dim * 2)
+
+    def _map(self):
+        capacity = self._capacity()
+        self._matrix = np.memmap(self.matrix_path, dtype=np.float16, mode="r+", shape=(capacity, self.dim)) if capacity else None
+
+    def _rows(self, hashes: list) -> dict:
+        return dict(select_in(self._conn, "SELECT hash, row FROM rows WHERE hash IN ({})", hashes))
+
+    def get(self, texts: list, encode) -> np.ndarray:
+        """
+        Return a float32 (len(texts), dim) matrix of embeddings. Only distinct texts
+        that are not stored yet are passed to `encode(texts) -> array` and then appended.
+        """
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        hashes = [text_hash(t) for t in texts]
+        unique = list(dict.fromkeys(hashes))
+        if self._conn is None:
+            # Nothing stored, but texts repeated within the call (e.g. shared sources) are still encoded once
+            text_of = dict(zip(hashes, texts))
+            encoded = np.asarray(encode([text_of[h] for h in unique]), dtype=np.float32)
+            position = {h: i for i, h in enumerate(unique)}
+            return encoded[[position[h] for h in hashes]]
+
+        with self._lock:
+            rows = self._rows(unique)
+        missing = [h for h in unique if h not in rows]
+
+        if missing:
+            text_of = dict(zip(hashes, texts))
+            encoded = np.asarray(encode([text_of[h] for h in missing]), dtype=np.float16)
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Another process may have stored some of them in the meantime
+                    rows.update(self._rows(missing))
+                    new = [i for i, h in enumerate(missing) if h not in rows]
+                    if new:
+                        start = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+                        end = start + len(new)
+                        if end > self._capacity():
+                            with open(self.matrix_path, "r+b") as f:
+                                f.truncate(max(end, 2 * self._capacity(), 1024) * self.dim * 2)
+                        if self._matrix is None or end > len(self._matrix):
+                            self._map()  # grown by this or another process since it was mapped
+                        self._matrix[start:end] = encoded[new]
+                        self._matrix.flush()
+                        self._conn.executemany("INSERT INTO rows (hash, row) VALUES (?, ?)",
+                                               [(missing[i], start + j) for j, i in enumerate(new)])
+                        rows.update((missing[i], start + j) for j, i in enumerate(new))
+                    self._conn.commit()
+                except Exception:
+                    self._conn.rollback()
+                    raise
+
+        idx = np.fromiter((rows[h] for h in hashes), dtype=np.int64, count=len(hashes))
+        with self._lock:
+            if self._matrix is None or idx.max() >= len(self._matrix):
+                self._map()  # grown by another process
+            return self._matrix[idx].astype(np.float32)
@@ -0,0 +1,162 @@
+"""
+Asynchronous scoring jobs. A job is a numbered sequence of requests ("chunks") to
+one endpoint, each uploaded exactly as it would be posted to that endpoint and
+passed on without being decoded. The chunks of all jobs wait in one queue per service
+and are sent by a fixed number of workers per replica, highest job priority first
+and oldest job first within a priority. Responses are kept until the job expires,
+so clients can poll or stream progress, read results as soon as a chunk is done,
+cancel jobs and fetch their results later.
+"""
+import asyncio
+from collections import defaultdict
+import heapq
+import itertools
+import os
+import time
+import uuid
+
+# Finished (or abandoned) jobs and their responses are dropped after this many seconds
+JOB_TTL = float(os.environ.get("GATEWAY_JOB_TTL", "3600"))
+MAX_CHUNKS = 100000
+
+class Chunk:
+    """One request of a job: "missing" until uploaded, then "queued", "running" and "done", or "cancelled" while queued."""
+    def __init__(self, job, index: int):
+        self.job = job
+        self.index = index
+        self.state = "missing"
+        self.headers = None
+        self.body = None
+        self.response = None
+        self.version = 0  # bumped by every upload, so a replaced chunk's old result is ignored
+
+class Job:
+    def __init__(self, service: str, endpoint: str, chunks: int, priority: int):
+        self.id = uuid.uuid4().hex
+        self.service = service
+        self.endpoint = endpoint
+        self.priority = priority
+        self.chunks = [Chunk(self, i) for i in range(chunks)]
+        self.completed = {}  # chunk index -> completion number, in the order the chunks finished
+        self.completions = 0
+        self.cancelled = False
+        self.created = self.updated = time.time()
+        self.finished = None
+        self.changes = 0  # bumped by every update, so subscribers can wait for the next one
+        self.changed = asyncio.Condition()
+
+    @property
+    def state(self) -> str:
+        if self.cancelled:
+            return "cancelled"
+        states = [chunk.state for chunk in self.chunks]
+        if all(state == "done" for state in states):
+            return "done"
+        if "running" in states or "done" in states:
+            return "running"
+        return "queued" if "queued" in states else "waiting"
+
+    def status(self) -> dict:
+        states = [chunk.state for chunk in self.chunks]
+        return {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "priority": self.priority,
+            "state": self.state,
+            "chunks": len(self.chunks),
+            **{state: states.count(state) for state in ("missing", "queued", "running", "done", "cancelled")},
+            "failed": sum(1 for chunk in self.chunks if chunk.response is not None and chunk.response.status != 200),
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+    async def notify(self):
+        self.changes += 1
+        self.updated = time.time()
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def wait(self, predicate, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for `predicate()`; returns its last value."""
+        async with self.changed:
+            try:
+                await asyncio.wait_for(self.changed.wait_for(predicate), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return predicate()
+
+class JobStore:
+    """The jobs of the gateway and the per-service queues their chunks wait in."""
+    def __init__(self, ttl: float = JOB_TTL):
+        self.ttl = ttl
+        self.jobs = {}
+        self._queues = defaultdict(list)  # service -> heap of (-priority, job created, sequence, chunk, version)
+        self._ready = defaultdict(asyncio.Condition)
+        self._sequence = itertools.count()
+
+    def create(self, service: str, endpoint: str, chunks: int, priority: int = 0) -> Job:
+        job = Job(service, endpoint, chunks, priority)
+        self.jobs[job.id] = job
+        return job
+
+    async def put(self, job: Job, index: int, headers: dict, body: bytes):
+        """Queue chunk `index` of a job, replacing an earlier upload of it."""
+        chunk = job.chunks[index]
+        chunk.version += 1
+        chunk.state, chunk.headers, chunk.body, chunk.response = "queued", headers, body, None
+        job.completed.pop(index, None)
+        job.finished = None
+        heapq.heappush(self._queues[job.service], (-job.priority, job.created, next(self._sequence), chunk, chunk.version))
+        async with self._ready[job.service]:
+            self._ready[job.service].notify()
+        await job.notify()
+
+    async def next(self, service: str):
+        """Wait for the next chunk to send to `service`; returns (chunk, version)."""
+        queue = self._queues[service]
+        while True:
+            async with self._ready[service]:
+                await self._ready[service].wait_for(lambda: bool(queue))
+                _, _, _, chunk, version = heapq.heappop(queue)
+            if chunk.version == version and chunk.state == "queued" and not chunk.job.cancelled:
+                chunk.state = "running"
+                await chunk.job.notify()
+                return chunk, version
+
+    async def finish(self, chunk: Chunk, version: int, response):
+        """Store the response of a chunk, unless it was uploaded again meanwhile."""
+        job = chunk.job
+        if chunk.version != version:
+            return
+        chunk.state, chunk.response, chunk.body = "done", response, None
+        job.completions += 1
+        job.completed[chunk.index] = job.completions
+        if job.state == "done":
+            job.finished = time.time()
+        await job.notify()
+
+    async def cancel(self, job: Job):
+        """Drop the job's queued chunks; chunks already sent to a service still finish."""
+        job.cancelled = True
+        job.finished = job.finished or time.time()
+        for chunk in job.chunks:
+            if chunk.state == "queued":
+                chunk.state, chunk.body = "cancelled", None
+        await job.notify()
+
+    def remove(self, job: Job):
+        self.jobs.pop(job.id, None)
+
+    async def expire(self):
+        """Forget jobs that finished, or were last touched, more than `ttl` seconds ago; unfinished ones are cancelled first."""
+        cutoff = time.time() - self.ttl
+        for job_id, job in list(self.jobs.items()):
+            if (job.finished or job.updated) < cutoff:
+                await self.cancel(job)  # nobody could fetch the results of its queued chunks
+                del self.jobs[job_id]
+
+    def queued(self) -> dict:
+        """{service: chunks waiting to be sent}."""
+        return {service: sum(1 for *_, chunk, version in queue if chunk.version == version and chunk.state == "queued"
+                             and not chunk.job.cancelled)
+                for service, queue in self._queues.items()}
@@ -1,62 +1,122 @@
-from flask import Flask, request, jsonify
+import autotune
+from batching import MicroBatcher, batch_settings, tokenized_lengths
+import cpu_backend
+from embedding_store import EmbeddingStore
+from flask import Flask
+import model_store
+import multi_system
+import numpy as np
+import os
+from score_cache import ScoreCache, segment_keys
+import service_metrics
 import sys
 from waitress import serve
+import wire
 from sentence_transformers import SentenceTransformer
 
 # Run on GPU 0
 #os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
 app = Flask(__name__)
+service_metrics.instrument(app)
 port = int(sys.argv[1]) if len(sys.argv) > 1 else 5006
 
-def normalise_score(x: float) -> float:
+def normalise_scores(x: np.ndarray) -> np.ndarray:
     """
-    Normalize a score from [0, 100] into [0, 1],
-    mapping [0, 70) -> 0 and [70, 100] linearly to [0, 1].
+    Normalize scores from [0, 100] into [0, 100],
+    mapping [0, 80) -> 0 and [80, 100] linearly to [0, 100].
 
     Args:
-        x (float): Input score between 0 and 100.
+        x (np.ndarray): Input scores, clamped to [0, 100].
 
     Returns:
-        float: Normalized score in [0, 1].
+        np.ndarray: Normalized scores in [0, 100].
     """
-    x = max(0.0, min(100.0, x))  # clamp to [0,100]
-    if x < 80:
-        return 0.0
-    elif x > 100:
-        raise ValueError("Input must be between 0 and 100.")
-    else:
-        res = (x - 80) / (100 - 80)
-        return res * 100
+    x = np.clip(x, 0.0, 100.0)
+    return np.where(x < 80, 0.0, (x - 80) / (100 - 80) * 100)
 
 @app.route("/")
 def health():
     return "Luxembedder service is running", 200
 
-# Load the model
-model = SentenceTransformer('fredxlpy/LuxEmbedder')
+def similarity_scores(source_embeddings: np.ndarray, candidate_embeddings: np.ndarray) -> list:
+    """Scores of aligned rows of normalised sentence embeddings."""
+    # Cosine similarity: element-wise multiplication and summation over the dimension
+    res = (np.asarray(source_embeddings) * np.asarray(candidate_embeddings)).sum(axis=1)
+    return normalise_scores(res * 100).tolist()
+
+def calibration_scores(encoder):
+    """Score calibration items (see cpu_backend) with `encoder`, as requests are scored."""
+    def score(items):
+        return similarity_scores(encoder.encode([i["source"] for i in items]), encoder.encode([i["candidate"] for i in items]))
+    return score
+
+# Load the model; see cpu_backend for LUXEMBEDDER_BACKEND
+backend = cpu_backend.backend("luxembedder")
+cpu_backend.configure_torch(backend)
+model = SentenceTransformer(model_store.local_model('fredxlpy/LuxEmbedder'), device=cpu_backend.device(backend))
+if backend == "cpu-int8":
+    fp32_model, model = model, cpu_backend.quantize(model)
+    cpu_backend.calibrate("luxembedder", calibration_scores(fp32_model), calibration_scores(model))
+    del fp32_model
+cache = ScoreCache()
+
+# Sentences from concurrent requests are encoded together, in batches of similar length,
+# within a token budget tuned for this device unless LUXEMBEDDER_MAX_TOKENS is set
+max_tokens = autotune.BatchLimit("LUXEMBEDDER_MAX_TOKENS", "fredxlpy/LuxEmbedder", autotune.torch_device(backend), 16384, minimum=512)
+count_tokens = tokenized_lengths(model.tokenizer, model.max_seq_length)
+
+def encode(texts: list) -> list:
+    return list(model.encode(texts, batch_size=len(texts) if max_tokens.value else 32))
+
+def probe(limit: int) -> int:
+    return len(encode(autotune.probe_texts(limit, count_tokens)))
+
+max_tokens.start(probe)
+batcher = MicroBatcher(service_metrics.observe_batches(max_tokens.guard(encode, lambda texts: len(texts) * max(count_tokens(texts)))),
+                       *batch_settings("luxembedder", None if max_tokens.value else 256, 10), lengths=count_tokens if max_tokens.value else None)
+max_tokens.bind(batcher, "max_tokens")
+service_metrics.queue_depth(batcher.depth)
+
+@app.route('/autotune', methods=['POST'])
+def autotune_batches():
+    return wire.respond({max_tokens.key: max_tokens.tune(probe)})
+
+# Embeddings of every sentence seen so far; set LUXEMBEDDER_STORE="" to disable. int8 embeddings are kept apart
+store_dir = os.environ.get("LUXEMBEDDER_STORE", "./cache/luxembedder")
+if store_dir and backend == "cpu-int8":
+    store_dir = os.path.join(store_dir, "int8")
+store = EmbeddingStore(store_dir, model.get_sentence_embedding_dimension())
 
 @app.route('/luxembedder', methods=['POST'])
 def luxembedderscore():
-    data = request.json
+    data = wire.request_data()
     sources = data.get('sources', [])
-    candidates = data.get('candidates', [])
+    systems = data.get('systems')
 
-    if not sources or not candidates or len(sources) != len(candidates):
-        return jsonify({'error': 'Invalid input: sources and candidates must be non-empty and of equal length'}), 400
-
-    # Encode sentences
-    source_embeddings = model.encode(sources, convert_to_tensor=True)
-    candidate_embeddings = model.encode(candidates, convert_to_tensor=True)
+    if systems is not None:
+        # Multi-system mode: sources shared by all systems are only encoded once
+        if not multi_system.valid(sources, systems):
+            return wire.respond({'error': 'Invalid input: every system must have as many candidates as there are sources'}, 400)
+        sources, candidates, spans = multi_system.flatten(sources, systems)
+    else:
+        candidates = data.get('candidates', [])
+        if not sources or not candidates or len(sources) != len(candidates):
+            return wire.respond({'error': 'Invalid input: sources and candidates must be non-empty and of equal length'}, 400)
 
-    # Compute cosine similarity scores (element-wise multiplication and summation over dimension)
-    res = (source_embeddings * candidate_embeddings).sum(dim=1).cpu().numpy()
-    res = (res * 100).tolist()  # scale and convert to list
-    for idx in range(len(res)):
-        res[idx] = normalise_score(res[idx])
+    keys = segment_keys("luxembedder", "fredxlpy/LuxEmbedder", cpu_backend.cache_config(backend, {}), candidates, sources=sources)
 
+    def compute(idxs):
+        # Only sentences missing from the store are encoded, each once
+        texts = [sources[i] for i in idxs] + [candidates[i] for i in idxs]
+        embeddings = store.get(texts, lambda missing: np.stack(batcher.submit(missing)))
+        return similarity_scores(embeddings[:len(idxs)], embeddings[len(idxs):])
 
-    return jsonify({'luxembedder_scores': res})
+    res, cache_stats = cache.lookup(keys, compute)
+    service_metrics.record_segments("/luxembedder", len(keys), cache_stats)
+    if systems is not None:
+        res = multi_system.split(res, spans)
+    return wire.respond({'luxembedder_scores': res, 'cache': cache_stats})
 
 if __name__ == "__main__":
     serve(app, host="0.0.0.0", port=port)
@@ -1,5 +1,11 @@
-from flask import Flask, request, jsonify
-import requests
+from aiohttp import ClientConnectorError, ClientError, ClientSession, ClientTimeout, TCPConnector, web
+import asyncio
+from coalescing import COALESCE_MAX_BYTES, BufferedResponse, Coalescer, fingerprint
+import json
+from jobs import MAX_CHUNKS, JobStore
+import os
+import service_metrics
+from service_metrics import Counter, Gauge, Histogram
 import subprocess
 import time
 import socket
@@ -11,18 +17,20 @@ def get_free_port():
         s.bind(("", 0))
         return s.getsockname()[1]
 
-def wait_for_service(url, timeout=120):
-    """Wait until a service responds with 200 OK."""
-    start = time.time()
-    while time.time() - start < timeout:
+async def wait_for_service(session, url, proc, timeout):
+    """Wait until a service responds with 200 OK; fail early if its process exits."""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"exited with code {proc.returncode}")
         try:
-            res = requests.get(url)
-            if res.status_code == 200:
-                return True
-        except Exception:
+            async with session.get(url) as res:
+                if res.status == 200:
+                    return
+        except ClientError:
             pass
-        time.sleep(1)
-    raise RuntimeError(f"Service at {url} did not start in {timeout}s")
+        await asyncio.sleep(POLL_INTERVAL)
+    raise RuntimeError(f"did not start in {timeout}s")
 
 def get_client_accessible_ip():
     """
@@ -50,7 +58,7 @@ SERVICES = {
     "bert": {
         "venv": "./bert_venv/bin/python",
         "script": "bert_service.py",
-        "endpoints": ["/bertscore", "/sacrebleu"],
+        "endpoints": ["/bertscore", "/sacrebleu", "/sacrebleu_segments"],
     },
     "luxembedder": {
         "venv": "./luxembedder_venv/bin/python",
@@ -66,50 +74,488 @@ SERVICES = {
 }
 
 # -------- Launch services --------
-processes = {}
-ports = {}
+# All replicas load their models at the same time; see `service_health`
+START_TIMEOUT = float(os.environ.get("GATEWAY_START_TIMEOUT", "600"))
+POLL_INTERVAL = 0.2
+# Running replicas are health-checked every HEALTH_INTERVAL seconds and taken
+# out of rotation after HEALTH_FAILURES failed checks in a row
+HEALTH_INTERVAL = float(os.environ.get("GATEWAY_HEALTH_INTERVAL", "5"))
+HEALTH_TIMEOUT = 10
+HEALTH_FAILURES = 3
+
+class Replica:
+    """One process of a service, with the number of requests currently proxied to it."""
+    def __init__(self, name, port, proc):
+        self.name = name
+        self.port = port
+        self.proc = proc
+        self.state = "starting"  # -> "healthy" <-> "down"
+        self.in_flight = 0
+
+    @property
+    def url(self):
+        return f"http://localhost:{self.port}"
+
+replicas = {}
 
 for name, cfg in SERVICES.items():
-    port = get_free_port()
-    ports[name] = port
-    print(f"Starting {name.upper()} service on port {port}")
-    proc = subprocess.Popen([cfg["venv"], cfg["script"], str(port)])
-    processes[name] = proc
-    wait_for_service(f"http://localhost:{port}/")
+    # e.g. BLEURT_REPLICAS=4 runs four BLEURT processes
+    count = max(1, int(os.environ.get(f"{name.upper()}_REPLICAS", "1")))
+    # Replicas share the CPU cores, for model threads (see cpu_backend) and sacrebleu workers (see surface_metrics)
+    cores = str(max(1, (os.cpu_count() or 1) // count))
+    env = {"LUXEVAL_CPU_THREADS": cores, "SACREBLEU_WORKERS": cores, **os.environ}
+    replicas[name] = []
+    for i in range(count):
+        port = get_free_port()
+        replica_name = name.upper() if count == 1 else f"{name.upper()}[{i + 1}/{count}]"
+        print(f"Starting {replica_name} service on port {port}")
+        proc = subprocess.Popen([cfg["venv"], cfg["script"], str(port)], env=env)
+        replicas[name].append(Replica(replica_name, port, proc))
+
+# -------- Gateway --------
+# Keep-alive connections kept open to each service
+POOL_SIZE = int(os.environ.get("GATEWAY_POOL_SIZE", "32"))
+CHUNK_SIZE = 64 * 1024
+# Headers passed through unchanged so bodies never need to be decoded here
+FORWARDED_REQUEST_HEADERS = ("Content-Type", "Content-Encoding", "Accept", "Accept-Encoding")
+FORWARDED_RESPONSE_HEADERS = ("Content-Type", "Content-Encoding")
+
+session_key = web.AppKey("session", ClientSession)
+pools_key = web.AppKey("pools", dict)
+coalescer_key = web.AppKey("coalescer", Coalescer)
+jobs_key = web.AppKey("jobs", JobStore)
+
+async def client_session(app):
+    """One pooled session for all backend calls; scoring requests may run for a long time."""
+    app[session_key] = ClientSession(
+        connector=TCPConnector(limit=0, limit_per_host=POOL_SIZE, keepalive_timeout=60),
+        timeout=ClientTimeout(total=None, sock_connect=10),
+        auto_decompress=False,
+    )
+    yield
+    await app[session_key].close()
+
+class ServicePool:
+    """
+    The replicas of one service. Requests go to the healthy replica with the fewest
+    requests in flight; while no replica is healthy but some are still starting,
+    requests wait.
+    """
+    def __init__(self, name, replicas):
+        self.name = name
+        self.replicas = replicas
+        self.error = None
+        self._changed = asyncio.Condition()
+
+    def pick(self):
+        healthy = [r for r in self.replicas if r.state == "healthy"]
+        return min(healthy, key=lambda r: r.in_flight) if healthy else None
+
+    async def acquire(self):
+        """A replica to send the next request to, or None if none is healthy or starting."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.pick() or all(r.state == "down" for r in self.replicas))
+        return self.pick()
+
+    async def set_state(self, replica, state, error=None):
+        replica.state = state
+        if error:
+            self.error = f"{self.name} service {error}"
+        async with self._changed:
+            self._changed.notify_all()
+
+async def is_healthy(session, replica):
+    try:
+        async with session.get(f"{replica.url}/", timeout=ClientTimeout(total=HEALTH_TIMEOUT)) as res:
+            return res.status == 200
+    except (ClientError, asyncio.TimeoutError):
+        return False
+
+async def monitor(app, pool, replica, start):
+    """Wait for a replica to come up, then health-check it until its process exits."""
+    session = app[session_key]
+    try:
+        await wait_for_service(session, f"{replica.url}/", replica.proc, START_TIMEOUT)
+        print(f"{replica.name} service ready after {time.monotonic() - start:.1f}s")
+        await pool.set_state(replica, "healthy")
+    except RuntimeError as e:
+        print(f"{replica.name} service failed: {e}")
+        await pool.set_state(replica, "down", e)
+
+    failures = 0
+    while replica.proc.poll() is None:
+        await asyncio.sleep(HEALTH_INTERVAL)
+        if await is_healthy(session, replica):
+            failures = 0
+            if replica.state != "healthy":
+                print(f"{replica.name} service is back")
+                await pool.set_state(replica, "healthy")
+        else:
+            failures += 1
+            if failures >= HEALTH_FAILURES and replica.state == "healthy":
+                print(f"{replica.name} service taken out after {failures} failed health checks")
+                await pool.set_state(replica, "down", "failed its health checks")
+
+    if replica.state != "down":
+        print(f"{replica.name} service exited with code {replica.proc.returncode}")
+        await pool.set_state(replica, "down", f"exited with code {replica.proc.returncode}")
+
+async def service_health(app):
+    """
+    Start and health-check all replicas concurrently, reporting each one as soon
+    as it is up. The gateway accepts requests meanwhile; see `ServicePool.acquire`.
+    """
+    app[pools_key] = {name: ServicePool(name, service_replicas) for name, service_replicas in replicas.items()}
+    start = time.monotonic()
+    tasks = [asyncio.create_task(monitor(app, pool, replica, start))
+             for pool in app[pools_key].values() for replica in pool.replicas]
+    yield
+    for task in tasks:
+        task.cancel()
+
+# -------- Metrics --------
+# The gateway's own metrics; GET /metrics adds those of every replica
+gateway_registry = service_metrics.Registry()
+service_metrics.process_metrics(gateway_registry, prefix="luxeval_gateway")
+proxy_requests = Counter("luxeval_gateway_requests_total", "Proxied requests, by service, endpoint and status.",
+                         ("service", "endpoint", "status"), gateway_registry)
+proxy_duration = Histogram("luxeval_gateway_request_duration_seconds", "Time to answer a proxied request, waiting for a replica included.",
+                           ("service", "endpoint"), gateway_registry)
+scrape_up = Gauge("luxeval_gateway_scrape_up", "1 if the replica's metrics could be read.", ("service", "replica"), gateway_registry)
+Gauge("luxeval_gateway_replica_healthy", "1 while the replica is in rotation.", ("service", "replica"), gateway_registry,
+      fn=lambda: {(name, r.name): int(r.state == "healthy") for name, service_replicas in replicas.items() for r in service_replicas})
+Gauge("luxeval_gateway_replica_in_flight", "Requests the replica is working on.", ("service", "replica"), gateway_registry,
+      fn=lambda: {(name, r.name): r.in_flight for name, service_replicas in replicas.items() for r in service_replicas})
+
+async def scrape(session, replica):
+    """The metrics text of a replica, or None if it cannot be read."""
+    try:
+        async with session.get(f"{replica.url}/metrics", timeout=ClientTimeout(total=HEALTH_TIMEOUT)) as res:
+            if res.status == 200:
+                return await res.text()
+    except (ClientError, asyncio.TimeoutError):
+        pass
+    return None
+
+async def metrics(request):
+    """Prometheus metrics of the gateway and of every replica, labelled with service and replica."""
+    targets = [(name, replica) for name, pool in request.app[pools_key].items() for replica in pool.replicas if replica.proc.poll() is None]
+    texts = await asyncio.gather(*(scrape(request.app[session_key], replica) for _, replica in targets))
+    for (name, replica), text in zip(targets, texts):
+        scrape_up.set(int(text is not None), service=name, replica=replica.name)
+    replica_metrics = service_metrics.merge([({"service": name, "replica": replica.name}, text)
+                                             for (name, replica), text in zip(targets, texts) if text is not None])
+    return web.Response(text=gateway_registry.render() + replica_metrics, headers={"Content-Type": service_metrics.CONTENT_TYPE})
+
+async def home(request):
+    return web.Response(text="Gateway is running")
+
+async def stats(request):
+    """Replica states and, per service, how requests were answered."""
+    coalescer = request.app[coalescer_key]
+    return web.json_response({
+        "services": {
+            name: {
+                "replicas": [{"name": r.name, "state": r.state, "in_flight": r.in_flight} for r in pool.replicas],
+                "requests": {k: coalescer.stats[name][k] for k in ("computed", "coalesced", "cache_hits", "streamed")},
+            }
+            for name, pool in request.app[pools_key].items()
+        },
+        "in_flight": coalescer.in_flight(),
+        "jobs": {**job_counts(request.app[jobs_key]), "chunks_queued": request.app[jobs_key].queued()},
+        "response_cache": {"entries": len(coalescer.cache), "bytes": coalescer.cache.size},
+    })
+
+async def autotune(request):
+    """Tune the batch limits of every healthy replica of a service again, one replica at a time."""
+    name = request.match_info["service"]
+    if name not in request.app[pools_key]:
+        return web.json_response({"error": f"Unknown service '{name}'"}, status=404)
+    results = {}
+    for replica in request.app[pools_key][name].replicas:
+        if replica.state != "healthy":
+            results[replica.name] = {"error": f"replica is {replica.state}"}
+            continue
+        try:
+            async with request.app[session_key].post(f"{replica.url}/autotune", headers={"Accept": "application/json", "Accept-Encoding": "identity"}) as res:
+                results[replica.name] = await res.json() if res.status == 200 else {"error": await res.text()}
+        except ClientError as e:
+            results[replica.name] = {"error": str(e)}
+    return web.json_response(results)
+
+async def with_replica(pool, send):
+    """
+    Call `send(replica)` on the least-loaded healthy replica. A replica that refuses
+    the connection is taken out and the next one is tried, since nothing was sent yet.
+    Returns None if no replica is left.
+    """
+    while True:
+        replica = await pool.acquire()
+        if replica is None:
+            return None
+        replica.in_flight += 1
+        try:
+            return await send(replica)
+        except ClientConnectorError as e:
+            print(f"{replica.name} service taken out: {e}")
+            await pool.set_state(replica, "down", "refused the connection")
+        finally:
+            replica.in_flight -= 1
 
-# -------- Flask gateway --------
-app = Flask(__name__)
+def error_response(status, message):
+    return BufferedResponse(status, {"Content-Type": "application/json"}, json.dumps({"error": message}).encode("utf-8"))
 
-@app.route('/')
-def home():
-    return "Gateway is running", 200
+async def fetch(service_name, endpoint, pool, session, headers, body):
+    """Send a buffered request and buffer the response, so it can answer coalesced requests and jobs too."""
+    async def send(replica):
+        async with session.post(f"{replica.url}{endpoint}", data=body, headers=headers) as res:
+            response_headers = {k: res.headers[k] for k in FORWARDED_RESPONSE_HEADERS if k in res.headers}
+            return BufferedResponse(res.status, response_headers, await res.read())
+    try:
+        return await with_replica(pool, send) or error_response(503, pool.error or f"{service_name} service is unavailable")
+    except ClientError as e:
+        return error_response(502, f"{service_name} service failed: {e}")
 
 # Dynamically create proxy routes
 def make_proxy(service_name, endpoint):
-    def proxy():
+    async def stream(pool, request, headers):
+        """Stream a large request to the backend and its response back, without buffering either."""
+        async def send(replica):
+            response = None
+            try:
+                async with request.app[session_key].post(f"{replica.url}{endpoint}", data=request.content, headers=headers) as res:
+                    response = web.StreamResponse(status=res.status)
+                    for k in FORWARDED_RESPONSE_HEADERS:
+                        if k in res.headers:
+                            response.headers[k] = res.headers[k]
+                    await response.prepare(request)
+                    async for chunk in res.content.iter_chunked(CHUNK_SIZE):
+                        await response.write(chunk)
+                    await response.write_eof()
+                    return response
+            except ClientConnectorError:
+                raise  # nothing was sent, the request can go to another replica
+            except ClientError as e:
+                if response is not None and response.prepared:
+                    raise  # body already partially sent, drop the connection
+                return web.json_response({"error": f"{service_name} service failed: {e}"}, status=502)
+        return await with_replica(pool, send) or web.json_response(
+            {"error": pool.error or f"{service_name} service is unavailable"}, status=503)
+
+    async def handle(request):
+        pool = request.app[pools_key][service_name]
+        coalescer = request.app[coalescer_key]
+        headers = {k: request.headers[k] for k in FORWARDED_REQUEST_HEADERS if k in request.headers}
+
+        if request.content_length is None or request.content_length > COALESCE_MAX_BYTES:
+            coalescer.stats[service_name]["streamed"] += 1
+            return await stream(pool, request, headers)
+
+        body = await request.read()
+        key = fingerprint(endpoint, headers, body)
+        result = await coalescer.run(service_name, key, lambda: fetch(service_name, endpoint, pool, request.app[session_key], headers, body))
+        return web.Response(status=result.status, headers=result.headers, body=result.body)
+
+    async def proxy(request):
+        start = time.perf_counter()
+        status = "error"  # the connection was dropped, e.g. while streaming
         try:
-            res = requests.post(
-                f"http://localhost:{ports[service_name]}{endpoint}",
-                json=request.get_json()
-            )
-            res.raise_for_status()
-            return jsonify(res.json()), res.status_code
+            response = await handle(request)
+            status = str(response.status)
+            return response
         except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            print(f"{service_name}{endpoint} failed: {e!r}")
+            raise
+        finally:
+            proxy_duration.observe(time.perf_counter() - start, service=service_name, endpoint=endpoint)
+            proxy_requests.inc(service=service_name, endpoint=endpoint, status=status)
     return proxy
 
+async def coalescer_ctx(app):
+    coalescer = app[coalescer_key] = Coalescer()
+    Counter("luxeval_gateway_coalescer_requests_total", "Requests by how they were answered (computed, coalesced, cache_hits, streamed).",
+            ("service", "outcome"), gateway_registry,
+            fn=lambda: {(name, outcome): count for name, counts in coalescer.stats.items() for outcome, count in counts.items()})
+    Gauge("luxeval_gateway_response_cache_bytes", "Size of the responses kept for identical requests.", registry=gateway_registry,
+          fn=lambda: coalescer.cache.size)
+    yield
+
+# -------- Jobs --------
+# Chunks of jobs each worker sends at a time, per replica of the service; see jobs.py
+JOB_CONCURRENCY = max(1, int(os.environ.get("GATEWAY_JOB_CONCURRENCY", "2")))
+MAX_WAIT = 60  # longest long-poll and event heartbeat, in seconds
+ENDPOINT_SERVICES = {endpoint: name for name, cfg in SERVICES.items() for endpoint in cfg["endpoints"]}
+job_chunks = Counter("luxeval_gateway_job_chunks_total", "Job chunks answered, by service, endpoint and status.",
+                     ("service", "endpoint", "status"), gateway_registry)
+
+def find_job(request):
+    """The job and chunk index named in the URL; raises 404 for unknown jobs and chunks."""
+    job = request.app[jobs_key].jobs.get(request.match_info["job_id"])
+    if job is None:
+        raise web.HTTPNotFound(text=json.dumps({"error": f"Unknown or expired job '{request.match_info['job_id']}'"}),
+                               content_type="application/json")
+    index = int(request.match_info.get("index", 0))
+    if index >= len(job.chunks):
+        raise web.HTTPNotFound(text=json.dumps({"error": f"Job {job.id} has {len(job.chunks)} chunks"}),
+                               content_type="application/json")
+    return job, index
+
+def wait_seconds(request) -> float:
+    try:
+        return min(max(float(request.query.get("wait", "0")), 0), MAX_WAIT)
+    except ValueError:
+        raise web.HTTPBadRequest(text=json.dumps({"error": "wait must be a number of seconds"}), content_type="application/json")
+
+async def submit_job(request):
+    """
+    Create a job of {"chunks": n} requests to {"endpoint": ...}, run with {"priority": p}
+    (higher first, default 0). The chunks are then uploaded with PUT /jobs/{id}/chunks/{index}.
+    """
+    try:
+        spec = await request.json()
+        endpoint, count, priority = spec["endpoint"], int(spec["chunks"]), int(spec.get("priority", 0))
+    except (ValueError, KeyError, TypeError) as e:
+        return web.json_response({"error": f"Invalid job: {e!r}"}, status=400)
+    if endpoint not in ENDPOINT_SERVICES:
+        return web.json_response({"error": f"Unknown endpoint '{endpoint}'"}, status=400)
+    if not 0 < count <= MAX_CHUNKS:
+        return web.json_response({"error": f"A job has 1 to {MAX_CHUNKS} chunks"}, status=400)
+    job = request.app[jobs_key].create(ENDPOINT_SERVICES[endpoint], endpoint, count, priority)
+    return web.json_response(job.status(), status=201, headers={"Location": f"/jobs/{job.id}"})
+
+async def put_chunk(request):
+    """Queue one chunk of a job: a request body as it would be posted to the job's endpoint."""
+    job, index = find_job(request)
+    if job.cancelled:
+        return web.json_response({"error": f"Job {job.id} was cancelled"}, status=409)
+    headers = {k: request.headers[k] for k in FORWARDED_REQUEST_HEADERS if k in request.headers}
+    await request.app[jobs_key].put(job, index, headers, await request.read())
+    return web.json_response({"id": job.id, "chunk": index, "state": "queued"}, status=202)
+
+async def get_chunk(request):
+    """
+    The response of a chunk, as the endpoint answered it. Until it is done, waits up
+    to ?wait= seconds and then answers 202 with the chunk's state.
+    """
+    job, index = find_job(request)
+    chunk = job.chunks[index]
+    await job.wait(lambda: chunk.state == "done" or job.cancelled, wait_seconds(request))
+    if chunk.state == "done":
+        return web.Response(status=chunk.response.status, headers=chunk.response.headers, body=chunk.response.body)
+    if job.cancelled:
+        return web.json_response({"error": f"Job {job.id} was cancelled"}, status=409)
+    return web.json_response({"id": job.id, "chunk": index, "state": chunk.state}, status=202)
+
+async def get_job(request):
+    job, _ = find_job(request)
+    return web.json_response(job.status())
+
+async def list_jobs(request):
+    return web.json_response({"jobs": [job.status() for job in request.app[jobs_key].jobs.values()]})
+
+async def job_events(request):
+    """
+    Stream the status of a job as JSON lines, one per change (or every MAX_WAIT
+    seconds), each listing the chunks completed since the previous line, until
+    the job is done or cancelled.
+    """
+    job, _ = find_job(request)
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    seen, sent = -1, 0
+    while True:
+        if job.changes != seen:
+            seen = job.changes
+            completed = [index for index, number in job.completed.items() if number > sent]
+            sent = job.completions
+            await response.write(json.dumps({**job.status(), "completed": completed}).encode("utf-8") + b"\n")
+            if job.state in ("done", "cancelled"):
+                break
+        await job.wait(lambda: job.changes != seen, MAX_WAIT)
+        if job.changes == seen:
+            await response.write(b"\n")  # keeps idle connections open
+    await response.write_eof()
+    return response
+
+async def delete_job(request):
+    """Cancel a job that is not finished yet; remove a finished or cancelled one, with its results."""
+    job, _ = find_job(request)
+    store = request.app[jobs_key]
+    if job.state in ("done", "cancelled"):
+        store.remove(job)
+        return web.json_response({"id": job.id, "state": "removed"})
+    await store.cancel(job)
+    return web.json_response(job.status())
+
+async def job_worker(app, service_name):
+    """Send queued chunks to a service one at a time, like proxied requests (coalesced and cached)."""
+    store, pool = app[jobs_key], app[pools_key][service_name]
+    while True:
+        chunk, version = await store.next(service_name)
+        endpoint, headers, body = chunk.job.endpoint, chunk.headers, chunk.body
+        try:
+            key = fingerprint(endpoint, headers, body)
+            response = await app[coalescer_key].run(service_name, key, lambda: fetch(service_name, endpoint, pool, app[session_key], headers, body))
+        except Exception as e:
+            print(f"{service_name}{endpoint} job chunk failed: {e!r}")
+            response = error_response(502, f"{service_name} service failed: {e}")
+        job_chunks.inc(service=service_name, endpoint=endpoint, status=str(response.status))
+        await store.finish(chunk, version, response)
+
+async def expire_jobs(store):
+    while True:
+        await asyncio.sleep(min(60, store.ttl))
+        await store.expire()
+
+def job_counts(store) -> dict:
+    states = [job.state for job in store.jobs.values()]
+    return {state: states.count(state) for state in ("waiting", "queued", "running", "done", "cancelled")}
+
+async def jobs_ctx(app):
+    """The job store, JOB_CONCURRENCY workers per replica and the expiry of old jobs."""
+    store = app[jobs_key] = JobStore()
+    Gauge("luxeval_gateway_job_chunks_queued", "Job chunks waiting to be sent to the service.", ("service",), gateway_registry,
+          fn=lambda: {(name,): count for name, count in store.queued().items()})
+    Gauge("luxeval_gateway_jobs", "Jobs kept by the gateway, by state.", ("state",), gateway_registry,
+          fn=lambda: {(state,): count for state, count in job_counts(store).items()})
+    tasks = [asyncio.create_task(job_worker(app, name))
+             for name, pool in app[pools_key].items() for _ in range(JOB_CONCURRENCY * len(pool.replicas))]
+    tasks.append(asyncio.create_task(expire_jobs(store)))
+    yield
+    for task in tasks:
+        task.cancel()
+
+# Request bodies are forwarded as received, still compressed (see wire.py)
+app = web.Application(handler_args={"auto_decompress": False}, client_max_size=COALESCE_MAX_BYTES)
+app.cleanup_ctx.append(client_session)
+app.cleanup_ctx.append(service_health)
+app.cleanup_ctx.append(coalescer_ctx)
+app.cleanup_ctx.append(jobs_ctx)
+app.router.add_get("/", home)
+app.router.add_get("/stats", stats)
+app.router.add_get("/metrics", metrics)
+app.router.add_post("/autotune/{service}", autotune)
+app.router.add_post("/jobs", submit_job)
+app.router.add_get("/jobs", list_jobs)
+app.router.add_get("/jobs/{job_id}", get_job)
+app.router.add_delete("/jobs/{job_id}", delete_job)
+app.router.add_get("/jobs/{job_id}/events", job_events)
+app.router.add_put(r"/jobs/{job_id}/chunks/{index:\d+}", put_chunk)
+app.router.add_get(r"/jobs/{job_id}/chunks/{index:\d+}", get_chunk)
+
 for service_name, cfg in SERVICES.items():
     for endpoint in cfg["endpoints"]:
-        app.add_url_rule(endpoint, f"{service_name}_{endpoint}", make_proxy(service_name, endpoint), methods=["POST"])
+        app.router.add_post(endpoint, make_proxy(service_name, endpoint))
 
 # -------- Entry point --------
 if __name__ == '__main__':
     try:
         client_ip = get_client_accessible_ip()
-        print("Gateway is running!")
+        print("Gateway is running! Requests are held until their service is ready.")
         print(f"  - Local access (same machine): http://127.0.0.1:5000")
         print(f"  - Network access (other machines should use this IP): http://{client_ip}:5000")
-        app.run(host='0.0.0.0', port=5000, debug=True)
+        web.run_app(app, host='0.0.0.0', port=5000, print=None)
     finally:
-        for proc in processes.values():
-            proc.terminate()
+        for service_replicas in replicas.values():
+            for replica in service_replicas:
+                replica.proc.terminate()
@@ -0,0 +1,28 @@
+import os
+
+# Local model snapshots, one folder per hub repo; services load from here without contacting the hub
+MODEL_DIR = os.environ.get("LUXEVAL_MODEL_DIR", "./models")
+COMPLETE_MARKER = ".complete"
+
+# Weight formats that are skipped when a repo also has safetensors weights
+LEGACY_WEIGHTS = ["*.bin", "*.h5", "*.msgpack", "*.ot", "*.pt", "onnx/*", "openvino/*"]
+
+def snapshot_path(repo_id: str) -> str:
+    return os.path.join(MODEL_DIR, repo_id.replace("/", "--"))
+
+def local_model(repo_id: str) -> str:
+    """
+    Return the folder of a local snapshot of `repo_id`, downloading it on first use.
+    If the repo has safetensors weights, only those are fetched; transformers maps
+    them from disk instead of unpickling them. Once a snapshot is complete it is
+    used as is, so later starts need neither the hub nor the network.
+    """
+    path = snapshot_path(repo_id)
+    if os.path.exists(os.path.join(path, COMPLETE_MARKER)):
+        return path
+
+    from huggingface_hub import list_repo_files, snapshot_download
+    has_safetensors = any(f.endswith(".safetensors") for f in list_repo_files(repo_id))
+    snapshot_download(repo_id, local_dir=path, ignore_patterns=LEGACY_WEIGHTS if has_safetensors else None)
+    open(os.path.join(path, COMPLETE_MARKER), "w").close()
+    return path
@@ -0,0 +1,20 @@
+def flatten(shared: list, systems: dict):
+    """
+    Lay out the candidates of several systems end to end, each aligned with the
+    shared source/reference list. Returns (shared_flat, candidates_flat, spans).
+    """
+    shared_flat, candidates_flat, spans = [], [], {}
+    for name, candidates in systems.items():
+        spans[name] = (len(candidates_flat), len(candidates_flat) + len(candidates))
+        shared_flat.extend(shared)
+        candidates_flat.extend(candidates)
+    return shared_flat, candidates_flat, spans
+
+def split(scores: list, spans: dict) -> dict:
+    """Inverse of `flatten` for the scores: {system: segment scores}."""
+    return {name: scores[start:end] for name, (start, end) in spans.items()}
+
+def valid(shared: list, systems) -> bool:
+    """Every system must have one non-empty candidate list aligned with `shared`."""
+    return (bool(shared) and isinstance(systems, dict) and bool(systems)
+            and all(isinstance(c, list) and len(c) == len(shared) for c in systems.values()))
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# Shared by all services; set LUXEVAL_SCORE_CACHE="" to disable caching
+CACHE_PATH = os.environ.get("LUXEVAL_SCORE_CACHE", "./cache/scores.sqlite")
+
+def segment_key(metric: str, model_id: str, config: dict, source, reference, candidate) -> str:
+    """Content address of one segment score: hash of metric, checkpoint, config and texts."""
+    payload = json.dumps([metric, model_id, config, source, reference, candidate], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def segment_keys(metric: str, model_id: str, config: dict, candidates: list, references=None, sources=None) -> list:
+    """Build the cache keys for aligned candidate/reference/source lists."""
+    n = len(candidates)
+    references = references if references is not None else [None] * n
+    sources = sources if sources is not None else [None] * n
+    return [segment_key(metric, model_id, config, src, ref, cand) for src, ref, cand in zip(sources, references, candidates)]
+
+def select_in(conn, query: str, values: list) -> list:
+    """All rows of `query`, whose "IN ({})" is filled with `values` in chunks that stay below SQLite's variable limit."""
+    rows = []
+    for start in range(0, len(values), 500):
+        chunk = values[start:start + 500]
+        rows.extend(conn.execute(query.format(",".join("?" * len(chunk))), chunk).fetchall())
+    return rows
+
+class ScoreCache:
+    """
+    Persistent segment-score store backed by SQLite.
+    Safe to share between the service processes and their request threads.
+    """
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL NOT NULL)")
+            self._conn.commit()
+
+    def get_many(self, keys: list) -> list:
+        """Return the cached score for every key, or None where there is none."""
+        if self._conn is None:
+            return [None] * len(keys)
+        with self._lock:
+            found = dict(select_in(self._conn, "SELECT key, score FROM scores WHERE key IN ({})", list(set(keys))))
+        return [found.get(k) for k in keys]
+
+    def put_many(self, keys: list, scores: list):
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)", zip(keys, scores))
+            self._conn.commit()
+
+    def lookup(self, keys: list, compute):
+        """
+        Return (scores, stats) for `keys`. `compute(indices)` is called once with the
+        positions of the uncached keys (duplicates scored once) and must return their
+        scores in the same order; results are stored and spliced back in place.
+        stats counts per position: "hits" from the store and "misses", of which
+        "deduplicated" repeated an earlier miss of the same request.
+        """
+        scores = stored = self.get_many(keys)
+        first_miss = {}
+        for i, (key, score) in enumerate(zip(keys, scores)):
+            if score is None and key not in first_miss:
+                first_miss[key] = i
+
+        if first_miss:
+            computed = [float(s) for s in compute(list(first_miss.values()))]
+            self.put_many(list(first_miss), computed)
+            by_key = dict(zip(first_miss, computed))
+            scores = [by_key[k] if s is None else s for k, s in zip(keys, scores)]
+
+        # Every position without a stored score is a miss; repeats of a key within the request are scored once
+        misses = sum(1 for score in stored if score is None)
+        return scores, {"hits": len(keys) - misses, "misses": misses, "deduplicated": misses - len(first_miss)}
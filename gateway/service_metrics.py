@@ -0,0 +1,233 @@
+"""
+Prometheus metrics in the text exposition format, without dependencies. Every
+service serves its own on GET /metrics (see `instrument`); the gateway adds the
+service and replica to their labels and serves them together with its own.
+Rates such as segments per second are left to Prometheus (rate() of the counters).
+"""
+import bisect
+from collections import OrderedDict
+import os
+import re
+import resource
+import sys
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics)
+
+REGISTRY = Registry()
+
+class Metric:
+    """
+    Values by label values. Counters and gauges can instead be read from `fn()`
+    at every scrape, which returns a number or {label values: number}.
+    """
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=(), registry: Registry = REGISTRY, fn=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.fn = fn
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[n] for n in self.label_names)
+
+    def _samples(self):
+        """(suffix, label values, extra label, value) for every sample."""
+        if self.fn is not None:
+            values = self.fn()
+            if not isinstance(values, dict):
+                values = {(): values} if values is not None else {}
+            return [("", key, "", value) for key, value in values.items()]
+        with self._lock:
+            return [("", key, "", value) for key, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_labels(self.label_names, key, extra)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), registry: Registry = REGISTRY, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    samples.append(("_bucket", key, f'le="{_number(bound)}"', cumulative))
+                samples.append(("_sum", key, "", total))
+                samples.append(("_count", key, "", cumulative))
+        return samples
+
+# -------- Process --------
+def resident_memory() -> int:
+    """Resident set size in bytes (the peak where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def cuda_memory(kind: str) -> dict:
+    """{(device,): bytes} allocated/reserved by torch, if this process uses CUDA already."""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return {}
+    read = torch.cuda.memory_allocated if kind == "allocated" else torch.cuda.memory_reserved
+    return {(str(i),): read(i) for i in range(torch.cuda.device_count())}
+
+def process_metrics(registry: Registry = REGISTRY, prefix: str = "luxeval"):
+    Gauge(f"{prefix}_process_resident_memory_bytes", "Resident memory of the process.", registry=registry, fn=resident_memory)
+    Gauge(f"{prefix}_cuda_memory_allocated_bytes", "CUDA memory allocated by torch tensors.", ("device",), registry, fn=lambda: cuda_memory("allocated"))
+    Gauge(f"{prefix}_cuda_memory_reserved_bytes", "CUDA memory held by torch's caching allocator.", ("device",), registry, fn=lambda: cuda_memory("reserved"))
+
+# -------- Services --------
+requests_total = Counter("luxeval_requests_total", "Requests handled, by endpoint and status.", ("endpoint", "status"))
+request_duration = Histogram("luxeval_request_duration_seconds", "Time to answer a request.", ("endpoint",))
+segments_total = Counter("luxeval_segments_total", "Segments scored (cached or not).", ("endpoint",))
+cache_hits_total = Counter("luxeval_cache_hits_total", "Segments answered from the score cache.", ("endpoint",))
+cache_misses_total = Counter("luxeval_cache_misses_total", "Segments not found in the score cache.", ("endpoint",))
+cache_deduplicated_total = Counter("luxeval_cache_deduplicated_total", "Cache misses that repeated another segment of the same request, scored once.", ("endpoint",))
+batch_size = Histogram("luxeval_batch_size", "Items per model batch.", buckets=SIZE_BUCKETS)
+batch_duration = Histogram("luxeval_batch_duration_seconds", "Time the model takes for one batch.")
+
+def record_segments(endpoint: str, count: int, cache_stats: dict = None):
+    """Count the segments of one request, and how many came from the cache (see `ScoreCache.lookup`)."""
+    segments_total.inc(count, endpoint=endpoint)
+    if cache_stats is not None:
+        cache_hits_total.inc(cache_stats["hits"], endpoint=endpoint)
+        cache_misses_total.inc(cache_stats["misses"], endpoint=endpoint)
+        cache_deduplicated_total.inc(cache_stats.get("deduplicated", 0), endpoint=endpoint)
+
+def observe_batches(fn):
+    """Wrap a `MicroBatcher` function so the size and duration of every batch are recorded."""
+    def run(items):
+        start = time.perf_counter()
+        results = fn(items)
+        batch_duration.observe(time.perf_counter() - start)
+        batch_size.observe(len(items))
+        return results
+    return run
+
+def queue_depth(fn):
+    """Report `fn()` (e.g. `MicroBatcher.depth`) as the number of items waiting for a batch."""
+    Gauge("luxeval_queue_depth", "Items waiting for a model batch.", fn=fn)
+
+def instrument(app):
+    """Time and count every request of a Flask app, and serve the metrics on GET /metrics."""
+    from flask import Response, g, request
+
+    process_metrics()
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record(exc):
+        """Runs for every request, also when an unhandled exception skipped the after_request hooks."""
+        if request.path not in ("/", "/metrics") and "metrics_start" in g:  # not health checks and scrapes
+            endpoint = request.url_rule.rule if request.url_rule else "unknown"
+            status = g.get("metrics_status", 500) if exc is None else 500
+            request_duration.observe(time.perf_counter() - g.metrics_start, endpoint=endpoint)
+            requests_total.inc(endpoint=endpoint, status=str(status))
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+# -------- Aggregation --------
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})?\s+(\S+)")
+
+def merge(texts: list) -> str:
+    """
+    Combine several expositions into one, e.g. of all replicas. `texts` holds
+    ({label: value} to add to every sample, text) pairs; HELP and TYPE are kept
+    once per metric and the samples of every source are grouped under them.
+    """
+    families = OrderedDict()  # name -> [HELP/TYPE lines, samples]
+    for extra_labels, text in texts:
+        extra = ",".join(f'{k}="{_escape(v)}"' for k, v in extra_labels.items())
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = line.split()[2]
+                header, _ = families.setdefault(family, ([], []))
+                if not any(h.split()[1] == line.split()[1] for h in header):
+                    header.append(line)
+                continue
+            match = _SAMPLE.match(line)
+            if not match or family is None:
+                continue
+            name, labels, value = match.groups()
+            labels = labels[1:-1] if labels else ""
+            labels = ",".join(part for part in (extra, labels) if part)
+            families[family][1].append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return "".join("\n".join(header + samples) + "\n" for header, samples in families.values())
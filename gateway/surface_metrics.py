@@ -0,0 +1,78 @@
+"""
+Sentence-level BLEU, chrF2 and TER with their sufficient statistics. sacrebleu is
+pure Python, so segments are split into chunks that are scored by worker processes.
+"""
+import multiprocessing
+import os
+from sacrebleu.metrics import BLEU, CHRF, TER
+
+# Worker processes per service replica (set by the gateway); 1 scores in the request thread
+WORKERS = int(os.environ.get("SACREBLEU_WORKERS", str(os.cpu_count() or 1)))
+MIN_CHUNK = 256  # segments per task
+
+# -------- sacrebleu adapter --------
+# The only uses of sacrebleu's private Metric API; tests/test_surface_metrics.py checks them against its public one
+
+def extract_statistics(metric, hypotheses: list, references: list) -> list:
+    """One list of sufficient statistics per segment, each with a single reference."""
+    return metric._extract_corpus_statistics(hypotheses, [references])
+
+def score_from_statistics(metric, stats):
+    """The sacrebleu score of one row of (summed) statistics."""
+    return metric._compute_score_from_stats(stats)
+
+def aggregate(metric, stats: list):
+    """The corpus score of per-segment statistics, as `metric.corpus_score` computes it."""
+    return metric._aggregate_and_compute(stats)
+
+def corpus_metrics() -> dict:
+    """The metrics statistics are extracted with, by score name (as in sacrebleu's signatures)."""
+    return {"BLEU": BLEU(), "chrF2": CHRF(), "TER": TER()}
+
+def signatures() -> dict:
+    """Configuration of each metric, so callers can tell whether the statistics match their own."""
+    result = {}
+    for name, metric in corpus_metrics().items():
+        metric.num_refs = 1  # set by sacrebleu once references are seen; always one here
+        result[name] = metric.get_signature().format()
+    return result
+
+def score_chunk(hypotheses: list, references: list) -> dict:
+    """{metric: (segment statistics, sentence scores)}; sentence BLEU uses effective order like sacrebleu's sentence_bleu."""
+    sentence_bleu = BLEU(effective_order=True)
+    result = {}
+    for name, metric in corpus_metrics().items():
+        stats = extract_statistics(metric, hypotheses, references)
+        sentence_metric = sentence_bleu if name == "BLEU" else metric
+        result[name] = (stats, [score_from_statistics(sentence_metric, s).score for s in stats])
+    return result
+
+class SegmentScorer:
+    """
+    Scores segments on a pool of forked worker processes. The pool is started when
+    the scorer is created, so create it before any model is moved to the GPU.
+    """
+    def __init__(self, workers: int = WORKERS):
+        self.workers = workers
+        self._pool = multiprocessing.get_context("fork").Pool(workers) if workers > 1 else None
+
+    def score(self, hypotheses: list, references: list) -> dict:
+        """{metric: {"scores": sentence scores, "stats": segment statistics}} for aligned segment lists."""
+        size = max(MIN_CHUNK, -(-len(hypotheses) // self.workers))
+        chunks = [(hypotheses[start:start + size], references[start:start + size]) for start in range(0, len(hypotheses), size)]
+        if self._pool is not None and len(chunks) > 1:
+            results = self._pool.starmap(score_chunk, chunks)
+        else:
+            results = [score_chunk(*chunk) for chunk in chunks]
+
+        scored = {name: {"scores": [], "stats": []} for name in corpus_metrics()}
+        for result in results:
+            for name, (stats, scores) in result.items():
+                scored[name]["stats"].extend(stats)
+                scored[name]["scores"].extend(scores)
+        return scored
+
+def corpus_scores(stats: dict) -> dict:
+    """Corpus score of each metric from its segment statistics ({metric: stats})."""
+    metrics = corpus_metrics()
+    return {name: aggregate(metrics[name], s).score for name, s in stats.items()}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The services import their sibling modules by name, as when run from gateway/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import autotune
+
+def test_guarded_batches_run_concurrently_and_shrink_once(monkeypatch):
+    monkeypatch.setattr(autotune, "AUTOTUNE", False)
+    limit = autotune.BatchLimit("TEST_MAX_TOKENS", "model", "device", 1024)
+    both_running = threading.Barrier(2, timeout=5)
+    shrinks = []
+
+    class Batcher:
+        max_tokens = property(lambda self: limit.value, lambda self, value: shrinks.append(value))
+    limit.bind(Batcher(), "max_tokens")
+
+    def fn(items):
+        if len(items) > 2:
+            both_running.wait()  # raises if the other batch cannot start meanwhile
+            raise MemoryError()
+        return items
+
+    run = limit.guard(fn, size=lambda items: 1024)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(run, [[1, 2, 3, 4], [5, 6, 7, 8]]))
+    assert results == [[1, 2, 3, 4], [5, 6, 7, 8]]
+    assert shrinks == [1024, 512]
+    assert limit.value == 512
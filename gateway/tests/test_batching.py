@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+import random
+import threading
+
+import pytest
+
+from batching import MicroBatcher, fits, token_batches
+
+def test_fits():
+    assert fits(1, 1000, 64)  # a single item always runs
+    assert fits(4, 16, 64)
+    assert not fits(5, 16, 64)
+    assert fits(1000, 1000, 0)  # no token budget
+
+def test_token_batches_stay_within_the_budget():
+    lengths = [3, 40, 7, 7, 20, 1, 100]
+    batches = token_batches(lengths, 40, max_batch_size=3)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 3
+        assert fits(len(batch), max(lengths[i] for i in batch), 40)
+    assert batches[0] == [6]  # longest first
+
+def test_mixed_lengths_come_back_in_submission_order():
+    batches = []
+
+    def fn(items):
+        batches.append(list(items))
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(fn, max_batch_size=None, max_wait=0.05, lengths=lambda items: [len(i) for i in items], max_tokens=40)
+    rng = random.Random(0)
+    requests = [["x" * rng.randint(1, 30) + str(r) + str(i) for i in range(rng.randint(1, 12))] for r in range(6)]
+    start = threading.Barrier(len(requests))
+
+    def submit(items):
+        start.wait()
+        return batcher.submit(items)
+
+    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+        results = list(executor.map(submit, requests))
+
+    assert results == [[item.upper() for item in items] for items in requests]
+    for batch in batches:
+        assert fits(len(batch), max(len(item) for item in batch), 40)
+    assert sorted(item for batch in batches for item in batch) == sorted(item for items in requests for item in items)
+
+def test_item_limit_and_errors():
+    sizes = []
+
+    def fn(items):
+        sizes.append(len(items))
+        if "boom" in items:
+            raise ValueError("boom")
+        return [i * 2 for i in items]
+
+    batcher = MicroBatcher(fn, max_batch_size=4, max_wait=0)
+    assert batcher.submit(list(range(10))) == [i * 2 for i in range(10)]
+    assert sizes == [4, 4, 2]
+    with pytest.raises(ValueError):
+        batcher.submit([1, "boom"])
+    assert batcher.submit([5]) == [10]
+    assert batcher.depth() == 0
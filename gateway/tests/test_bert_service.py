@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import threading
+from unittest import mock
+
+os.environ.update({"BERTSCORE_WARM_LANGS": "", "BERTSCORE_BACKEND": "cpu", "BERTSCORE_MAX_TOKENS": "64",
+                   "LUXEVAL_SCORE_CACHE": "", "SACREBLEU_WORKERS": "1"})
+
+import pytest
+
+pytest.importorskip("bert_score")
+with mock.patch.object(sys, "argv", ["bert_service.py"]):  # the service reads its port from argv
+    import bert_service
+
+WORDS = "the a cat dog sat ran on under mat house big small red blue".split()
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    """A randomly initialised two-layer BERT with a word-level vocabulary."""
+    from transformers import BertConfig, BertModel, BertTokenizer
+    path = tmp_path_factory.mktemp("tiny_bert")
+    vocab = path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS) + "\n")
+    BertTokenizer(str(vocab), model_max_length=512).save_pretrained(path)
+    config = BertConfig(vocab_size=5 + len(WORDS), hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64)
+    BertModel(config).save_pretrained(path)
+    return str(path)
+
+def test_shared_references_are_embedded_once(tiny_model, monkeypatch):
+    monkeypatch.setattr(bert_service, "resolve_model", lambda language: (tiny_model, 2))
+    scorer = bert_service.pool.get("en")
+    embedded = []
+    hook = scorer._model.register_forward_hook(lambda module, args, output: embedded.append(len(args[0])))
+    references = ["the cat sat on the mat", "a dog ran under the house", "the big red house", "a small blue cat sat"]
+    systems = {f"system{s}": [f"{WORDS[s]} {WORDS[s + i + 1]} {WORDS[s + 2 * i + 2]} dog" for i in range(len(references))]
+               for s in range(3)}
+    try:
+        response = bert_service.app.test_client().post("/bertscore", json={"references": references, "systems": systems, "language": "en"})
+    finally:
+        hook.remove()
+
+    assert response.status_code == 200
+    scores = response.get_json()["bert_scores"]
+    assert {name: len(s) for name, s in scores.items()} == {name: len(references) for name in systems}
+    distinct = set(references) | {c for candidates in systems.values() for c in candidates}
+    # The budget of 64 tokens forces several batches; every distinct sentence still goes through the encoder once
+    assert len(embedded) > 1
+    assert sum(embedded) == len(distinct)
+
+def test_loading_a_model_does_not_block_resident_scorers(monkeypatch):
+    monkeypatch.setattr(bert_service, "resolve_model", lambda language: (f"model-{language}", 2))
+    pool = bert_service.ScorerPool(budget_mb=1000)
+    release, loaded = threading.Event(), []
+
+    def load(key, language):
+        loaded.append(language)
+        if language == "de":
+            release.wait(10)
+        return f"scorer-{language}", 1
+    monkeypatch.setattr(pool, "_load", load)
+
+    assert pool.get("fr") == "scorer-fr"
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        loading = [executor.submit(pool.get, "de") for _ in range(2)]  # the second waits for the first load
+        assert pool.get("fr") == "scorer-fr"
+        assert not any(future.done() for future in loading)
+        release.set()
+        assert [future.result(10) for future in loading] == ["scorer-de", "scorer-de"]
+    assert loaded == ["fr", "de"]
+
+def test_batches_are_sized_by_their_own_sentences(tiny_model, monkeypatch):
+    monkeypatch.setattr(bert_service, "resolve_model", lambda language: (tiny_model, 2))
+    scorer = bert_service.pool.get("en")
+    embedded = []
+    hook = scorer._model.register_forward_hook(lambda module, args, output: embedded.append(tuple(args[0].shape)))
+    long = [" ".join(WORDS[(s + i) % len(WORDS)] for i in range(20)) for s in range(2)]
+    short = [f"{WORDS[s]} {WORDS[s + 1]}" for s in range(10)]
+    candidates, references = long + short, short[::-1] + long
+    try:
+        scores = bert_service.score_pairs(scorer, candidates, references, 64)
+    finally:
+        hook.remove()
+
+    P, R, F1 = scorer.score(candidates, references)
+    assert scores == pytest.approx((F1 * 100).tolist(), abs=1e-4)
+    # The long sentences run alone; the short ones share batches that a request-wide size would have split
+    assert all(rows * tokens <= 64 or rows == 1 for rows, tokens in embedded)
+    assert max(rows for rows, _ in embedded) > 64 // max(tokens for _, tokens in embedded)
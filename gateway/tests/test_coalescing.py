@@ -0,0 +1,49 @@
+import asyncio
+from coalescing import BufferedResponse, Coalescer, ResponseCache, fingerprint
+
+def test_identical_in_flight_requests_share_one_fetch():
+    async def scenario():
+        coalescer = Coalescer(ResponseCache(ttl=0))
+        release, fetches = asyncio.Event(), []
+
+        async def fetch():
+            fetches.append(1)
+            await release.wait()
+            return BufferedResponse(200, {}, b"scores")
+
+        key = fingerprint("/bertscore", {"Content-Type": "application/json"}, b'{"candidates": ["a"]}')
+        waiting = [asyncio.ensure_future(coalescer.run("bert", key, fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert coalescer.in_flight() == 1
+        release.set()
+        responses = await asyncio.gather(*waiting)
+
+        assert fetches == [1]
+        assert all(response.body == b"scores" for response in responses)
+        assert coalescer.stats["bert"] == {"computed": 1, "coalesced": 2}
+        assert coalescer.in_flight() == 0
+    asyncio.run(scenario())
+
+def test_different_requests_are_not_coalesced():
+    assert fingerprint("/bertscore", {}, b"a") != fingerprint("/bertscore", {}, b"b")
+    assert fingerprint("/bertscore", {}, b"a") != fingerprint("/bertscore", {"Content-Encoding": "gzip"}, b"a")
+    assert fingerprint("/bertscore", {}, b"a") != fingerprint("/bleurt", {}, b"a")
+
+def test_a_cancelled_waiter_does_not_cancel_the_fetch():
+    async def scenario():
+        coalescer = Coalescer(ResponseCache(ttl=30))
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return BufferedResponse(200, {}, b"scores")
+
+        first = asyncio.ensure_future(coalescer.run("bert", "key", fetch))
+        second = asyncio.ensure_future(coalescer.run("bert", "key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()  # its client disconnected
+        release.set()
+        assert (await second).body == b"scores"
+        assert (await coalescer.run("bert", "key", fetch)).body == b"scores"  # from the response cache
+        assert coalescer.stats["bert"]["cache_hits"] == 1
+    asyncio.run(scenario())
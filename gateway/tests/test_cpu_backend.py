@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+import cpu_backend
+
+def test_backend_setting(monkeypatch):
+    monkeypatch.setenv("COMET_BACKEND", " CPU-int8 ")
+    assert cpu_backend.backend("comet") == "cpu-int8"
+    assert cpu_backend.backend("comet", int8=False) == "cpu"  # a model that cannot be quantised runs fp32
+    monkeypatch.setenv("COMET_BACKEND", "tpu")
+    with pytest.raises(ValueError, match="COMET_BACKEND must be one of"):
+        cpu_backend.backend("comet")
+
+def test_int8_scores_are_cached_separately():
+    config = {"num_layers": 17}
+    assert cpu_backend.cache_config("cpu", config) == cpu_backend.cache_config("gpu", config) == config
+    assert cpu_backend.cache_config("cpu-int8", config) == {"num_layers": 17, "backend": "cpu-int8"}
+
+def test_calibration_report(tmp_path, monkeypatch):
+    items = [{"source": "", "reference": "", "candidate": str(i)} for i in range(4)]
+    (tmp_path / "set.json").write_text(json.dumps(items))
+    monkeypatch.setattr(cpu_backend, "CALIBRATION_SET", str(tmp_path / "set.json"))
+    monkeypatch.setattr(cpu_backend, "CALIBRATION_DIR", str(tmp_path / "reports"))
+
+    report = cpu_backend.calibrate("bleurt", lambda items: [1.0, 2.0, 3.0, 4.0], lambda items: [1.0, 2.5, 2.5, 4.5])
+    assert report["segments"] == 4
+    assert report["spearman"] == pytest.approx(cpu_backend.compare([1, 2, 3, 4], [1, 2.5, 2.5, 4.5])["spearman"])
+    assert report["max_abs_diff"] == pytest.approx(0.5)
+    assert json.loads((tmp_path / "reports" / "bleurt.json").read_text())["pearson"] == pytest.approx(report["pearson"])
+
+def test_ranks_share_ties():
+    assert cpu_backend._ranks([3.0, 1.0, 3.0, 2.0]).tolist() == [2.5, 0.0, 2.5, 1.0]
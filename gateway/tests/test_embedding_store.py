@@ -0,0 +1,29 @@
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+DIM = 4
+
+def encoder(calls: list):
+    """Deterministic embeddings from the text length, recording every call."""
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[len(t), 1, 2, 3] for t in texts], dtype=np.float32)
+    return encode
+
+def test_replicas_share_one_directory(tmp_path):
+    first, second = EmbeddingStore(str(tmp_path), DIM), EmbeddingStore(str(tmp_path), DIM)
+    calls = []
+    first.get(["a", "bb"], encoder(calls))  # second has not mapped the matrix yet
+    assert second.get(["ccc", "dddd"], encoder(calls))[:, 0].tolist() == [3, 4]
+
+    first.get([f"text {i}" for i in range(2000)], encoder(calls))  # grows the file past second's mapping
+    assert second.get(["eeeee", "a"], encoder(calls))[:, 0].tolist() == [5, 1]
+    assert first.get(["ccc", "eeeee"], encoder(calls))[:, 0].tolist() == [3, 5]
+    assert calls[-1] == ["eeeee"]  # "a" came from the store, and nothing is encoded twice
+
+def test_repeated_texts_are_encoded_once_without_a_store():
+    calls = []
+    embeddings = EmbeddingStore(None, DIM).get(["s", "s", "s", "c1", "c2", "c3"], encoder(calls))
+    assert calls == [["s", "c1", "c2", "c3"]]
+    assert embeddings[:, 0].tolist() == [1, 1, 1, 2, 2, 2]
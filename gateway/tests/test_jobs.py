@@ -0,0 +1,56 @@
+import asyncio
+from coalescing import BufferedResponse
+from jobs import JobStore
+
+OK = BufferedResponse(200, {}, b"{}")
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_expired_job_is_not_sent():
+    async def scenario():
+        store = JobStore(ttl=60)
+        abandoned = store.create("bert", "/bertscore", 2)
+        await store.put(abandoned, 0, {}, b"0")
+        await store.put(abandoned, 1, {}, b"1")
+        abandoned.updated -= 120  # last touched two minutes ago
+        await store.expire()
+
+        assert abandoned.id not in store.jobs
+        assert abandoned.cancelled and all(chunk.body is None for chunk in abandoned.chunks)
+        assert store.queued() == {"bert": 0}
+        current = store.create("bert", "/bertscore", 1)
+        await store.put(current, 0, {}, b"current")
+        chunk, _ = await asyncio.wait_for(store.next("bert"), 1)
+        assert chunk.job is current
+    run(scenario())
+
+def test_chunk_uploaded_again_completes_once():
+    async def scenario():
+        store = JobStore()
+        job = store.create("bert", "/bertscore", 2)
+        for index in (0, 1, 0):  # chunk 0 is uploaded again after it was scored
+            await store.put(job, index, {}, b"body")
+            chunk, version = await store.next("bert")
+            await store.finish(chunk, version, OK)
+
+        assert list(job.completed) == [1, 0]
+        assert job.state == "done" and job.status()["done"] == 2
+    run(scenario())
+
+def test_cancelled_chunks_are_reported_as_cancelled():
+    async def scenario():
+        store = JobStore()
+        job = store.create("bert", "/bertscore", 3)
+        for index in (0, 1):
+            await store.put(job, index, {}, b"body")
+        chunk, version = await store.next("bert")
+        await store.cancel(job)
+        await store.finish(chunk, version, OK)  # sent before the job was cancelled
+
+        status = job.status()
+        assert status["state"] == "cancelled"
+        assert {state: status[state] for state in ("missing", "queued", "running", "done", "cancelled")} == \
+            {"missing": 1, "queued": 0, "running": 0, "done": 1, "cancelled": 1}
+        assert store.queued() == {"bert": 0}
+    run(scenario())
@@ -0,0 +1,25 @@
+from score_cache import ScoreCache
+
+def test_repeated_uncached_segments_count_as_misses(tmp_path):
+    cache = ScoreCache(str(tmp_path / "scores.sqlite"))
+    computed = []
+
+    def compute(indices):
+        computed.append(indices)
+        return [float(i) for i in indices]
+
+    scores, stats = cache.lookup(["a", "b", "a", "a"], compute)
+    assert computed == [[0, 1]]
+    assert scores == [0.0, 1.0, 0.0, 0.0]
+    assert stats == {"hits": 0, "misses": 4, "deduplicated": 2}
+
+    scores, stats = cache.lookup(["a", "c", "c"], compute)
+    assert computed[-1] == [1]
+    assert scores == [0.0, 1.0, 1.0]
+    assert stats == {"hits": 1, "misses": 2, "deduplicated": 1}
+
+def test_lookups_beyond_sqlites_variable_limit(tmp_path):
+    cache = ScoreCache(str(tmp_path / "scores.sqlite"))
+    keys = [f"key{i}" for i in range(1201)]
+    cache.put_many(keys[::2], [float(i) for i in range(0, 1201, 2)])
+    assert cache.get_many(keys + ["key0"]) == [float(i) if i % 2 == 0 else None for i in range(1201)] + [0.0]
@@ -0,0 +1,36 @@
+from flask import Flask
+import pytest
+
+import service_metrics
+
+def requests_counted(endpoint: str, status: str) -> float:
+    return sum(value for _, labels, _, value in service_metrics.requests_total._samples() if labels == (endpoint, status))
+
+@pytest.fixture(scope="module")
+def app():
+    app = Flask(__name__)
+    service_metrics.instrument(app)
+
+    @app.route("/fails", methods=["POST"])
+    def fails():
+        raise RuntimeError("model crashed")
+
+    @app.route("/works", methods=["POST"])
+    def works():
+        return "ok"
+    return app
+
+@pytest.mark.parametrize("propagate", [False, True])
+def test_unhandled_exceptions_are_counted_as_500(app, propagate):
+    app.testing = propagate  # exceptions propagating to the caller skip the after_request hooks
+    before = requests_counted("/fails", "500")
+    try:
+        assert app.test_client().post("/fails").status_code == 500
+    except RuntimeError:
+        assert propagate
+    assert requests_counted("/fails", "500") == before + 1
+
+def test_responses_are_counted_with_their_status(app):
+    before = requests_counted("/works", "200")
+    assert app.test_client().post("/works").status_code == 200
+    assert requests_counted("/works", "200") == before + 1
@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("sacrebleu")
+import surface_metrics
+
+HYPOTHESES = ["the cat sat on the mat", "a dog ran", "", "Ëch hunn en Hond gesinn ."]
+REFERENCES = ["the cat sat on a mat", "the dog ran away", "nothing", "Ech hunn en Hond gesi ."]
+
+def test_adapter_matches_the_public_api():
+    for name, metric in surface_metrics.corpus_metrics().items():
+        stats = surface_metrics.extract_statistics(metric, HYPOTHESES, REFERENCES)
+        expected = metric.corpus_score(HYPOTHESES, [REFERENCES]).score
+        assert surface_metrics.aggregate(metric, stats).score == pytest.approx(expected), name
+        assert surface_metrics.corpus_scores({name: stats}) == {name: pytest.approx(expected)}
+        summed = [sum(column) for column in zip(*stats)]
+        assert surface_metrics.score_from_statistics(metric, summed).score == pytest.approx(expected), name
+
+def test_segment_scores_match_sentence_scores():
+    scored = surface_metrics.SegmentScorer(workers=1).score(HYPOTHESES, REFERENCES)
+    for name, metric in surface_metrics.corpus_metrics().items():
+        if name == "BLEU":
+            metric = type(metric)(effective_order=True)
+        expected = [metric.sentence_score(h, [r]).score for h, r in zip(HYPOTHESES, REFERENCES)]
+        assert scored[name]["scores"] == pytest.approx(expected), name
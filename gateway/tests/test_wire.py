@@ -0,0 +1,31 @@
+import gzip
+import pytest
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+import wire
+
+ENCODINGS = ["gzip"] + (["zstd"] if wire.zstandard is not None else [])
+
+def compress(body: bytes, encoding: str) -> bytes:
+    return gzip.compress(body) if encoding == "gzip" else wire.zstandard.ZstdCompressor().compress(body)
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_round_trip(encoding):
+    body = b'{"candidates": ["a"]}' * 1000
+    assert wire.decompress(compress(body, encoding), encoding, max_bytes=len(body)) == body
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_body_expanding_past_the_limit_is_refused(encoding):
+    bomb = compress(b"\0" * (64 * 1024 * 1024), encoding)  # compresses to a few kilobytes
+    assert len(bomb) < 1024 * 1024
+    with pytest.raises(RequestEntityTooLarge):
+        wire.decompress(bomb, encoding, max_bytes=4 * 1024 * 1024)
+
+def test_uncompressed_body_past_the_limit_is_refused():
+    with pytest.raises(RequestEntityTooLarge):
+        wire.decompress(b"x" * 11, "identity", max_bytes=10)
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_corrupt_body_is_a_bad_request(encoding):
+    with pytest.raises(BadRequest):
+        wire.decompress(compress(b"payload" * 100, encoding)[:-8] + b"garbage!", encoding)
@@ -0,0 +1,105 @@
+"""
+Request/response encoding shared by the services. Bodies are JSON or MessagePack
+(Content-Type / Accept) and optionally zstd- or gzip-compressed (Content-Encoding /
+Accept-Encoding); JSON without compression always works. The gateway passes bodies
+and these headers through unchanged.
+"""
+from flask import Response, request
+import gzip
+import io
+import json
+import numpy as np
+import os
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MIN_COMPRESS_BYTES = 1024  # smaller responses are sent as they are
+# Largest request body a service accepts, after decompression
+MAX_BODY_BYTES = int(float(os.environ.get("LUXEVAL_MAX_BODY_MB", "256")) * 1024 * 1024)
+DECOMPRESS_PIECE_BYTES = 1024 * 1024
+DECODE_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+def _plain(obj):
+    """numpy scalars/arrays as plain Python values, for MessagePack."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Cannot encode {type(obj).__name__}")
+
+def decompress(body: bytes, encoding: str, max_bytes: int = MAX_BODY_BYTES) -> bytes:
+    """
+    Decompress a request body. It is inflated in pieces and refused (413) as soon
+    as it exceeds `max_bytes`, so a small upload cannot expand into gigabytes.
+    """
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        if len(body) > max_bytes:
+            raise RequestEntityTooLarge(f"Request body exceeds {max_bytes} bytes (LUXEVAL_MAX_BODY_MB)")
+        return body
+    if encoding == "gzip":
+        reader = gzip.GzipFile(fileobj=io.BytesIO(body))
+    elif encoding == "zstd" and zstandard is not None:
+        reader = zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True)
+    else:
+        raise UnsupportedMediaType(f"Unsupported Content-Encoding: {encoding}")
+
+    data = bytearray()
+    try:
+        while True:
+            piece = reader.read(DECOMPRESS_PIECE_BYTES)
+            if not piece:
+                return bytes(data)
+            data += piece
+            if len(data) > max_bytes:
+                raise RequestEntityTooLarge(f"Request body exceeds {max_bytes} bytes once decompressed (LUXEVAL_MAX_BODY_MB)")
+    except DECODE_ERRORS as e:
+        raise BadRequest(f"Invalid {encoding} body: {e}")
+
+def compress(body: bytes, accept_encoding: str):
+    """Compress with the best encoding the caller accepts; returns (body, encoding or None)."""
+    accepted = {e.split(";")[0].strip().lower() for e in (accept_encoding or "").split(",")}
+    if len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    if "zstd" in accepted and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(body), "zstd"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=5), "gzip"
+    return body, None
+
+def request_data() -> dict:
+    """The decoded body of the current Flask request (415 for formats this service cannot read)."""
+    content_type = (request.content_type or JSON).split(";")[0].strip().lower()
+    if content_type == MSGPACK and msgpack is None:
+        raise UnsupportedMediaType("MessagePack is not available in this service")
+    if content_type not in (JSON, MSGPACK):
+        raise UnsupportedMediaType(f"Unsupported Content-Type: {content_type}")
+    body = decompress(request.get_data(), request.headers.get("Content-Encoding"))
+    try:
+        return msgpack.unpackb(body, raw=False) if content_type == MSGPACK else json.loads(body)
+    except ValueError as e:
+        raise BadRequest(f"Invalid {content_type} body: {e}")
+
+def respond(payload: dict, status: int = 200) -> Response:
+    """Encode `payload` as MessagePack if the caller accepts it (JSON otherwise), compressed if accepted."""
+    if msgpack is not None and MSGPACK in request.headers.get("Accept", ""):
+        body, content_type = msgpack.packb(payload, default=_plain, use_bin_type=True), MSGPACK
+    else:
+        body, content_type = json.dumps(payload, default=_plain).encode("utf-8"), JSON
+    body, encoding = compress(body, request.headers.get("Accept-Encoding"))
+    response = Response(body, status=status, content_type=content_type)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept, Accept-Encoding"
+    return response